@@ -1,28 +1,55 @@
 # --- Main imports from Login System ---
 # --- Main imports from Login System ---
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, abort
 import os
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_
+from flask_migrate import Migrate
+from sqlalchemy import event, insert, or_, func
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
 import random
+import smtplib
+import socket
 import string
-from datetime import datetime, timedelta
+import hashlib
+import hmac
+import time
+import uuid
+from datetime import datetime, timedelta, timezone, time as dt_time
 from werkzeug.utils import secure_filename
-import fitz 
-from geopy.geocoders import Nominatim
 import json
-import requests
+import math
+import mimetypes
+import re
 from openai import OpenAI
 # --- Imports from Medical Advice App ---
 import pytesseract
-from PIL import Image
 from dotenv import load_dotenv
-import google.generativeai as genai # <-- KEEP ONLY ONE
 
 # --- Advanced Feature Imports (Mail, Scheduler) ---
 from flask_mail import Mail, Message
 from apscheduler.schedulers.background import BackgroundScheduler
+
+# --- Local Modules ---
+from availability import Schedule, SlotIndex
+from blobstore import BlobStore, LocalBackend, LocalObjectStoreClient, ObjectStoreBackend
+from exercises import EXERCISE_LIST, ExerciseImageCache, select_by_rules, selection_key
+from dispatch_log import DispatchLog
+from extraction import ExtractionEngine, is_extractable
+from geocoding import EARTH_RADIUS_KM, Gazetteer, ReverseGeocoder, distance_km, nominatim_provider
+from guides import GuideStore
+import integrity
+from jobs import JobQueue, QueueFullError
+from llm import FakeProvider, GeminiProvider, LLMGateway, OpenAIImageProvider
+import metrics
+from ocr import UnreadableImageError
+from pagination import InvalidCursorError, keyset_page, page_size
+from retrieval import RetrievalIndex
+from search_index import SearchIndex
+from semantic_cache import SemanticCache
+from text_cache import TextCache, file_sha256
+import tracing
 # --- App Configuration ---
 # ... (rest of your app.py file)
 
@@ -31,7 +58,8 @@ load_dotenv() # Load environment variables
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 try:
-    openai_client = OpenAI() # This automatically reads the OPENAI_API_KEY from your .env
+    # Reads OPENAI_API_KEY from your .env; retries are left to the image gateway (see llm.py)
+    openai_client = OpenAI(max_retries=0)
     print("OpenAI client configured successfully for DALL-E image generation.")
 except Exception as e:
     openai_client = None
@@ -49,6 +77,22 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 os.makedirs(UPLOAD_FOLDER, exist_ok=True) # Ensure the upload folder exists
 
+# --- Blob Storage Configuration ---
+# Patient documents are stored once per distinct content, under their SHA-256 (blobstore.py).
+# BLOB_BACKEND is 'local' (files under BLOB_STORE_PATH) or 'object' (an object store; for now the
+# local stand-in under OBJECT_STORE_PATH, with downloaded copies cached in BLOB_CACHE_PATH)
+app.config['BLOB_BACKEND'] = os.getenv('BLOB_BACKEND', 'local')
+app.config['BLOB_STORE_PATH'] = os.getenv('BLOB_STORE_PATH', os.path.join(UPLOAD_FOLDER, 'blobs'))
+app.config['OBJECT_STORE_PATH'] = os.getenv('OBJECT_STORE_PATH', 'object_store')
+app.config['BLOB_CACHE_PATH'] = os.getenv('BLOB_CACHE_PATH', os.path.join(UPLOAD_FOLDER, 'blob_cache'))
+if app.config['BLOB_BACKEND'] == 'object':
+    blob_backend = ObjectStoreBackend(LocalObjectStoreClient(app.config['OBJECT_STORE_PATH']), app.config['BLOB_CACHE_PATH'])
+    blob_temp_dir = os.path.join(app.config['BLOB_CACHE_PATH'], 'tmp')
+else:
+    blob_backend = LocalBackend(app.config['BLOB_STORE_PATH'])
+    blob_temp_dir = os.path.join(app.config['BLOB_STORE_PATH'], 'tmp') # Same filesystem, so blobs are moved into place
+blob_store = BlobStore(blob_backend, blob_temp_dir)
+
 # --- Tesseract Configuration (from Medical Advice App) ---
 # Make sure to adjust this path if yours is different
 try:
@@ -58,6 +102,135 @@ except Exception:
     print("WARNING: Tesseract not found at C:\\Program Files\\Tesseract-OCR\\tesseract.exe. OCR will fail.")
     print("Please install Tesseract OCR and/or update the path in app.py if you need OCR functionality.")
 
+# --- Text Extraction Configuration ---
+# PDF pages are extracted (and scanned pages OCR'd) in parallel across worker processes
+app.config['OCR_WORKERS'] = int(os.getenv('OCR_WORKERS', os.cpu_count() or 2))
+app.config['EXTRACTION_MAX_PAGES'] = int(os.getenv('EXTRACTION_MAX_PAGES', 200))
+# Deskew/threshold images and reject blurry or blank ones before Tesseract (ocr.py)
+app.config['OCR_PREPROCESS'] = os.getenv('OCR_PREPROCESS', 'true').lower() in ['true', '1', 't']
+extraction_engine = ExtractionEngine(
+    max_workers=app.config['OCR_WORKERS'],
+    max_pages=app.config['EXTRACTION_MAX_PAGES'],
+    tesseract_cmd=pytesseract.pytesseract.tesseract_cmd,
+    preprocess=app.config['OCR_PREPROCESS']
+)
+
+# --- Extracted Text Cache Configuration ---
+# OCR/PDF text is cached by the SHA-256 of the file, in memory and on disk next to the uploads folder
+TEXT_CACHE_FOLDER = "text_cache"
+app.config['TEXT_CACHE_MEMORY_BYTES'] = int(os.getenv('TEXT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+app.config['TEXT_CACHE_DISK_BYTES'] = int(os.getenv('TEXT_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+text_cache = TextCache(
+    TEXT_CACHE_FOLDER,
+    max_memory_bytes=app.config['TEXT_CACHE_MEMORY_BYTES'],
+    max_disk_bytes=app.config['TEXT_CACHE_DISK_BYTES']
+)
+
+# --- Document Question Context Configuration ---
+# A question about a document longer than DOCUMENT_CONTEXT_CHARS only gets the chunks most relevant to it
+# (retrieval.py), up to that many characters; shorter documents are sent whole. Chunk indexes are kept on disk.
+app.config['DOCUMENT_CONTEXT_CHARS'] = int(os.getenv('DOCUMENT_CONTEXT_CHARS', 6000))
+RETRIEVAL_INDEX_FOLDER = "retrieval_index"
+retrieval_index = RetrievalIndex(RETRIEVAL_INDEX_FOLDER)
+
+
+# --- First-Aid Guide Library Configuration ---
+# Guides for the emergency buttons are served from memory; refreshed versions are written to guide_cache/
+GUIDE_CACHE_FOLDER = "guide_cache"
+app.config['GUIDE_REFRESH_HOURS'] = int(os.getenv('GUIDE_REFRESH_HOURS', 24 * 7))
+app.config['GUIDE_RELOAD_SECONDS'] = int(os.getenv('GUIDE_RELOAD_SECONDS', 60)) # How soon other workers serve a refreshed guide
+app.config['GUIDE_MAX_AGE_SECONDS'] = 3600 # Browser Cache-Control for library guides
+guide_store = GuideStore(
+    os.path.join(app.root_path, 'data', 'first_aid_guides.json'),
+    os.path.join(GUIDE_CACHE_FOLDER, 'first_aid_guides.json')
+)
+
+# --- Chatbot Response Cache Configuration ---
+# Near-duplicate chatbot questions are answered from memory instead of calling Gemini again
+app.config['SEMANTIC_CACHE_THRESHOLD'] = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+app.config['SEMANTIC_CACHE_TTL_SECONDS'] = int(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', 24 * 3600))
+app.config['SEMANTIC_CACHE_MAX_ENTRIES'] = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 2000))
+chat_cache = SemanticCache(
+    threshold=app.config['SEMANTIC_CACHE_THRESHOLD'],
+    ttl_seconds=app.config['SEMANTIC_CACHE_TTL_SECONDS'],
+    max_entries=app.config['SEMANTIC_CACHE_MAX_ENTRIES']
+)
+
+# --- Slot Availability Configuration ---
+# Booked slots per doctor and day are cached as bitmaps (availability.py); entries are
+# re-read from the database after this long so other workers' bookings show up
+app.config['SLOT_INDEX_TTL_SECONDS'] = int(os.getenv('SLOT_INDEX_TTL_SECONDS', 60))
+
+# --- Pagination Configuration ---
+# Documents, records and appointments are listed a page at a time (pagination.py);
+# dashboards render the first page and fetch the rest from the /api/patients/... listings
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', 20))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', 100)) # Largest ?limit= accepted
+
+# --- Reverse Geocoding Configuration ---
+# Addresses for ambulance calls come from one shared Nominatim client, cached and rate-limited,
+# with the bundled gazetteer as the offline fallback (geocoding.py)
+app.config['GEOCODER_USER_AGENT'] = os.getenv('GEOCODER_USER_AGENT', 'anon_healthcare_app_v1')
+app.config['GEOCODE_TIMEOUT_SECONDS'] = float(os.getenv('GEOCODE_TIMEOUT_SECONDS', 3))
+app.config['GEOCODE_RATE_PER_SECOND'] = float(os.getenv('GEOCODE_RATE_PER_SECOND', 1)) # Nominatim's usage policy
+app.config['GEOCODE_CACHE_TTL_SECONDS'] = int(os.getenv('GEOCODE_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+app.config['GAZETTEER_PATH'] = os.getenv('GAZETTEER_PATH', os.path.join(app.root_path, 'data', 'gazetteer.csv'))
+try:
+    gazetteer = Gazetteer(app.config['GAZETTEER_PATH'])
+except Exception as e:
+    gazetteer = None
+    print(f"WARNING: Could not load the offline gazetteer. Error: {e}")
+geocoder = ReverseGeocoder(
+    nominatim_provider(app.config['GEOCODER_USER_AGENT']),
+    gazetteer,
+    ttl_seconds=app.config['GEOCODE_CACHE_TTL_SECONDS'],
+    rate_per_second=app.config['GEOCODE_RATE_PER_SECOND'],
+    timeout_seconds=app.config['GEOCODE_TIMEOUT_SECONDS']
+)
+
+# --- Dispatch Log Configuration ---
+# Ambulance calls are recorded as DispatchEvent rows and appended to a JSONL file,
+# buffered in memory and written in batches by a background thread (dispatch_log.py)
+app.config['DISPATCH_LOG_PATH'] = os.getenv('DISPATCH_LOG_PATH', os.path.join('logs', 'dispatch_events.jsonl'))
+app.config['DISPATCH_LOG_FLUSH_SECONDS'] = float(os.getenv('DISPATCH_LOG_FLUSH_SECONDS', 0.5))
+app.config['DISPATCH_OPEN_HOURS'] = int(os.getenv('DISPATCH_OPEN_HOURS', 6)) # Unclosed dispatches older than this aren't "open"
+
+# --- Background Job Queue Configuration ---
+# Document OCR + AI analysis runs outside the request thread; state is kept in the ProcessingJob table
+app.config['JOB_QUEUE_MAX_DEPTH'] = int(os.getenv('JOB_QUEUE_MAX_DEPTH', 50))
+app.config['LLM_WORKERS'] = int(os.getenv('LLM_WORKERS', 8))
+app.config['JOB_LONG_POLL_SECONDS'] = 5  # Maximum ?wait= accepted by /jobs/<id>; each waiting request holds a worker thread
+app.config['JOB_STALE_AFTER_MINUTES'] = 15  # 'running' jobs older than this are assumed lost on restart
+job_queue = JobQueue(max_depth=app.config['JOB_QUEUE_MAX_DEPTH'], workers=app.config['LLM_WORKERS'])
+
+# --- Metrics ---
+time_to_first_token = metrics.histogram(
+    'llm_time_to_first_token_seconds',
+    'Time from sending a streaming prompt to receiving its first chunk of text'
+)
+mail_messages_total = metrics.counter('mail_messages_total', 'Queued emails by delivery outcome (sent, retry, dead)')
+mail_batch_seconds = metrics.histogram('mail_batch_seconds', 'Time to deliver one batch of queued emails')
+mail_queue_delay_seconds = metrics.histogram(
+    'mail_queue_delay_seconds',
+    'Time from queueing an email to delivering it',
+    buckets=(1, 5, 10, 30, 60, 300, 900, 3600)
+)
+http_request_seconds = metrics.histogram(
+    'http_request_seconds',
+    'Time to handle a request, by endpoint (for streamed responses, until the response starts)',
+    buckets=metrics.LATENCY_BUCKETS
+)
+document_question_context_chars = metrics.histogram(
+    'document_question_context_chars', 'Document text sent with a question, by whether it was the full text or excerpts',
+    buckets=(1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+)
+http_requests_total = metrics.counter('http_requests_total', 'Requests handled, by endpoint, method and status')
+# Requests slower than this are logged with the time spent per dependency (sql, pdf, ocr, llm, smtp, geocode)
+app.config['SLOW_REQUEST_SECONDS'] = float(os.getenv('SLOW_REQUEST_SECONDS', 0)) # 0 turns the slow-request log off
+
+# --- Admin Configuration ---
+# Maintenance endpoints (e.g. /admin/analyses) accept requests carrying this token in X-Admin-Token
+app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN')
 
 # --- Database Configuration (MySQL) ---
 USER = 'root'
@@ -66,10 +239,36 @@ HOST = '127.0.0.1' # Use 127.0.0.1 for Windows development
 PORT = 3306
 DATABASE_NAME = 'hospital_db'
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE_NAME}'
+# DATABASE_URL overrides the MySQL settings above (e.g. sqlite:///dev.db for scripts and local runs)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'mysql+pymysql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE_NAME}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
+# Schema changes are Alembic migrations in migrations/; apply them with `flask db upgrade`
+migrate = Migrate(app, db, render_as_batch=True) # Batch mode lets ALTERs run on SQLite too
+with app.app_context():
+    tracing.instrument_sqlalchemy(db.engine) # Every query is an 'sql' span
+
+# --- Request Instrumentation ---
+@app.before_request
+def start_request_trace():
+    tracing.start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    trace = tracing.end_trace()
+    if trace is None:
+        return response
+    elapsed = trace.elapsed()
+    endpoint = request.endpoint or 'unmatched' # Raw paths of 404s would make a series per URL
+    http_request_seconds.observe(elapsed, endpoint=endpoint)
+    http_requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+
+    slow_after = app.config['SLOW_REQUEST_SECONDS']
+    if slow_after and elapsed >= slow_after:
+        print(f"Slow request: {request.method} {request.path} -> {response.status_code} "
+              f"in {elapsed:.3f}s ({trace.breakdown()})")
+    return response
 
 # --- Mail Config (Flask-Mail) ---
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
@@ -80,9 +279,46 @@ app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', app.config.get('MAIL_USERNAME'))
 mail = Mail(app)
 
+# --- Outbound Email Queue Configuration ---
+# Emails are rendered and stored in the OutboundEmail table, then delivered by a background job
+# over one SMTP connection per run, so requests never wait on the mail server
+app.config['MAIL_BATCH_SIZE'] = int(os.getenv('MAIL_BATCH_SIZE', 100))
+app.config['MAIL_POLL_SECONDS'] = int(os.getenv('MAIL_POLL_SECONDS', 10))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.getenv('MAIL_MAX_ATTEMPTS', 5)) # After this many failures the email is 'dead'
+app.config['MAIL_RETRY_BACKOFF_SECONDS'] = int(os.getenv('MAIL_RETRY_BACKOFF_SECONDS', 60)) # Doubles after each failure
+
 # --- APScheduler Config ---
+# Only periodic jobs run here. Anything that must survive a restart (e.g. reminders) is stored in
+# the database and picked up by one of these jobs.
 scheduler = BackgroundScheduler(timezone="UTC")
 scheduler.start()
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}" # Owner name for SchedulerLease rows
+
+# --- Appointment Reminder Configuration ---
+# A booked appointment's reminder is due REMINDER_LEAD_HOURS before it (Appointment.reminder_due_at).
+# Every process sweeps for due reminders, but only the one holding the 'reminders' lease sends them.
+app.config['REMINDER_LEAD_HOURS'] = int(os.getenv('REMINDER_LEAD_HOURS', 24))
+app.config['REMINDER_SWEEP_SECONDS'] = int(os.getenv('REMINDER_SWEEP_SECONDS', 60))
+app.config['REMINDER_BATCH_SIZE'] = int(os.getenv('REMINDER_BATCH_SIZE', 500)) # Reminders loaded and sent together
+app.config['SCHEDULER_LEASE_SECONDS'] = int(os.getenv('SCHEDULER_LEASE_SECONDS', 180)) # A dead leader is replaced after this
+
+# --- Document Integrity Ledger Configuration ---
+# Every uploaded document gets a hash-chained LedgerEntry; every LEDGER_BATCH_SECONDS the new entries
+# are sealed into a Merkle-tree LedgerBatch whose root is anchored with the notary (integrity.py)
+app.config['LEDGER_BATCH_SECONDS'] = int(os.getenv('LEDGER_BATCH_SECONDS', 60))
+app.config['LEDGER_MAX_BATCH'] = int(os.getenv('LEDGER_MAX_BATCH', 10000)) # Entries sealed under one root
+app.config['NOTARY_PATH'] = os.getenv('NOTARY_PATH', os.path.join('ledger', 'anchors.jsonl'))
+app.config['NOTARY_KEY_PATH'] = os.getenv('NOTARY_KEY_PATH', os.path.join('ledger', 'notary.key'))
+notary = integrity.LocalNotary(app.config['NOTARY_PATH'], app.config['NOTARY_KEY_PATH'])
+
+# --- Search Index Configuration ---
+# Document text and medical record notes are indexed in an SQLite FTS5 file (search_index.py) and
+# searched through /doctor/patient/<id>/search. New items are indexed every SEARCH_INDEX_SECONDS.
+app.config['SEARCH_INDEX_PATH'] = os.getenv('SEARCH_INDEX_PATH', os.path.join('search', 'index.sqlite3'))
+app.config['SEARCH_INDEX_SECONDS'] = int(os.getenv('SEARCH_INDEX_SECONDS', 30))
+app.config['SEARCH_INDEX_BATCH'] = int(os.getenv('SEARCH_INDEX_BATCH', 50)) # Documents per run; each may need OCR
+app.config['SEARCH_INDEX_RESCAN_IDS'] = int(os.getenv('SEARCH_INDEX_RESCAN_IDS', 1000)) # Ids below the watermark re-checked each run
+search_index = SearchIndex(app.config['SEARCH_INDEX_PATH'])
 
 # --- Database Models (No Changes Here) ---
 class Hospital(db.Model):
@@ -103,9 +339,17 @@ class Doctor(db.Model):
     password_hash = db.Column(db.String(200), nullable=False)
     specialization = db.Column(db.String(100))
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
+    # Bookable hours: appointments are slot_minutes long, starting from work_start
+    work_start = db.Column(db.Time, nullable=False, default=dt_time(9, 0), server_default='09:00:00')
+    work_end = db.Column(db.Time, nullable=False, default=dt_time(17, 0), server_default='17:00:00')
+    slot_minutes = db.Column(db.Integer, nullable=False, default=30, server_default='30')
     def set_password(self, password): self.password_hash = generate_password_hash(password)
     def check_password(self, password): return check_password_hash(self.password_hash, password)
 
+    @property
+    def schedule(self):
+        return Schedule(self.work_start, self.work_end, self.slot_minutes)
+
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -127,6 +371,9 @@ class PatientProfile(db.Model):
     gender = db.Column(db.String(10))
     medical_history = db.Column(db.Text, nullable=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    # Last exercise selection for this history (JSON list), and the selection_key() it was made for
+    exercise_selection = db.Column(db.Text, nullable=True)
+    exercise_selection_key = db.Column(db.String(64), nullable=True)
 
 # In app.py
 
@@ -136,6 +383,7 @@ class PatientDocument(db.Model):
     document_type = db.Column(db.String(50), nullable=False)
     upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    content_hash = db.Column(db.String(64), db.ForeignKey('blob.sha256', name='fk_patient_document_blob'), nullable=True) # The file's blob; None for older uploads
     
     # --- ADD THIS NEW COLUMN AND RELATIONSHIP ---
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=True) # Nullable = True, because patient can upload
@@ -143,15 +391,23 @@ class PatientDocument(db.Model):
     # --- END OF ADDITION ---
     
     patient = db.relationship('Patient', backref=db.backref('documents', lazy=True))
+
+    __table_args__ = (
+        db.Index('ix_patient_document_patient_upload', 'patient_id', 'upload_date'), # A patient's documents, newest first
+        db.Index('ix_patient_document_filename', 'filename'), # /uploads/<filename>
+    )
+
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_name = db.Column(db.String(100), nullable=False)
     patient_email = db.Column(db.String(120), nullable=False)
     patient_phone = db.Column(db.String(20), nullable=False)
-    appointment_date = db.Column(db.Date, nullable=False)
-    appointment_time = db.Column(db.String(10), nullable=False)
+    appointment_at = db.Column(db.DateTime, nullable=False, index=True) # Local date and time of the visit
     reason_for_visit = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), nullable=False, default='Booked')
+    # When the reminder email is due; cleared once it is sent or the appointment is cancelled
+    reminder_due_at = db.Column(db.DateTime, nullable=True, index=True)
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     # --- ADD THIS NEW COLUMN AND RELATIONSHIP ---
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
@@ -159,6 +415,43 @@ class Appointment(db.Model):
     # --- END OF ADDED COLUMN ---
     doctor = db.relationship('Doctor', backref='appointments')
 
+    __table_args__ = (
+        # Doctor dashboard: a doctor's appointments from today, in time order
+        db.Index('ix_appointment_doctor_at', 'doctor_id', 'appointment_at'),
+        # Patient dashboard: a patient's booked appointments from today (equality columns first, then the range)
+        db.Index('ix_appointment_patient_status_at', 'patient_id', 'status', 'appointment_at'),
+    )
+
+    # --- Compatibility accessors for the old separate date / 'HH:MM AM/PM' columns ---
+    @property
+    def appointment_date(self):
+        return self.appointment_at.date() if self.appointment_at else None
+
+    @appointment_date.setter
+    def appointment_date(self, value):
+        current_time = self.appointment_at.time() if self.appointment_at else datetime.min.time()
+        self.appointment_at = datetime.combine(value, current_time)
+
+    @property
+    def appointment_time(self):
+        return self.appointment_at.strftime(APPOINTMENT_TIME_FORMAT) if self.appointment_at else None
+
+    @appointment_time.setter
+    def appointment_time(self, value):
+        current_date = self.appointment_at.date() if self.appointment_at else datetime.utcnow().date()
+        self.appointment_at = datetime.combine(current_date, parse_appointment_time(value))
+
+APPOINTMENT_TIME_FORMAT = '%I:%M %p' # How appointment times are written in the booking form, e.g. '02:00 PM'
+
+def parse_appointment_time(value):
+    """Parses '02:00 PM' (or 24-hour '14:00') into a time."""
+    for time_format in (APPOINTMENT_TIME_FORMAT, '%H:%M'):
+        try:
+            return datetime.strptime(value.strip(), time_format).time()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised appointment time: {value!r}")
+
 class MedicalRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     record_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -175,6 +468,222 @@ class MedicalRecord(db.Model):
     patient = db.relationship('Patient', backref='medical_records')
     appointment = db.relationship('Appointment', backref=db.backref('medical_record', uselist=False))
 
+    __table_args__ = (
+        db.Index('ix_medical_record_patient_date', 'patient_id', 'record_date'), # A patient's history, newest first
+    )
+
+class SlotReservation(db.Model):
+    # One row per booked slot. The unique constraint is what stops two bookings taking the same slot;
+    # cancelling an appointment deletes its reservation so the slot can be booked again.
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    slot_at = db.Column(db.DateTime, nullable=False)
+    slot_minutes = db.Column(db.Integer, nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, unique=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'slot_at', name='uq_slot_reservation_doctor_slot'),
+    )
+
+class OutboundEmail(db.Model):
+    # The outbound mail queue. Rows stay 'queued' until delivered ('sent'), or become 'dead'
+    # after MAIL_MAX_ATTEMPTS failed attempts and are kept for inspection.
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False) # Rendered when the email is queued
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbound_email_status_next_attempt', 'status', 'next_attempt_at'), # The sender's "what is due" query
+    )
+
+class Blob(db.Model):
+    # A stored file (blobstore.py), shared by every PatientDocument with this content_hash.
+    # refcount is the number of documents using it; scripts/gc_blobs.py deletes blobs left at 0.
+    sha256 = db.Column(db.String(64), primary_key=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Last refcount change
+
+@event.listens_for(PatientDocument, 'after_delete')
+def release_document_blob(mapper, connection, document):
+    """Drops a deleted document's reference to its blob, in the same transaction."""
+    if document.content_hash:
+        connection.execute(
+            Blob.__table__.update()
+            .where(Blob.sha256 == document.content_hash)
+            .values(refcount=Blob.refcount - 1, updated_at=datetime.utcnow())
+        )
+
+class LedgerEntry(db.Model):
+    # The document integrity ledger: one row per uploaded document, chained through prev_hash.
+    # The hashed fields are never updated; batch_id and merkle_proof are filled in once, when the
+    # entry is sealed into a LedgerBatch. The unique prev_hash keeps the chain from forking.
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('patient_document.id'), nullable=False, index=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    prev_hash = db.Column(db.String(64), nullable=False)
+    entry_hash = db.Column(db.String(64), nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('ledger_batch.id'), nullable=True, index=True)
+    merkle_proof = db.Column(db.Text, nullable=True) # JSON [[side, sibling hash], ...] up to the batch's root
+
+    batch = db.relationship('LedgerBatch')
+
+    __table_args__ = (
+        db.UniqueConstraint('prev_hash', name='uq_ledger_entry_prev_hash'),
+        db.UniqueConstraint('entry_hash', name='uq_ledger_entry_entry_hash'),
+    )
+
+class LedgerBatch(db.Model):
+    # A Merkle tree over the entry hashes of consecutive ledger entries; its root is anchored with the notary
+    id = db.Column(db.Integer, primary_key=True)
+    merkle_root = db.Column(db.String(64), nullable=False)
+    entry_count = db.Column(db.Integer, nullable=False)
+    first_entry_id = db.Column(db.Integer, nullable=False)
+    last_entry_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    anchor_receipt = db.Column(db.Text, nullable=False) # JSON receipt from LocalNotary.anchor
+
+class DispatchEvent(db.Model):
+    # Append-only log of ambulance dispatches. A dispatch is 'requested', gets an 'address_resolved'
+    # event once its location has been geocoded, and stays open until a 'closed' event.
+    # Rows are inserted in batches by dispatch_log; they are never updated.
+    id = db.Column(db.Integer, primary_key=True)
+    dispatch_id = db.Column(db.String(32), nullable=False, index=True)
+    event_type = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    caller_name = db.Column(db.String(100), nullable=True)
+    caller_phone = db.Column(db.String(20), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    address = db.Column(db.Text, nullable=True)
+    address_source = db.Column(db.String(20), nullable=True) # 'provider', 'cache', 'gazetteer' or 'none'
+
+    __table_args__ = (
+        db.Index('ix_dispatch_event_type_location', 'event_type', 'latitude', 'longitude'), # Nearest-dispatch search
+    )
+
+class SchedulerLease(db.Model):
+    # Leader election for periodic jobs: the process whose lease hasn't expired runs the job,
+    # renewing the lease each time. If it dies, another process takes over once the lease expires.
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False) # PROCESS_ID of the holder
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class ProcessingJob(db.Model):
+    # A background document-processing job (OCR + AI analysis), polled through /jobs/<id>
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = db.Column(db.String(30), nullable=False) # 'upload_analysis' or 'document_analysis'
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, done, failed
+    filepath = db.Column(db.String(500), nullable=False)
+    result = db.Column(db.Text, nullable=True) # The analysis markdown once status is 'done'
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Owner of the job; both are empty for anonymous /upload jobs
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('patient_document.id'), nullable=True)
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+        if self.status == 'done':
+            data['result'] = self.result
+        elif self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+class DocumentAnalysis(db.Model):
+    # A stored AI analysis. It is only valid for the exact file contents, prompt version and model it was made with.
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('patient_document.id'), nullable=False, index=True)
+    content_hash = db.Column(db.String(64), nullable=False) # SHA-256 of the file bytes
+    prompt_version = db.Column(db.String(20), nullable=False)
+    model_name = db.Column(db.String(50), nullable=False)
+    analysis = db.Column(db.Text, nullable=False) # The generated markdown
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    document = db.relationship('PatientDocument', backref=db.backref('analyses', lazy=True, cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.UniqueConstraint('document_id', 'content_hash', 'prompt_version', 'model_name', name='uq_document_analysis_key'),
+    )
+
+# --- Query Layer ---
+# Queries used by the dashboards and notifications. Everything their templates walk
+# is loaded up front, so the number of SQL statements doesn't grow with the number of rows.
+
+def get_doctor_with_hospital(doctor_id):
+    return Doctor.query.options(joinedload(Doctor.hospital)).filter_by(id=doctor_id).first()
+
+def get_appointment_for_notification(appointment_id):
+    """An appointment with its doctor and hospital, as used by the confirmation and reminder emails."""
+    return Appointment.query.options(
+        joinedload(Appointment.doctor).joinedload(Doctor.hospital)
+    ).filter_by(id=appointment_id).first()
+
+def start_of_today():
+    return datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+def get_doctor_upcoming_appointments(doctor_id):
+    # The dashboard shows the patient_name/contact columns stored on the appointment, so no patient join
+    return Appointment.query.filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_at >= start_of_today()
+    ).order_by(Appointment.appointment_at).all()
+
+def count_doctor_medical_records(doctor_id):
+    return db.session.query(func.count(MedicalRecord.id)).filter(MedicalRecord.doctor_id == doctor_id).scalar()
+
+def get_patient_upcoming_appointments(patient_id, cursor=None, limit=None):
+    """One page of a patient's booked appointments from today, soonest first."""
+    query = Appointment.query.options(joinedload(Appointment.doctor)).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.appointment_at >= start_of_today(),
+        Appointment.status == 'Booked'
+    )
+    return keyset_page(query, Appointment.appointment_at, Appointment.id, cursor,
+                       limit or app.config['PAGE_SIZE'], descending=False)
+
+def load_booked_slots(doctor_id, day):
+    """[(slot start, length in minutes)] reserved for a doctor on a day; feeds the slot index."""
+    day_start = datetime.combine(day, dt_time.min)
+    return db.session.query(SlotReservation.slot_at, SlotReservation.slot_minutes).filter(
+        SlotReservation.doctor_id == doctor_id,
+        SlotReservation.slot_at >= day_start,
+        SlotReservation.slot_at < day_start + timedelta(days=1)
+    ).all()
+
+slot_index = SlotIndex(load_booked_slots, ttl_seconds=app.config['SLOT_INDEX_TTL_SECONDS'])
+
+def get_patient_with_profiles(patient_id):
+    return Patient.query.options(selectinload(Patient.profiles)).filter_by(id=patient_id).first()
+
+def get_patient_documents(patient_id, cursor=None, limit=None):
+    """One page of a patient's documents, newest first."""
+    query = PatientDocument.query.options(joinedload(PatientDocument.doctor)).filter_by(patient_id=patient_id)
+    return keyset_page(query, PatientDocument.upload_date, PatientDocument.id, cursor,
+                       limit or app.config['PAGE_SIZE'])
+
+def get_patient_medical_records(patient_id, cursor=None, limit=None):
+    """One page of a patient's medical records, newest first."""
+    query = MedicalRecord.query.options(joinedload(MedicalRecord.doctor)).filter_by(patient_id=patient_id)
+    return keyset_page(query, MedicalRecord.record_date, MedicalRecord.id, cursor,
+                       limit or app.config['PAGE_SIZE'])
+
 # --- MERGED ROUTES START HERE ---
 def generate_password(length=8):
     """Generates a random password."""
@@ -185,63 +694,343 @@ def generate_password(length=8):
 # 3. HELPER FUNCTIONS (Email, AI, Scheduling)
 # ====================================================================
 
-def send_email(to_email, subject, template, **kwargs):
-    """Helper to send emails."""
+# Email templates are compiled once, not looked up (and checked for changes) on every render
+EMAIL_TEMPLATES = {
+    name: app.jinja_env.get_template(name)
+    for name in ('emails/confirmation.html', 'emails/reminder.html')
+}
+
+def queue_emails(emails):
+    """Renders [(to_email, subject, template, template kwargs)] and queues them for deliver_queued_emails."""
     if not app.config.get('MAIL_SERVER'):
-        print(f"Mail not configured. Would send to {to_email} with subject '{subject}'")
+        for to_email, subject, _, _ in emails:
+            print(f"Mail not configured. Would send to {to_email} with subject '{subject}'")
         return
-    try:
-        msg = Message(subject, recipients=[to_email])
-        msg.html = render_template(template, **kwargs)
-        mail.send(msg)
-        print(f"Email sent to {to_email}")
-    except Exception as e:
-        print(f"Error sending email: {e}")
+    db.session.add_all([
+        OutboundEmail(to_email=to_email, subject=subject, html=EMAIL_TEMPLATES[template].render(**kwargs))
+        for to_email, subject, template, kwargs in emails
+    ])
+    db.session.commit()
+    wake_mail_sender()
 
-def schedule_appointment_reminders(appointment):
-    """Schedules email reminders for an appointment."""
-    try:
-        # Convert appointment time from 'HH:MM AM/PM' to a datetime object
-        appt_dt_str = f"{appointment.appointment_date} {appointment.appointment_time}"
-        appt_dt = datetime.strptime(appt_dt_str, '%Y-%m-%d %I:%M %p') # Use %I for 12-hour format
-        
-        # Schedule a reminder 24 hours before the appointment
-        reminder_time_24h = appt_dt - timedelta(hours=24)
-        if reminder_time_24h > datetime.now():
-            job_id = f'appt_{appointment.id}_reminder_24h'
-            scheduler.add_job(
-                func=send_email,
-                trigger='date',
-                run_date=reminder_time_24h,
-                args=[appointment.patient_email, 'Appointment Reminder', 'emails/reminder.html'],
-                kwargs={'appointment': appointment},
-                id=job_id,
-                replace_existing=True
-            )
-            print(f"Scheduled 24-hour reminder for appointment {appointment.id} at {reminder_time_24h}")
+def send_email(to_email, subject, template, **kwargs):
+    """Queues one email; it is delivered in the background."""
+    queue_emails([(to_email, subject, template, kwargs)])
+
+def wake_mail_sender():
+    """Runs the delivery job now rather than at its next poll (it only sends if this process holds the mail lease)."""
+    job = scheduler.get_job('deliver_queued_emails')
+    if job:
+        job.modify(next_run_time=datetime.now(timezone.utc))
+
+def next_email_batch():
+    return OutboundEmail.query.filter(
+        OutboundEmail.status == 'queued',
+        OutboundEmail.next_attempt_at <= datetime.utcnow()
+    ).order_by(OutboundEmail.next_attempt_at).limit(app.config['MAIL_BATCH_SIZE']).all()
+
+def record_email_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error)[:1000]
+    if email.attempts >= app.config['MAIL_MAX_ATTEMPTS']:
+        email.status = 'dead'
+        mail_messages_total.inc(outcome='dead')
+        print(f"Gave up on email {email.id} to {email.to_email} after {email.attempts} attempts: {error}")
+    else:
+        backoff = app.config['MAIL_RETRY_BACKOFF_SECONDS'] * 2 ** (email.attempts - 1)
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+        mail_messages_total.inc(outcome='retry')
 
-    except Exception as e:
-        print(f"Error scheduling reminder for appointment {appointment.id}: {e}")
+def deliver_queued_emails():
+    """
+    Scheduled job: delivers the queued emails that are due, MAIL_BATCH_SIZE at a time, over one
+    SMTP connection that stays open while there is more to send. Only the holder of the 'mail'
+    lease sends. A crash mid-batch can deliver an email twice but never loses one.
+    """
+    with app.app_context():
+        try:
+            if not acquire_lease('mail', app.config['SCHEDULER_LEASE_SECONDS']):
+                return
+            batch = next_email_batch()
+            if not batch:
+                return
+
+            handled = set() # IDs in the current batch that were delivered or refused
+            try:
+                with mail.connect() as connection:
+                    while batch:
+                        started = time.monotonic()
+                        for email in batch:
+                            msg = Message(email.subject, recipients=[email.to_email], html=email.html)
+                            try:
+                                with tracing.span('smtp'):
+                                    connection.send(msg)
+                            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                                record_email_failure(email, e) # This message was refused; the connection is still usable
+                                handled.add(email.id)
+                                continue
+                            handled.add(email.id)
+                            email.status = 'sent'
+                            email.sent_at = datetime.utcnow()
+                            mail_messages_total.inc(outcome='sent')
+                            mail_queue_delay_seconds.observe((email.sent_at - email.created_at).total_seconds())
+                        db.session.commit()
+                        mail_batch_seconds.observe(time.monotonic() - started)
+
+                        if not acquire_lease('mail', app.config['SCHEDULER_LEASE_SECONDS']):
+                            break
+                        handled.clear()
+                        batch = next_email_batch()
+            except (smtplib.SMTPException, OSError) as e:
+                # Could not connect, or the connection dropped: everything in this batch that wasn't
+                # delivered or refused counts as a failed attempt
+                print(f"Error delivering queued emails: {e}")
+                for email in batch:
+                    if email.id not in handled:
+                        record_email_failure(email, e)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error in the email delivery job: {e}")
+
+scheduler.add_job(
+    func=deliver_queued_emails,
+    trigger='interval',
+    seconds=app.config['MAIL_POLL_SECONDS'],
+    id='deliver_queued_emails',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+def reminder_due_time(appointment_at):
+    """When the reminder for an appointment at this (local) time is due, or None if that has already passed."""
+    due_at = appointment_at - timedelta(hours=app.config['REMINDER_LEAD_HOURS'])
+    return due_at if due_at > datetime.now() else None
+
+def acquire_lease(name, seconds):
+    """Takes or renews the named SchedulerLease for this process. Returns True if this process holds it."""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=seconds)
+    renewed = SchedulerLease.query.filter(
+        SchedulerLease.name == name,
+        or_(SchedulerLease.owner == PROCESS_ID, SchedulerLease.expires_at < now)
+    ).update({'owner': PROCESS_ID, 'expires_at': expires_at}, synchronize_session=False)
+    if renewed:
+        db.session.commit()
+        return True
 
-def cancel_scheduled_reminders(appointment_id):
-    """Removes any scheduled jobs for a given appointment ID."""
-    job_id = f'appt_{appointment_id}_reminder_24h'
+    # No row yet, or another process holds it; only one process can insert the row
+    db.session.rollback()
+    if db.session.get(SchedulerLease, name):
+        return False
+    db.session.add(SchedulerLease(name=name, owner=PROCESS_ID, expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+def send_reminder_batch(appointment_ids):
+    """Queues the reminders for these appointments (IDs, loaded here with everything the template needs)."""
+    appointments = Appointment.query.options(
+        joinedload(Appointment.doctor).joinedload(Doctor.hospital)
+    ).filter(Appointment.id.in_(appointment_ids), Appointment.status == 'Booked').all()
+    queue_emails([
+        (appointment.patient_email, 'Appointment Reminder', 'emails/reminder.html', {'appointment': appointment})
+        for appointment in appointments
+    ])
+
+def send_due_reminders():
+    """
+    Scheduled job: sends every reminder that is due, REMINDER_BATCH_SIZE at a time.
+    Reminders are claimed (reminder_due_at cleared) before they are sent, so a crash
+    mid-batch can lose a reminder but never send one twice.
+    """
+    with app.app_context():
+        try:
+            while acquire_lease('reminders', app.config['SCHEDULER_LEASE_SECONDS']):
+                due_ids = [row.id for row in db.session.query(Appointment.id).filter(
+                    Appointment.reminder_due_at <= datetime.now()
+                ).order_by(Appointment.reminder_due_at).limit(app.config['REMINDER_BATCH_SIZE'])]
+                if not due_ids:
+                    break
+
+                claimed = Appointment.query.filter(
+                    Appointment.id.in_(due_ids), Appointment.reminder_due_at.isnot(None)
+                ).update({'reminder_due_at': None, 'reminder_sent_at': datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+                print(f"Sending {claimed} due appointment reminders.")
+                send_reminder_batch(due_ids)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error sending appointment reminders: {e}")
+
+scheduler.add_job(
+    func=send_due_reminders,
+    trigger='interval',
+    seconds=app.config['REMINDER_SWEEP_SECONDS'],
+    id='send_due_reminders',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+LEDGER_APPEND_ATTEMPTS = 5
+
+def record_document_in_ledger(document):
+    """
+    Appends the ledger entry for a committed document (with content_hash set), chained to the
+    current last entry. Concurrent uploads race for the same prev_hash; the loser retries.
+    The upload stands if this fails; /verify then reports the document as not in the ledger.
+    """
+    created_at = datetime.utcnow().replace(microsecond=0) # Part of the hash, so stored exactly (MySQL drops microseconds)
     try:
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-            print(f"Removed scheduled reminders for cancelled appointment {appointment_id}")
+        for _ in range(LEDGER_APPEND_ATTEMPTS):
+            last = LedgerEntry.query.order_by(LedgerEntry.id.desc()).with_for_update().first()
+            prev_hash = last.entry_hash if last else integrity.GENESIS_HASH
+            entry = LedgerEntry(
+                document_id=document.id,
+                content_hash=document.content_hash,
+                created_at=created_at,
+                prev_hash=prev_hash,
+                entry_hash=integrity.entry_hash(prev_hash, document.id, document.content_hash, created_at)
+            )
+            db.session.add(entry)
+            try:
+                db.session.commit()
+                return entry
+            except IntegrityError:
+                db.session.rollback()
+        print(f"Could not append a ledger entry for document {document.id}: the chain kept moving.")
     except Exception as e:
-        print(f"Could not remove job {job_id}. It may have already run or not existed. Error: {e}")
+        db.session.rollback()
+        print(f"Could not append a ledger entry for document {document.id}: {e}")
+    return None
 
-def get_ai_analysis(extracted_text: str) -> str:
+def seal_ledger_batch():
     """
-    Takes extracted text and returns an AI-generated summary using the configured Gemini model.
-    Raises an exception if the model is not configured or fails.
+    Scheduled job: seals the ledger entries that aren't in a batch yet (oldest first, up to
+    LEDGER_MAX_BATCH) into a Merkle tree, anchors its root with the notary, and stores each
+    entry's inclusion proof. Only the holder of the 'ledger' lease seals.
     """
-    if not gemini_model:
-        raise Exception("AI analysis service is not configured.")
+    with app.app_context():
+        try:
+            if not acquire_lease('ledger', app.config['SCHEDULER_LEASE_SECONDS']):
+                return
+            entries = (LedgerEntry.query.filter(LedgerEntry.batch_id.is_(None))
+                       .order_by(LedgerEntry.id).limit(app.config['LEDGER_MAX_BATCH']).all())
+            if not entries:
+                return
+
+            root, proofs = integrity.merkle_tree([entry.entry_hash for entry in entries])
+            receipt = notary.anchor(root)
+            batch = LedgerBatch(
+                merkle_root=root,
+                entry_count=len(entries),
+                first_entry_id=entries[0].id,
+                last_entry_id=entries[-1].id,
+                anchor_receipt=json.dumps(receipt)
+            )
+            db.session.add(batch)
+            db.session.flush()
+            for entry, proof in zip(entries, proofs):
+                entry.batch_id = batch.id
+                entry.merkle_proof = json.dumps(proof)
+            db.session.commit()
+            print(f"Sealed {len(entries)} ledger entries into batch {batch.id} (root {root[:16]}..., "
+                  f"notary height {receipt['height']}).")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error sealing ledger batch: {e}")
+
+scheduler.add_job(
+    func=seal_ledger_batch,
+    trigger='interval',
+    seconds=app.config['LEDGER_BATCH_SECONDS'],
+    id='seal_ledger_batch',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+def index_medical_record(record):
+    body = "\n".join(filter(None, [record.notes, record.prescription]))
+    search_index.add('record', record.id, record.patient_id, f"Consultation with Dr. {record.doctor.name}",
+                     body, record.record_date)
+
+def index_document(doc):
+    """Indexes a document's text, extracting it first if it was never read (served from the text cache otherwise)."""
+    text = ""
+    if is_extractable(doc.filename):
+        try:
+            text = get_document_text(document_path(doc))
+        except Exception as e:
+            # Unreadable scans, corrupt PDFs, missing files: still searchable by type and name,
+            # and the text will not get any better by retrying
+            print(f"Indexing document {doc.id} without its text: {e}")
+    search_index.add('document', doc.id, doc.patient_id, f"{doc.document_type}: {doc.filename.split('_', 2)[-1]}",
+                     text, doc.upload_date)
 
-    prompt = f"""
+def unindexed_ids(kind, model):
+    """
+    Ids of `model` rows that are not in the search index yet, oldest first. Besides the ids past the
+    watermark, the last SEARCH_INDEX_RESCAN_IDS below it are checked again: ids are handed out when a
+    row is inserted, not when it is committed, so on MySQL a slow transaction can commit a lower id
+    after the job has moved past it.
+    """
+    after_id = search_index.watermark(kind) - app.config['SEARCH_INDEX_RESCAN_IDS']
+    indexed = search_index.indexed_ids(kind, after_id)
+    ids = db.session.query(model.id).filter(model.id > after_id).order_by(model.id)
+    return [row_id for (row_id,) in ids if row_id not in indexed]
+
+def update_search_index():
+    """
+    Scheduled job: indexes the medical records and documents that are not in the index yet (see
+    unindexed_ids). The index is a file on this machine, so every machine runs this job for itself
+    (no lease); processes sharing the file only repeat each other's idempotent writes.
+    """
+    with app.app_context():
+        try:
+            record_ids = unindexed_ids('record', MedicalRecord)[:app.config['SEARCH_INDEX_BATCH'] * 10]
+            records = (MedicalRecord.query.options(joinedload(MedicalRecord.doctor))
+                       .filter(MedicalRecord.id.in_(record_ids)).order_by(MedicalRecord.id).all()) if record_ids else []
+            for record in records:
+                index_medical_record(record)
+            if records:
+                search_index.set_watermark('record', records[-1].id)
+
+            document_ids = unindexed_ids('document', PatientDocument)[:app.config['SEARCH_INDEX_BATCH']]
+            documents = (PatientDocument.query.filter(PatientDocument.id.in_(document_ids))
+                         .order_by(PatientDocument.id).all()) if document_ids else []
+            for doc in documents:
+                index_document(doc)
+                search_index.set_watermark('document', doc.id)
+            if records or documents:
+                print(f"Search index: {len(records)} medical records and {len(documents)} documents indexed.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error updating the search index: {e}")
+
+scheduler.add_job(
+    func=update_search_index,
+    trigger='interval',
+    seconds=app.config['SEARCH_INDEX_SECONDS'],
+    id='update_search_index',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+def get_document_text(filepath: str) -> str:
+    """
+    Returns the extracted text of a PDF or image.
+    The text is cached by file content, so each document is only parsed/OCR'd once.
+    """
+    return text_cache.get_or_extract(filepath, extraction_engine.extract)
+
+ANALYSIS_PROMPT_TEMPLATE = """
     You are a helpful medical assistant. Your role is to analyze a medical document for a patient and explain it in simple, easy-to-understand language. Do not provide a direct diagnosis. Use clean Markdown for formatting with headings and bullet points.
 
     Based on the following document text, provide a summary with these exact sections:
@@ -263,14 +1052,238 @@ def get_ai_analysis(extracted_text: str) -> str:
     {extracted_text}
     ---
     """
+# Stored analyses are tied to this version, so editing the prompt above makes them regenerate
+ANALYSIS_PROMPT_VERSION = hashlib.sha256(ANALYSIS_PROMPT_TEMPLATE.encode('utf-8')).hexdigest()[:12]
+
+def get_ai_analysis(extracted_text: str) -> str:
+    """
+    Takes extracted text and returns an AI-generated summary using the configured Gemini model.
+    Raises LLMError if the model is not configured or fails.
+    """
+    prompt = ANALYSIS_PROMPT_TEMPLATE.format(extracted_text=extracted_text)
+    return llm.generate(prompt, 'analysis')
+
+def get_stored_analysis(document_id, content_hash):
+    """Returns the stored analysis for this exact document content, prompt version and model, or None."""
+    return DocumentAnalysis.query.filter_by(
+        document_id=document_id,
+        content_hash=content_hash,
+        prompt_version=ANALYSIS_PROMPT_VERSION,
+        model_name=llm.model_name
+    ).first()
+
+def store_analysis(document_id, content_hash, analysis):
+    """Saves a freshly generated analysis, replacing any outdated ones for the document."""
+    try:
+        DocumentAnalysis.query.filter_by(document_id=document_id).delete()
+        db.session.add(DocumentAnalysis(
+            document_id=document_id,
+            content_hash=content_hash,
+            prompt_version=ANALYSIS_PROMPT_VERSION,
+            model_name=llm.model_name,
+            analysis=analysis
+        ))
+        db.session.commit()
+    except Exception as e:
+        # Another worker stored the same analysis first; theirs is just as good
+        db.session.rollback()
+        print(f"Could not store analysis for document {document_id}: {e}")
+
+def sse_event(payload, event=None, event_id=None):
+    """Formats one Server-Sent Event carrying a JSON payload."""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    prefix += f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+def stream_ai_response(prompt, endpoint, error_message, on_complete=None):
+    """
+    Streams a Gemini completion to the browser as Server-Sent Events:
+    a `data: {"text": ...}` event per chunk, then `event: done` (or `event: error`).
+    Records the time to the first chunk, which is the latency the user actually feels.
+    If given, `on_complete` is called with the full text once the stream finishes successfully.
+    """
+    def generate():
+        started = time.monotonic()
+        first_chunk = True
+        parts = []
+        try:
+            for text in llm.stream(prompt, endpoint):
+                if first_chunk:
+                    time_to_first_token.observe(time.monotonic() - started, endpoint=endpoint)
+                    first_chunk = False
+                parts.append(text)
+                yield sse_event({"text": text})
+            if on_complete and parts:
+                on_complete("".join(parts).strip())
+            yield sse_event({}, event='done')
+        except Exception as e:
+            print(f"Streaming Error ({endpoint}): {e}")
+            yield sse_event({"error": error_message}, event='error')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # Stop proxies from buffering the stream
+    )
+
+def cached_stream_response(text):
+    """Sends an already known answer in the same SSE format as stream_ai_response."""
+    def generate():
+        yield sse_event({"text": text})
+        yield sse_event({}, event='done')
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Cache': 'HIT'})
+
+def cache_bypassed():
+    """True if the client asked for a fresh answer (X-Cache-Bypass: 1 or Cache-Control: no-cache)."""
+    return (request.headers.get('X-Cache-Bypass', '').lower() in ['1', 'true']
+            or 'no-cache' in request.headers.get('Cache-Control', '').lower())
+
+def is_admin_request():
+    """True for requests carrying the configured admin token (or any request in debug mode)."""
+    if app.debug:
+        return True
+    token = app.config.get('ADMIN_TOKEN')
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied, token)
     
-    response = gemini_model.generate_content(prompt)
-    
-    if response and response.candidates:
-        return response.candidates[0].content.parts[0].text.strip()
-    else:
-        raise Exception("Could not get a valid analysis from the AI model.")
-    
+# ====================================================================
+# BACKGROUND DOCUMENT JOBS
+# ====================================================================
+
+def enqueue_analysis_job(kind, filepath, patient_id=None, document_id=None):
+    """
+    Records a new ProcessingJob and hands it to the job queue.
+    Raises QueueFullError (and records nothing) if the queue is full.
+    """
+    job = ProcessingJob(kind=kind, filepath=filepath, patient_id=patient_id, document_id=document_id)
+    db.session.add(job)
+    db.session.commit() # The worker must be able to see the row before it starts
+
+    try:
+        job_queue.submit(job.id, run_analysis_job, job.id)
+    except QueueFullError:
+        db.session.delete(job)
+        db.session.commit()
+        raise
+    return job
+
+def remove_upload(filepath):
+    """Deletes a temporary upload, if it is still there."""
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove upload {filepath}: {e}")
+
+def run_analysis_job(job_id):
+    """Worker body: extracts the document text (OCR in the process pool) and asks the AI for an analysis."""
+    with app.app_context():
+        # Atomically claim the job so two processes resuming after a restart can't both run it
+        claimed = ProcessingJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'updated_at': datetime.utcnow()}
+        )
+        db.session.commit()
+        if not claimed:
+            return
+
+        job = db.session.get(ProcessingJob, job_id)
+        try:
+            content_hash = file_sha256(job.filepath)
+            extracted_text = get_document_text(job.filepath)
+            if extracted_text.strip():
+                job.result = get_ai_analysis(extracted_text)
+            else:
+                job.result = "Could not find any text in the document."
+            job.status = 'done'
+        except UnreadableImageError as e:
+            # Not a failure of ours: tell the patient what to fix instead of retrying
+            extracted_text = ""
+            job.result = f"Could not read the image: {e}. Please upload a sharper, well-lit photo of the document."
+            job.status = 'done'
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        db.session.commit()
+        if job.kind == 'upload_analysis':
+            remove_upload(job.filepath) # The file was only uploaded to be analysed
+
+        # Keep the analysis so the next "Analyze" click doesn't call the AI again
+        if job.status == 'done' and job.document_id and extracted_text.strip():
+            store_analysis(job.document_id, content_hash, job.result)
+            # Questions usually follow an analysis; chunk and index a long document now rather than on the first one
+            if len(extracted_text) > app.config['DOCUMENT_CONTEXT_CHARS']:
+                try:
+                    retrieval_index.get(extracted_text)
+                except Exception as e:
+                    print(f"Could not index document {job.document_id} for questions: {e}")
+
+def resume_pending_jobs():
+    """Re-queues jobs that were accepted but not finished before the last shutdown."""
+    stale_before = datetime.utcnow() - timedelta(minutes=app.config['JOB_STALE_AFTER_MINUTES'])
+    ProcessingJob.query.filter(
+        ProcessingJob.status == 'running',
+        ProcessingJob.updated_at < stale_before
+    ).update({'status': 'queued'})
+    db.session.commit()
+
+    pending = ProcessingJob.query.filter_by(status='queued').order_by(ProcessingJob.created_at).all()
+    for job in pending:
+        job_queue.submit(job.id, run_analysis_job, job.id, force=True)
+    if pending:
+        print(f"Resumed {len(pending)} pending document jobs.")
+
+def queue_full_response():
+    """The 429 returned when the job queue can't take more work."""
+    response = jsonify({"error": "The server is busy processing other documents. Please try again shortly."})
+    response.headers['Retry-After'] = '10'
+    return response, 429
+
+def can_view_job(job):
+    """
+    Anonymous /upload jobs are readable by anyone holding their unguessable id; a patient's
+    jobs only by whoever may see that patient's records (can_view_patient checks the user type,
+    since doctor and patient ids come from different tables).
+    """
+    if job is None:
+        return False
+    return job.patient_id is None or can_view_patient(job.patient_id)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Returns the status of a background job. Pass ?wait=<seconds> to long-poll:
+    the request is held until the job finishes or the wait runs out.
+    """
+    job = db.session.get(ProcessingJob, job_id)
+    if not can_view_job(job):
+        return jsonify({"error": "Job not found."}), 404
+
+    wait = min(request.args.get('wait', 0, type=float), app.config['JOB_LONG_POLL_SECONDS'])
+    deadline = time.monotonic() + wait
+    while job.status in ('queued', 'running') and time.monotonic() < deadline:
+        # End the read transaction: under REPEATABLE READ a refresh inside it would keep seeing the old row
+        db.session.rollback()
+        time.sleep(0.5)
+        db.session.refresh(job)
+
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Returns just the analysis of a finished job (202 while it is still pending)."""
+    job = db.session.get(ProcessingJob, job_id)
+    if not can_view_job(job):
+        return jsonify({"error": "Job not found."}), 404
+
+    if job.status == 'done':
+        return jsonify({"analysis": job.result})
+    if job.status == 'failed':
+        return jsonify({"error": f"An error occurred during analysis: {job.error}"}), 500
+    return jsonify(job.to_dict()), 202
+
 # --- Routes for the Medical Advice / Main Landing Page ---
 @app.route('/')
 def index():
@@ -301,35 +1314,65 @@ def upload_file():
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({"error": "No selected file or file type not allowed."}), 400
 
-    analysis_response = "" # Initialize variable outside the try block
+    filename = secure_filename(file.filename)
+    if not is_extractable(filename):
+        # Use the "analysis" key for consistency
+        return jsonify({"analysis": "Could not find any text in the document."})
 
+    # A name of our own, so concurrent uploads of "report.pdf" can't overwrite each other; run_analysis_job deletes it
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"upload_{uuid.uuid4().hex}{os.path.splitext(filename)[1]}")
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
         file.save(filepath)
-        
-        extracted_text = ""
-        if filename.lower().endswith('.pdf'):
-            with fitz.open(filepath) as pdf_doc:
-                for page in pdf_doc:
-                    extracted_text += page.get_text()
-        elif filename.lower().split('.')[-1] in ['png', 'jpg', 'jpeg']:
-            image = Image.open(filepath)
-            extracted_text = pytesseract.image_to_string(image)
-        
-        if not extracted_text.strip():
-            # Use the "analysis" key for consistency
-            return jsonify({"analysis": "Could not find any text in the document."})
-        
-        # Call the helper function and store the result
-        analysis_response = get_ai_analysis(extracted_text)
-        
+
+        # OCR and AI analysis happen in the background; the page polls /jobs/<id>
+        job = enqueue_analysis_job('upload_analysis', filepath)
+
+    except QueueFullError:
+        db.session.rollback()
+        remove_upload(filepath)
+        return queue_full_response()
     except Exception as e:
+        db.session.rollback()
+        remove_upload(filepath)
         print(f"Error in /upload route: {e}")
         return jsonify({"error": str(e)}), 500
 
-    # Return the successful response OUTSIDE the try...except block
-    return jsonify({"analysis": analysis_response})
+    return jsonify({"job_id": job.id, "status_url": url_for('job_status', job_id=job.id)}), 202
+
+def store_document_file(file):
+    """
+    Streams an uploaded file into the blob store and takes a reference on its Blob row.
+    Returns the content hash for PatientDocument.content_hash. The reference is committed
+    here, so if the document is then not saved the blob is only kept longer than needed.
+    The bytes are stored after the reference is committed (see blobstore.py): if the
+    garbage collector was deleting this blob meanwhile, they are written again.
+    """
+    with blob_store.stage(file.stream) as staged:
+        content_hash = staged.sha256
+        for _ in range(2):
+            if Blob.query.filter_by(sha256=content_hash).update(
+                    {'refcount': Blob.refcount + 1, 'updated_at': datetime.utcnow()}, synchronize_session=False):
+                db.session.commit()
+                break
+            db.session.add(Blob(sha256=content_hash, refcount=1))
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback() # The same file was uploaded at the same moment; take a reference on its row
+        else:
+            raise RuntimeError(f"Could not record blob {content_hash}.")
+        staged.store()
+    return content_hash
+
+def document_path(doc):
+    """Path of a document's file: its blob, or the file in UPLOAD_FOLDER for documents stored before blobs."""
+    if doc.content_hash:
+        try:
+            return blob_store.local_path(doc.content_hash)
+        except FileNotFoundError:
+            pass # Not imported into the blob store yet (scripts/import_uploads.py)
+    return os.path.join(app.config['UPLOAD_FOLDER'], doc.filename)
 
 @app.route('/upload_document', methods=['POST'])
 def upload_document():
@@ -353,16 +1396,18 @@ def upload_document():
         # To make filenames unique, prepend the patient ID and a timestamp
         unique_filename = f"{session['user_id']}_{int(datetime.now().timestamp())}_{filename}"
         
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+        content_hash = store_document_file(file)
         
         # Save file info to the database
         new_document = PatientDocument(
             filename=unique_filename,
             document_type=doc_type,
-            patient_id=session['user_id']
+            patient_id=session['user_id'],
+            content_hash=content_hash
         )
         db.session.add(new_document)
         db.session.commit()
+        record_document_in_ledger(new_document)
         
         flash('Document uploaded successfully!', 'success')
     else:
@@ -388,6 +1433,25 @@ def get_doctors_for_hospital(hospital_id):
     
     return jsonify(doctors=doctor_list)
 
+@app.route('/api/doctors/<int:doctor_id>/slots')
+def get_doctor_slots(doctor_id):
+    """Lists a doctor's slots for ?date=YYYY-MM-DD and whether each one can still be booked."""
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"error": "Pass the day as ?date=YYYY-MM-DD."}), 400
+
+    doctor = db.session.get(Doctor, doctor_id)
+    if not doctor:
+        return jsonify({"error": "Doctor not found."}), 404
+
+    now = datetime.now()
+    slots = [
+        {"time": start.strftime(APPOINTMENT_TIME_FORMAT), "available": free and start > now}
+        for start, free in slot_index.slots(doctor_id, day, doctor.schedule)
+    ]
+    return jsonify({"doctor_id": doctor_id, "date": day.isoformat(), "slot_minutes": doctor.slot_minutes, "slots": slots})
+
 
 # --- ADD this new route to your app.py ---
 # This route handles the form submission
@@ -401,8 +1465,8 @@ def book_appointment():
     """
     Handles the multi-step appointment booking form.
     - Creates a new patient account if one doesn't exist.
-    - Creates the appointment record.
-    - Sends an immediate email confirmation.
+    - Creates the appointment record and reserves its slot (409 if the slot is taken).
+    - Queues an email confirmation.
     - Schedules a future email reminder.
     """
     try:
@@ -439,36 +1503,57 @@ def book_appointment():
             )
             db.session.add(profile)
 
-        # Step 2: Create the Appointment
+        # Step 2: Check the requested slot is one of the doctor's bookable slots
+        doctor = db.session.get(Doctor, data['doctorId'])
+        if not doctor:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Please choose a doctor.'}), 400
+        slot_at = datetime.combine(datetime.strptime(data['date'], '%Y-%m-%d').date(), parse_appointment_time(data['time']))
+        if (slot_at, True) not in slot_index.slots(doctor.id, slot_at.date(), doctor.schedule) or slot_at <= datetime.now():
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'That time is not available. Please choose another slot.'}), 409
+
+        # Step 3: Create the Appointment together with its slot reservation
         new_appointment = Appointment(
             patient_name=f"{data['firstName']} {data.get('lastName', '')}",
             patient_email=email,
             patient_phone=phone,
-            appointment_date=datetime.strptime(data['date'], '%Y-%m-%d').date(),
-            appointment_time=data['time'], # Assumes format like '02:00 PM'
+            appointment_at=slot_at,
             reason_for_visit=data.get('reason', ''),
+            reminder_due_at=reminder_due_time(slot_at), # Sent by send_due_reminders
             doctor_id=data['doctorId'],
             patient_id=patient.id
         )
         db.session.add(new_appointment)
-        db.session.commit()  # Commit to get the final new_appointment.id
-
-        # Step 3: Trigger Notifications
+        db.session.flush()
+        db.session.add(SlotReservation(
+            doctor_id=doctor.id, slot_at=slot_at, slot_minutes=doctor.slot_minutes, appointment_id=new_appointment.id
+        ))
+        try:
+            db.session.commit()  # Commit to get the final new_appointment.id
+        except IntegrityError:
+            # Someone else reserved the same slot between our check and the commit
+            db.session.rollback()
+            slot_index.invalidate(doctor.id, slot_at.date())
+            return jsonify({'success': False, 'message': 'Sorry, that slot was just booked. Please choose another time.'}), 409
+        slot_index.mark_booked(doctor.id, slot_at, doctor.slot_minutes)
+
+        # Step 4: Trigger Notifications
         # We run this in a try-except so a notification failure doesn't break the booking
         try:
-            # Send immediate email confirmation
+            # Reload with the doctor and hospital the email templates need, in one query
+            new_appointment = get_appointment_for_notification(new_appointment.id)
+            # Queue the email confirmation; it is delivered in the background
             send_email(
                 to_email=new_appointment.patient_email,
                 subject=f"Appointment Confirmed at {new_appointment.doctor.hospital.name}",
                 template='emails/confirmation.html',
                 appointment=new_appointment
             )
-            # Schedule a reminder for the future
-            schedule_appointment_reminders(new_appointment)
         except Exception as e:
             print(f"NOTIFICATION ERROR for appt {new_appointment.id}: {e}")
 
-        # Step 4: Send Success Response to Frontend
+        # Step 5: Send Success Response to Frontend
         response_data = {
             'success': True, 
             'message': 'Appointment booked successfully! A confirmation email has been sent.',
@@ -487,7 +1572,8 @@ def cancel_appointment(appt_id):
     """
     Handles a patient's request to cancel an appointment.
     - Updates the appointment status to 'Cancelled'.
-    - Removes any pending scheduled reminders for that appointment.
+    - Drops its pending reminder.
+    - Releases the appointment's slot.
     """
     # Security: Ensure a patient is logged in
     if 'user_id' not in session or session.get('user_type') != 'patient':
@@ -504,10 +1590,17 @@ def cancel_appointment(appt_id):
         # Step 1: Update the appointment status
         appointment_to_cancel.status = 'Cancelled'
         
-        # Step 2: Cancel any scheduled reminders for this appointment
-        cancel_scheduled_reminders(appointment_to_cancel.id)
+        # Step 2: Drop its pending reminder
+        appointment_to_cancel.reminder_due_at = None
+
+        # Step 3: Release the slot so it can be booked again
+        reservation = SlotReservation.query.filter_by(appointment_id=appointment_to_cancel.id).first()
+        if reservation:
+            db.session.delete(reservation)
         
         db.session.commit()
+        if reservation:
+            slot_index.mark_free(reservation.doctor_id, reservation.slot_at, reservation.slot_minutes)
         flash("Your appointment has been successfully cancelled.", "success")
     else:
         flash("Appointment not found or you do not have permission to cancel it.", "danger")
@@ -597,19 +1690,17 @@ def doctor_dashboard():
         return redirect(url_for('doctor_login'))
         
     doctor_id = session.get('user_id')
-    doctor = Doctor.query.get(doctor_id)
+    doctor = get_doctor_with_hospital(doctor_id)
     
     # --- NEW LOGIC TO FETCH APPOINTMENTS ---
     # Order by date and time to show upcoming appointments first
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        Appointment.appointment_date >= datetime.utcnow().date()
-    ).order_by(Appointment.appointment_date, Appointment.appointment_time).all()
+    upcoming_appointments = get_doctor_upcoming_appointments(doctor_id)
     
     return render_template(
         'doctor_dashboard.html', 
         doctor=doctor,
-        appointments=upcoming_appointments
+        appointments=upcoming_appointments,
+        medical_record_count=count_doctor_medical_records(doctor_id)
     )
 # --- Patient Routes (Password-based, No OTP) ---
 @app.route('/patient_register', methods=['GET', 'POST'])
@@ -691,6 +1782,10 @@ def update_medical_history():
 
     # 4. Update the 'medical_history' attribute of the Python object.
     profile.medical_history = new_history_text
+    if selection_key(new_history_text) != profile.exercise_selection_key:
+        # The stored exercise plan was chosen for a different history
+        profile.exercise_selection = None
+        profile.exercise_selection_key = None
     
     # 5. Commit the change, which saves it permanently to the database.
     db.session.commit()
@@ -711,15 +1806,9 @@ def patient_dashboard():
     # Logic to control the upload form
     can_upload_documents = True 
 
-    # Logic to fetch all documents
-    all_documents = PatientDocument.query.filter_by(patient_id=patient_id).order_by(PatientDocument.upload_date.desc()).all()
-    
-    # Logic to fetch upcoming appointments
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.patient_id == patient_id,
-        Appointment.appointment_date >= datetime.utcnow().date(),
-        Appointment.status == 'Booked'
-    ).order_by(Appointment.appointment_date, Appointment.appointment_time).all()
+    # First page of documents and upcoming appointments; the page fetches the rest as it is scrolled
+    documents = get_patient_documents(patient_id)
+    upcoming_appointments = get_patient_upcoming_appointments(patient_id)
     
     # This is where the data is sent to the template
     return render_template(
@@ -727,14 +1816,16 @@ def patient_dashboard():
         patient=patient, 
         profile=active_profile, # The 'active_profile' object contains the medical_history
         has_recent_appointment=can_upload_documents,
-        documents=all_documents,
-        upcoming_appointments=upcoming_appointments,
+        documents=documents.items,
+        documents_next_cursor=documents.next_cursor,
+        upcoming_appointments=upcoming_appointments.items,
+        appointments_next_cursor=upcoming_appointments.next_cursor,
         now=datetime.utcnow() 
     )
 # --- ADD THIS NEW ROUTE for cancelling appointments ---
 
 # --- ADD a new route to serve the uploaded files securely ---
-from flask import send_from_directory
+from flask import send_file
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
@@ -747,8 +1838,13 @@ def uploaded_file(filename):
     
     if not doc:
         return "File not found or access denied", 404
-        
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+    # The bytes live in the blob store under the document's content hash (older uploads: UPLOAD_FOLDER)
+    filepath = document_path(doc)
+    if not os.path.exists(filepath):
+        return "File not found or access denied", 404
+    return send_file(filepath, mimetype=mimetypes.guess_type(doc.filename)[0], download_name=doc.filename,
+                     etag=doc.content_hash or True, conditional=True)
 @app.route('/select_profile')
 def select_profile():
     if session.get('user_type') != 'patient':
@@ -787,20 +1883,130 @@ def view_patient_details(patient_id, appointment_id):
         return redirect(url_for('doctor_dashboard'))
 
     # If security checks pass, fetch all patient data
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_with_profiles(patient_id)
+    if not patient:
+        abort(404)
     
-    # Fetch all of the patient's past documents and medical records (notes from doctors)
-    past_documents = PatientDocument.query.filter_by(patient_id=patient_id).order_by(PatientDocument.upload_date.desc()).all()
-    past_medical_records = MedicalRecord.query.filter_by(patient_id=patient_id).order_by(MedicalRecord.record_date.desc()).all()
+    # First page of the patient's documents and medical records (notes from doctors); older ones load on demand
+    past_documents = get_patient_documents(patient_id)
+    past_medical_records = get_patient_medical_records(patient_id)
 
     return render_template(
         'view_patient.html', 
         patient=patient,
         appointment=appointment,
-        past_documents=past_documents,
-        past_medical_records=past_medical_records
+        past_documents=past_documents.items,
+        documents_next_cursor=past_documents.next_cursor,
+        past_medical_records=past_medical_records.items,
+        records_next_cursor=past_medical_records.next_cursor
     )
 
+# --- Paginated History Listings ---
+# JSON pages of a patient's documents, records and upcoming appointments: ?limit=<n>&cursor=<next_cursor>
+
+def can_view_patient(patient_id):
+    """The patient themselves, or a doctor who has had an appointment with them."""
+    if session.get('user_type') == 'patient':
+        return session.get('user_id') == patient_id
+    if session.get('user_type') == 'doctor':
+        return db.session.query(Appointment.id).filter_by(
+            doctor_id=session.get('user_id'), patient_id=patient_id
+        ).first() is not None
+    return False
+
+def paginated_listing(patient_id, fetch_page, to_dict):
+    if not can_view_patient(patient_id):
+        return jsonify({"error": "Access denied"}), 403
+    limit = page_size(request.args.get('limit'), app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    try:
+        page = fetch_page(patient_id, cursor=request.args.get('cursor'), limit=limit)
+    except InvalidCursorError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"items": [to_dict(item) for item in page.items], "next_cursor": page.next_cursor})
+
+def document_to_dict(doc):
+    return {
+        "id": doc.id,
+        "document_type": doc.document_type,
+        "name": doc.filename.split('_', 2)[-1],
+        "upload_date": doc.upload_date.isoformat(),
+        "upload_date_label": doc.upload_date.strftime('%d %b %Y'),
+        "uploaded_by": doc.doctor.name if doc.doctor_id else None,
+        "url": url_for('uploaded_file', filename=doc.filename)
+    }
+
+def medical_record_to_dict(record):
+    return {
+        "id": record.id,
+        "record_date": record.record_date.isoformat(),
+        "record_date_label": record.record_date.strftime('%d %b %Y'),
+        "doctor_name": record.doctor.name,
+        "notes": record.notes,
+        "prescription": record.prescription
+    }
+
+def appointment_to_dict(appt):
+    return {
+        "id": appt.id,
+        "appointment_at": appt.appointment_at.isoformat(),
+        "date_label": appt.appointment_date.strftime('%A, %d %b %Y'),
+        "time_label": appt.appointment_time,
+        "doctor_name": appt.doctor.name,
+        "specialization": appt.doctor.specialization,
+        "cancel_url": url_for('cancel_appointment', appt_id=appt.id)
+    }
+
+@app.route('/api/patients/<int:patient_id>/documents')
+def list_patient_documents(patient_id):
+    return paginated_listing(patient_id, get_patient_documents, document_to_dict)
+
+@app.route('/api/patients/<int:patient_id>/medical_records')
+def list_patient_medical_records(patient_id):
+    return paginated_listing(patient_id, get_patient_medical_records, medical_record_to_dict)
+
+@app.route('/api/patients/<int:patient_id>/appointments')
+def list_patient_appointments(patient_id):
+    return paginated_listing(patient_id, get_patient_upcoming_appointments, appointment_to_dict)
+
+SEARCH_KINDS = {'document', 'record'}
+
+@app.route('/doctor/patient/<int:patient_id>/search')
+def search_patient_history(patient_id):
+    """
+    Full-text search over a patient's documents and medical records, best match first:
+    ?q=<words or "a phrase">&kind=document|record&limit=<n>. Each result carries a snippet and the
+    [start, end] offsets of the matched words in it, plus the document or record itself.
+    """
+    if session.get('user_type') != 'doctor' or not can_view_patient(patient_id):
+        return jsonify({"error": "Access denied"}), 403
+    query = request.args.get('q', '').strip()
+    kinds = request.args.getlist('kind')
+    if not set(kinds) <= SEARCH_KINDS:
+        return jsonify({"error": f"kind must be one of: {', '.join(sorted(SEARCH_KINDS))}"}), 400
+    limit = page_size(request.args.get('limit'), app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+
+    started = time.perf_counter()
+    with tracing.span('search'):
+        hits = search_index.search(patient_id, query, kinds=kinds or None, limit=limit)
+
+    # Load what the page shows for each hit; items deleted since they were indexed are left out
+    ids = {kind: [hit['source_id'] for hit in hits if hit['kind'] == kind] for kind in SEARCH_KINDS}
+    documents = {doc.id: doc for doc in PatientDocument.query.options(joinedload(PatientDocument.doctor)).filter(
+        PatientDocument.patient_id == patient_id, PatientDocument.id.in_(ids['document']))} if ids['document'] else {}
+    records = {record.id: record for record in MedicalRecord.query.options(joinedload(MedicalRecord.doctor)).filter(
+        MedicalRecord.patient_id == patient_id, MedicalRecord.id.in_(ids['record']))} if ids['record'] else {}
+
+    results = []
+    for hit in hits:
+        if hit['kind'] == 'document' and hit['source_id'] in documents:
+            hit['document'] = document_to_dict(documents[hit['source_id']])
+        elif hit['kind'] == 'record' and hit['source_id'] in records:
+            hit['record'] = medical_record_to_dict(records[hit['source_id']])
+        else:
+            continue
+        results.append(hit)
+    return jsonify({"query": query, "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 2)})
+
 @app.route('/doctor/add_medical_record', methods=['POST'])
 def add_medical_record():
     # Security Check
@@ -834,6 +2040,10 @@ def add_medical_record():
     )
     db.session.add(new_record)
     db.session.commit()
+    try:
+        index_medical_record(new_record) # Searchable right away; update_search_index would also pick it up
+    except Exception as e:
+        print(f"Could not index medical record {new_record.id}: {e}")
 
     flash("Medical record added successfully.", "success")
     return redirect(url_for('view_patient_details', patient_id=patient_id, appointment_id=appointment_id))
@@ -846,16 +2056,56 @@ def add_medical_record():
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # Configure Gemini
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Initialize the Gemini model to be used for analysis
-    gemini_model = genai.GenerativeModel("gemini-2.5-flash") 
-    print("Gemini configured successfully.")
-except Exception as e:
-    gemini_model = None
-    print(f"WARNING: Could not configure Gemini. Analysis will fail. Error: {e}")
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+
+# --- AI Gateway Configuration ---
+# Every Gemini / DALL-E call goes through a gateway (llm.py) with a concurrency cap, timeouts,
+# retries and a circuit breaker. LLM_PROVIDER=fake answers locally for offline load testing.
+app.config['LLM_PROVIDER'] = os.getenv('LLM_PROVIDER', 'gemini')
+app.config['LLM_TIMEOUT_SECONDS'] = float(os.getenv('LLM_TIMEOUT_SECONDS', 30))
+app.config['LLM_MAX_CONCURRENCY'] = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+app.config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', 2))
+app.config['IMAGE_TIMEOUT_SECONDS'] = float(os.getenv('IMAGE_TIMEOUT_SECONDS', 90))
+app.config['IMAGE_MAX_CONCURRENCY'] = int(os.getenv('IMAGE_MAX_CONCURRENCY', 4))
+app.config['FAKE_LLM_LATENCY_SECONDS'] = float(os.getenv('FAKE_LLM_LATENCY_SECONDS', 0.5))
+
+text_provider = image_provider = None
+if app.config['LLM_PROVIDER'] == 'fake':
+    text_provider = image_provider = FakeProvider(latency_seconds=app.config['FAKE_LLM_LATENCY_SECONDS'])
+    print("Using the offline fake AI provider.")
+else:
+    try:
+        text_provider = GeminiProvider(GEMINI_MODEL_NAME, GEMINI_API_KEY)
+        print("Gemini configured successfully.")
+    except Exception as e:
+        print(f"WARNING: Could not configure Gemini. Analysis will fail. Error: {e}")
+    if openai_client:
+        image_provider = OpenAIImageProvider(openai_client)
+
+llm = LLMGateway(
+    text_provider,
+    max_concurrency=app.config['LLM_MAX_CONCURRENCY'],
+    timeout_seconds=app.config['LLM_TIMEOUT_SECONDS'],
+    max_retries=app.config['LLM_MAX_RETRIES']
+)
+image_llm = LLMGateway(
+    image_provider,
+    max_concurrency=app.config['IMAGE_MAX_CONCURRENCY'],
+    timeout_seconds=app.config['IMAGE_TIMEOUT_SECONDS'],
+    max_retries=app.config['LLM_MAX_RETRIES']
+)
 # --- END OF GEMINI CONFIG BLOCK ---
 
+# --- Exercise Image Cache Configuration ---
+# Illustrations are generated once into static/exercises/ and served from there afterwards
+app.config['EXERCISE_IMAGE_WORKERS'] = int(os.getenv('EXERCISE_IMAGE_WORKERS', app.config['IMAGE_MAX_CONCURRENCY']))
+app.config['EXERCISE_IMAGE_WAIT_SECONDS'] = float(os.getenv('EXERCISE_IMAGE_WAIT_SECONDS', app.config['IMAGE_TIMEOUT_SECONDS']))
+exercise_images = ExerciseImageCache(
+    os.path.join(app.static_folder, 'exercises'),
+    lambda prompt: image_llm.generate_image(prompt, 'exercise_images'),
+    max_workers=app.config['EXERCISE_IMAGE_WORKERS']
+)
+
 
 # --- ADD THIS NEW ROUTE for the doctor to upload files ---
 @app.route('/doctor/upload_for_patient', methods=['POST'])
@@ -881,16 +2131,18 @@ def doctor_upload_for_patient():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         unique_filename = f"doc_{patient_id}_{int(datetime.now().timestamp())}_{filename}"
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+        content_hash = store_document_file(file)
         
         new_document = PatientDocument(
             filename=unique_filename,
             document_type=doc_type,
             patient_id=patient_id,
-            doctor_id=session['user_id'] # Link to the uploading doctor
+            doctor_id=session['user_id'], # Link to the uploading doctor
+            content_hash=content_hash
         )
         db.session.add(new_document)
         db.session.commit()
+        record_document_in_ledger(new_document)
         flash('Document uploaded for patient successfully!', 'success')
     else:
         flash('Invalid file or file type.', 'danger')
@@ -899,9 +2151,55 @@ def doctor_upload_for_patient():
     return redirect(url_for('view_patient_details', patient_id=patient_id, appointment_id=appointment_exists.id))
 
 
-# --- REPLACE your entire old /analyze_document route with this ---
-import fitz # PyMuPDF
+@app.route('/verify/<int:doc_id>')
+def verify_document(doc_id):
+    """
+    Integrity check for one document: the stored file still has the hash recorded at upload,
+    the ledger entry's hash is intact and links to the entry before it, and (once sealed) the
+    entry's Merkle proof leads to a root the notary has anchored. Returns the proof so it
+    can be checked independently.
+    """
+    doc = db.session.get(PatientDocument, doc_id)
+    if not doc or not can_view_patient(doc.patient_id):
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    entry = LedgerEntry.query.filter_by(document_id=doc.id).order_by(LedgerEntry.id.desc()).first()
+    if entry is None:
+        return jsonify({"document_id": doc.id, "in_ledger": False, "verified": False,
+                        "error": "This document is not in the integrity ledger (e.g. uploaded before it existed)."})
+
+    filepath = document_path(doc)
+    file_hash = file_sha256(filepath) if os.path.exists(filepath) else None
+    checks = {
+        "file_matches": file_hash == entry.content_hash,
+        "entry_hash_valid": entry.entry_hash == integrity.entry_hash(
+            entry.prev_hash, entry.document_id, entry.content_hash, entry.created_at),
+        "chain_link_valid": entry.prev_hash == integrity.GENESIS_HASH or db.session.query(LedgerEntry.id)
+            .filter_by(entry_hash=entry.prev_hash).first() is not None,
+    }
+    result = {
+        "document_id": doc.id,
+        "in_ledger": True,
+        "content_hash": entry.content_hash,
+        "current_file_hash": file_hash,
+        "entry": {"id": entry.id, "created_at": entry.created_at.isoformat(),
+                  "prev_hash": entry.prev_hash, "entry_hash": entry.entry_hash},
+        "anchored": entry.batch is not None
+    }
+    if entry.batch is not None:
+        proof = json.loads(entry.merkle_proof)
+        receipt = json.loads(entry.batch.anchor_receipt)
+        checks["merkle_proof_valid"] = integrity.verify_proof(entry.entry_hash, proof, entry.batch.merkle_root)
+        checks["anchor_valid"] = notary.verify(entry.batch.merkle_root, receipt)
+        result.update({"batch_id": entry.batch.id, "merkle_root": entry.batch.merkle_root,
+                       "merkle_proof": proof, "anchor_receipt": receipt})
+
+    result["checks"] = checks
+    result["verified"] = all(checks.values()) # Until its batch is sealed, an entry is verified up to its chain link
+    return jsonify(result)
+
 
+# --- REPLACE your entire old /analyze_document route with this ---
 # --- REPLACE your entire old /analyze_document route with this ---
 @app.route('/analyze_document/<int:doc_id>', methods=['POST'])
 def analyze_document(doc_id):
@@ -912,82 +2210,97 @@ def analyze_document(doc_id):
     if not doc:
         return jsonify({"error": "Document not found or access denied"}), 404
 
+    if not is_extractable(doc.filename):
+        return jsonify({"error": "Unsupported file type for analysis."}), 400
+
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], doc.filename)
-        extracted_text = ""
-        
-        if doc.filename.lower().endswith('.pdf'):
-            with fitz.open(filepath) as pdf_doc:
-                for page in pdf_doc:
-                    extracted_text += page.get_text()
-        elif doc.filename.lower().split('.')[-1] in ['png', 'jpg', 'jpeg']:
-            image = Image.open(filepath)
-            extracted_text = pytesseract.image_to_string(image)
-        else:
-            return jsonify({"error": "Unsupported file type for analysis."}), 400
-        
-        if not extracted_text.strip():
-            # Return an "analysis" key to match what this frontend expects
-            return jsonify({"analysis": "Could not find any text in the document to analyze."})
+        filepath = document_path(doc)
 
-        # --- Call the new helper function ---
-        analysis_response = get_ai_analysis(extracted_text)
-        
-        # The frontend for this page expects an "analysis" key
-        return jsonify({"analysis": analysis_response})
+        # Serve the stored analysis if this exact file was already analyzed with the current prompt and model
+        stored = get_stored_analysis(doc.id, file_sha256(filepath))
+        if stored:
+            return jsonify({"analysis": stored.analysis})
+
+        # Re-use a job that is already working on this document (e.g. after a double click)
+        job = ProcessingJob.query.filter(
+            ProcessingJob.document_id == doc.id,
+            ProcessingJob.status.in_(['queued', 'running'])
+        ).first()
+
+        if not job:
+            job = enqueue_analysis_job('document_analysis', filepath, patient_id=doc.patient_id, document_id=doc.id)
+
+        # The frontend polls the status URL until the "analysis" is ready
+        return jsonify({"job_id": job.id, "status_url": url_for('job_status', job_id=job.id)}), 202
 
+    except QueueFullError:
+        db.session.rollback()
+        return queue_full_response()
     except Exception as e:
+        db.session.rollback()
         print(f"Analysis Error: {e}")
         return jsonify({"error": f"An error occurred during analysis: {e}"}), 500
-# --- ADD THIS NEW ROUTE for contextual Q&A to app.py ---
-
-@app.route('/ask_about_document', methods=['POST'])
-def ask_about_document():
-    # Security check: User must be a logged-in patient
-    if session.get('user_type') != 'patient':
+@app.route('/admin/analyses', methods=['POST'])
+def manage_analyses():
+    """
+    Bulk maintenance of stored document analyses.
+    JSON body: {"action": "warm" | "invalidate", "document_ids": [...], "patient_id": ...}
+    Without document_ids or patient_id the action applies to every document.
+    - warm: queues analysis jobs for documents that have no up-to-date analysis
+    - invalidate: deletes stored analyses so they are regenerated on the next request
+    """
+    if not is_admin_request():
         return jsonify({"error": "Access Denied"}), 403
 
-    data = request.get_json()
-    doc_id = data.get('doc_id')
-    question = data.get('question')
-
-    if not all([doc_id, question]):
-        return jsonify({"error": "Missing document ID or question."}), 400
-
-    # Security check: Ensure the document belongs to this patient
-    doc = PatientDocument.query.filter_by(id=doc_id, patient_id=session['user_id']).first()
-    if not doc:
-        return jsonify({"error": "Document not found or access denied."}), 404
+    data = request.get_json() or {}
+    action = data.get('action')
+    if action not in ('warm', 'invalidate'):
+        return jsonify({"error": "action must be 'warm' or 'invalidate'."}), 400
+
+    documents = PatientDocument.query
+    if data.get('document_ids'):
+        documents = documents.filter(PatientDocument.id.in_(data['document_ids']))
+    if data.get('patient_id'):
+        documents = documents.filter(PatientDocument.patient_id == data['patient_id'])
+
+    if action == 'invalidate':
+        document_ids = documents.with_entities(PatientDocument.id)
+        invalidated = DocumentAnalysis.query.filter(
+            DocumentAnalysis.document_id.in_(document_ids.scalar_subquery())
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return jsonify({"invalidated": invalidated})
 
-    # --- Extract text from the document AGAIN to provide context to the AI ---
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], doc.filename)
-    extracted_text = ""
-    try:
-        if doc.filename.lower().endswith('.pdf'):
-            with fitz.open(filepath) as pdf_doc:
-                for page in pdf_doc:
-                    extracted_text += page.get_text()
-        elif doc.filename.lower().split('.')[-1] in ['png', 'jpg', 'jpeg']:
-            image = Image.open(filepath)
-            extracted_text = pytesseract.image_to_string(image)
-        else:
-            # This case should ideally not be reached if analysis worked before
-            return jsonify({"error": "Unsupported file type."}), 400
-            
-    except Exception as e:
-        print(f"Error re-extracting text: {e}")
-        return jsonify({"error": "Could not read the document to answer the question."}), 500
+    counts = {"queued": 0, "up_to_date": 0, "in_progress": 0, "skipped": 0, "deferred": 0}
+    for doc in documents.order_by(PatientDocument.id).all():
+        filepath = document_path(doc)
+        if not is_extractable(doc.filename) or not os.path.exists(filepath):
+            counts['skipped'] += 1
+            continue
+        if get_stored_analysis(doc.id, file_sha256(filepath)):
+            counts['up_to_date'] += 1
+            continue
+        if ProcessingJob.query.filter(
+            ProcessingJob.document_id == doc.id,
+            ProcessingJob.status.in_(['queued', 'running'])
+        ).first():
+            counts['in_progress'] += 1
+            continue
+        if counts['deferred']:
+            # The queue is already full; just count what is left for the next warm-up call
+            counts['deferred'] += 1
+            continue
+        try:
+            enqueue_analysis_job('document_analysis', filepath, patient_id=doc.patient_id, document_id=doc.id)
+            counts['queued'] += 1
+        except QueueFullError:
+            counts['deferred'] += 1
 
-    if not extracted_text.strip():
-        return jsonify({"response": "I couldn't find any text in the original document to reference."})
+    return jsonify(counts)
 
-    # --- Create the contextual prompt for Gemini ---
-    try:
-        if not gemini_model:
-            raise Exception("AI service is not configured.")
+# --- ADD THIS NEW ROUTE for contextual Q&A to app.py ---
 
-        # --- THIS IS THE NEW, MORE INTELLIGENT PROMPT ---
-        prompt = f"""
+DOCUMENT_QUESTION_PROMPT_TEMPLATE = """
         You are a helpful and knowledgeable medical assistant. Your task is to answer a patient's question. You have two modes of answering:
 
         1.  **If the patient's question can be answered directly from the text of their medical document**, you must base your answer on that text.
@@ -999,7 +2312,7 @@ def ask_about_document():
         -   Always include a disclaimer if you are providing general information not found in the report. For example: "While this report doesn't go into detail, here is a general explanation..."
         -   If asked for advice on how to "cure" a condition that the report says is not present (e.g., "No active disease"), you should first point out the good news from the report and then provide general wellness advice.
 
-        Here is the full text of the medical document for context:
+        {document_scope}
         --- DOCUMENT START ---
         {extracted_text}
         --- DOCUMENT END ---
@@ -1009,20 +2322,89 @@ def ask_about_document():
 
         Now, analyze the question and the document, and provide the best possible answer based on the rules above.
         """
-        # --- END OF THE NEW PROMPT ---
-        
-        response = gemini_model.generate_content(prompt)
-        
-        if response and response.candidates:
-            answer = response.candidates[0].content.parts[0].text.strip()
-        else:
-            answer = "I was unable to process your question at this time."
+FULL_DOCUMENT_SCOPE = "Here is the full text of the medical document for context:"
+DOCUMENT_EXCERPTS_SCOPE = (
+    "Here are the parts of the medical document most relevant to the question; other parts are left out "
+    "(gaps are marked [...]), so do not say the report lacks something only because it is not in these excerpts:"
+)
+
+def document_question_context(extracted_text, question):
+    """The document text to send with a question, and the prompt line introducing it."""
+    if len(extracted_text) <= app.config['DOCUMENT_CONTEXT_CHARS']:
+        document_question_context_chars.observe(len(extracted_text), scope='full')
+        return extracted_text, FULL_DOCUMENT_SCOPE
+    context = retrieval_index.select(extracted_text, question, app.config['DOCUMENT_CONTEXT_CHARS'])
+    document_question_context_chars.observe(len(context), scope='excerpts')
+    return context, DOCUMENT_EXCERPTS_SCOPE
+
+def build_document_question_prompt():
+    """
+    Validates an ask-about-document request and builds the Gemini prompt for it.
+    Returns (prompt, None), or (None, error_response) when the request can't be answered by the AI.
+    """
+    # Security check: User must be a logged-in patient
+    if session.get('user_type') != 'patient':
+        return None, (jsonify({"error": "Access Denied"}), 403)
+
+    data = request.get_json()
+    doc_id = data.get('doc_id')
+    question = data.get('question')
+
+    if not all([doc_id, question]):
+        return None, (jsonify({"error": "Missing document ID or question."}), 400)
+
+    # Security check: Ensure the document belongs to this patient
+    doc = PatientDocument.query.filter_by(id=doc_id, patient_id=session['user_id']).first()
+    if not doc:
+        return None, (jsonify({"error": "Document not found or access denied."}), 404)
+
+    # --- Get the document text (from the text cache if it was already extracted) ---
+    if not is_extractable(doc.filename):
+        # This case should ideally not be reached if analysis worked before
+        return None, (jsonify({"error": "Unsupported file type."}), 400)
 
+    filepath = document_path(doc)
+    try:
+        extracted_text = get_document_text(filepath)
+    except UnreadableImageError as e:
+        return None, jsonify({"response": f"I couldn't read the original document: {e}."})
+    except Exception as e:
+        print(f"Error re-extracting text: {e}")
+        return None, (jsonify({"error": "Could not read the document to answer the question."}), 500)
+
+    if not extracted_text.strip():
+        return None, jsonify({"response": "I couldn't find any text in the original document to reference."})
+
+    if not llm.available:
+        return None, (jsonify({"error": "AI service is not configured."}), 500)
+
+    context, document_scope = document_question_context(extracted_text, question)
+    return DOCUMENT_QUESTION_PROMPT_TEMPLATE.format(
+        document_scope=document_scope, extracted_text=context, question=question
+    ), None
+
+@app.route('/ask_about_document', methods=['POST'])
+def ask_about_document():
+    prompt, error_response = build_document_question_prompt()
+    if error_response:
+        return error_response
+
+    try:
+        answer = llm.generate(prompt, 'ask_about_document')
         return jsonify({"response": answer})
 
     except Exception as e:
         print(f"Contextual Chat Error: {e}")
         return jsonify({"error": "An error occurred while getting the answer."}), 500
+
+@app.route('/ask_about_document/stream', methods=['POST'])
+def ask_about_document_stream():
+    """Streaming version of /ask_about_document: the answer is sent as Server-Sent Events while it is generated."""
+    prompt, error_response = build_document_question_prompt()
+    if error_response:
+        return error_response
+    return stream_ai_response(prompt, 'ask_about_document', "An error occurred while getting the answer.")
+
 # --- START: Routes for Emergency Guide Page ---
 
 # 1. Route to serve the main emergency guide page
@@ -1032,91 +2414,371 @@ def emergency_guide():
     return render_template('emergency_guide.html')
 
 
+GUIDE_PROMPT_TEMPLATE = """
+        You are an AI First Aid Instructor. Your instructions must be simple, clear, and numbered, using Markdown for formatting. 
+        The very first step must always be a bolded instruction like '**1. Call Emergency Services Immediately.**'. 
+        Provide a step-by-step first aid guide for the following situation: "{emergency_type}".
+        Keep the language very simple, using short sentences and bullet points, as if talking to someone in a panic.
+        """
+
+def library_guide_response(guide):
+    """JSON response for a guide from the library, cacheable by the browser and revalidated by ETag."""
+    response = jsonify(guide.to_dict())
+    response.set_etag(guide.etag)
+    response.headers['Cache-Control'] = f"public, max-age={app.config['GUIDE_MAX_AGE_SECONDS']}"
+    return response.make_conditional(request)
+
 # 2. API route for getting first aid instructions when a button is clicked
-@app.route('/get_guide', methods=['POST'])
+@app.route('/get_guide', methods=['GET', 'POST'])
 def get_emergency_guide():
-    """Provides AI-generated first aid steps for a specific emergency."""
-    data = request.get_json()
-    emergency_type = data.get('emergency')
+    """
+    Provides first aid steps for a specific emergency.
+    Known emergencies are answered from the guide library; POST falls back to the AI for anything else.
+    GET (?emergency=...) only serves the library, so browsers and proxies can cache it.
+    """
+    if request.method == 'GET':
+        emergency_type = request.args.get('emergency')
+    else:
+        emergency_type = request.get_json().get('emergency')
 
     if not emergency_type:
         return jsonify({"error": "No emergency type specified."}), 400
 
-    if not gemini_model:
+    guide = guide_store.get(emergency_type)
+    if guide:
+        return library_guide_response(guide)
+    if request.method == 'GET':
+        return jsonify({"error": "No stored guide for this emergency."}), 404
+
+    if not llm.available:
         return jsonify({"error": "AI service is not configured."}), 500
 
     try:
-        prompt = f"""
-        You are an AI First Aid Instructor. Your instructions must be simple, clear, and numbered, using Markdown for formatting. 
-        The very first step must always be a bolded instruction like '**1. Call Emergency Services Immediately.**'. 
-        Provide a step-by-step first aid guide for the following situation: "{emergency_type}".
-        Keep the language very simple, using short sentences and bullet points, as if talking to someone in a panic.
-        """
-        response = gemini_model.generate_content(prompt)
-        guide_text = response.candidates[0].content.parts[0].text.strip()
+        prompt = GUIDE_PROMPT_TEMPLATE.format(emergency_type=emergency_type)
+        guide_text = llm.generate(prompt, 'get_guide')
         return jsonify({"guide": guide_text})
     except Exception as e:
         print(f"Emergency Guide Error: {e}")
         return jsonify({"error": "Could not generate guide at this time."}), 500
 
+@app.route('/get_guide/stream', methods=['POST'])
+def get_emergency_guide_stream():
+    """Streaming version of /get_guide, so the first steps appear while the rest is still being written."""
+    data = request.get_json()
+    emergency_type = data.get('emergency')
+
+    if not emergency_type:
+        return jsonify({"error": "No emergency type specified."}), 400
+
+    guide = guide_store.get(emergency_type)
+    if guide:
+        return library_guide_response(guide)
+
+    if not llm.available:
+        return jsonify({"error": "AI service is not configured."}), 500
+
+    prompt = GUIDE_PROMPT_TEMPLATE.format(emergency_type=emergency_type)
+    return stream_ai_response(prompt, 'get_guide', "Could not generate guide at this time.")
+
+def refresh_first_aid_guides():
+    """
+    Scheduled job: regenerates library guides older than the refresh interval.
+    A new version is only accepted if it keeps the mandatory first step.
+    Only the holder of the 'guides' lease regenerates, renewing it before each guide,
+    so every guide costs one AI call and one worker writes the refreshed-guides file.
+    """
+    if not llm.available:
+        return
+    with app.app_context():
+        try:
+            if not acquire_lease('guides', app.config['SCHEDULER_LEASE_SECONDS']):
+                return
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error refreshing first aid guides: {e}")
+            return
+        guide_store.load() # Start from what the previous lease holder wrote
+
+        refresh_before = datetime.utcnow() - timedelta(hours=app.config['GUIDE_REFRESH_HOURS'])
+        for name in guide_store.names():
+            guide = guide_store.get(name)
+            if guide.updated_at and datetime.fromisoformat(guide.updated_at) > refresh_before:
+                continue
+            try:
+                if not acquire_lease('guides', app.config['SCHEDULER_LEASE_SECONDS']):
+                    return # Took too long and another worker has taken over
+                text = llm.generate(GUIDE_PROMPT_TEMPLATE.format(emergency_type=name), 'refresh_guides')
+                if 'call emergency services' not in text[:200].lower():
+                    print(f"Rejected refreshed guide for '{name}': missing the emergency services step.")
+                    continue
+                guide = guide_store.update(name, text)
+                print(f"Refreshed first aid guide '{name}' (version {guide.version}).")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Could not refresh guide '{name}': {e}")
+
+def reload_first_aid_guides():
+    """Scheduled job: picks up guides the lease holder refreshed, in every worker."""
+    try:
+        if guide_store.reload_if_changed():
+            print("Reloaded refreshed first aid guides.")
+    except Exception as e:
+        print(f"Could not reload first aid guides: {e}")
+
+scheduler.add_job(
+    func=refresh_first_aid_guides,
+    trigger='interval',
+    hours=app.config['GUIDE_REFRESH_HOURS'],
+    id='refresh_first_aid_guides',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+scheduler.add_job(
+    func=reload_first_aid_guides,
+    trigger='interval',
+    seconds=app.config['GUIDE_RELOAD_SECONDS'],
+    id='reload_first_aid_guides',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+
+def write_dispatch_events(rows):
+    """dispatch_log sink: inserts a batch of events in one multi-row insert."""
+    with app.app_context():
+        db.session.execute(insert(DispatchEvent), rows)
+        db.session.commit()
+
+dispatch_log = DispatchLog(
+    app.config['DISPATCH_LOG_PATH'],
+    write_dispatch_events,
+    flush_seconds=app.config['DISPATCH_LOG_FLUSH_SECONDS'],
+    transient_errors=(OperationalError, InterfaceError) # Database unreachable: retry, don't dead-letter
+)
+
+DISPATCH_SEARCH_RADII_KM = (5, 25, 100) # The nearest-dispatch search widens through these until it finds one
+MAX_DISPATCH_STREAM_SECONDS = 300 # EventSource reconnects after this, resuming from Last-Event-ID
+CALLER_NAME_MAX_LENGTH = DispatchEvent.caller_name.type.length
+CALLER_PHONE_MAX_LENGTH = DispatchEvent.caller_phone.type.length
+CALLER_PHONE_PATTERN = re.compile(r'\+?[0-9][0-9 ()\-]{2,}')
+
+def parse_coordinates(latitude, longitude):
+    """Returns (lat, lon) as floats, or None if they are missing or out of range."""
+    try:
+        lat, lon = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    return (lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+
+def attach_dispatch_address(dispatch_id, latitude, longitude, result):
+    """Geocoder callback: logs the address found for a dispatch."""
+    dispatch_log.record(
+        dispatch_id=dispatch_id,
+        event_type='address_resolved',
+        latitude=latitude,
+        longitude=longitude,
+        address=result.address,
+        address_source=result.source
+    )
+
+def dispatch_event_to_dict(dispatch_event):
+    return {
+        "id": dispatch_event.id,
+        "dispatch_id": dispatch_event.dispatch_id,
+        "event_type": dispatch_event.event_type,
+        "created_at": dispatch_event.created_at.isoformat(),
+        "caller_name": dispatch_event.caller_name,
+        "caller_phone": dispatch_event.caller_phone,
+        "latitude": dispatch_event.latitude,
+        "longitude": dispatch_event.longitude,
+        "address": dispatch_event.address,
+        "address_source": dispatch_event.address_source
+    }
+
+def find_nearest_open_dispatch(latitude, longitude):
+    """
+    Returns (requested event, distance in km) for the closest open dispatch, or None.
+    Each pass only reads the dispatches inside a bounding box (through the
+    type/location index), widening it until one is found.
+    """
+    opened_after = datetime.utcnow() - timedelta(hours=app.config['DISPATCH_OPEN_HOURS'])
+    requested = aliased(DispatchEvent, name='requested')
+    closed = db.session.query(DispatchEvent.id).filter(
+        DispatchEvent.event_type == 'closed',
+        DispatchEvent.dispatch_id == requested.dispatch_id
+    )
+
+    for radius_km in DISPATCH_SEARCH_RADII_KM:
+        lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+        # Longitude degrees shrink towards the poles; clamp so the box stays finite
+        lon_delta = min(180.0, lat_delta / max(math.cos(math.radians(latitude)), 0.01))
+        candidates = db.session.query(requested).filter(
+            requested.event_type == 'requested',
+            requested.latitude.between(latitude - lat_delta, latitude + lat_delta),
+            requested.longitude.between(longitude - lon_delta, longitude + lon_delta),
+            requested.created_at >= opened_after,
+            ~closed.exists()
+        ).all()
+
+        ranked = sorted(
+            ((candidate, distance_km(latitude, longitude, candidate.latitude, candidate.longitude)) for candidate in candidates),
+            key=lambda pair: pair[1]
+        )
+        if ranked and ranked[0][1] <= radius_km:
+            return ranked[0]
+    return None
 
 # 3. API route to simulate calling an ambulance
 @app.route('/call_ambulance', methods=['POST'])
 def call_ambulance():
-    """Simulates a call for an ambulance and reverse geocodes the location."""
-    data = request.get_json()
+    """
+    Simulates a call for an ambulance. Answers at once: the call is added to the
+    dispatch log's buffer, and the location is reverse geocoded in the background
+    and can be read from /call_ambulance/<dispatch_id>/address.
+    """
+    data = request.get_json(silent=True) or {}
     name = data.get('name')
     phone = data.get('phone')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
+    coordinates = parse_coordinates(data.get('latitude'), data.get('longitude'))
     
-    # Simple validation
+    # Simple validation. The values go into the dispatch log as they are, so they must fit its columns.
+    name = name.strip() if isinstance(name, str) else None
+    phone = str(phone).strip() if isinstance(phone, (str, int)) and not isinstance(phone, bool) else None
     if not all([name, phone]):
         return jsonify({
             "success": False,
             "message": "Name and Phone Number are required."
         }), 400
+    if len(name) > CALLER_NAME_MAX_LENGTH:
+        return jsonify({
+            "success": False,
+            "message": f"Name must be at most {CALLER_NAME_MAX_LENGTH} characters."
+        }), 400
+    if len(phone) > CALLER_PHONE_MAX_LENGTH or not CALLER_PHONE_PATTERN.fullmatch(phone):
+        return jsonify({
+            "success": False,
+            "message": f"Phone Number must be 3 to {CALLER_PHONE_MAX_LENGTH} digits, spaces, dashes or brackets."
+        }), 400
 
-    # --- NEW: Reverse Geocoding with geopy ---
-    human_readable_address = "Not Provided"
-    if latitude and longitude:
-        try:
-            # Initialize the geolocator with a unique user_agent
-            geolocator = Nominatim(user_agent="anon_healthcare_app_v1")
-            
-            # Use the reverse method to get address from coordinates
-            location = geolocator.reverse(f"{latitude}, {longitude}", exactly_one=True, language='en')
-            
-            if location:
-                human_readable_address = location.address
-            else:
-                human_readable_address = "Could not determine address for the given coordinates."
-                
-        except Exception as e:
-            print(f"Geopy Error: {e}")
-            human_readable_address = "Error looking up address."
+    dispatch_id = uuid.uuid4().hex
+    latitude, longitude = coordinates or (None, None)
 
     # In a real-world application, you would integrate with an emergency dispatch API here.
-    # For this simulation, we will just print the data to the server console.
-    print("=" * 40)
-    print("!!! AMBULANCE DISPATCH REQUEST !!!")
-    print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"Caller Name: {name}")
-    print(f"Caller Phone: {phone}")
-    
-    if latitude and longitude:
-        print(f"Browser Location (PRECISE): {latitude}, {longitude}")
-        print(f"Detected Address (APPROXIMATE): {human_readable_address}")
-        print(f"Google Maps Link: https://www.google.com/maps?q={latitude},{longitude}")
-    else:
-        print("Browser Location: NOT PROVIDED or DENIED")
-    print("=" * 40)
-    
-    return jsonify({
+    # For this simulation, the call is recorded in the dispatch log (DispatchEvent table and JSONL file).
+    dispatch_log.record(
+        dispatch_id=dispatch_id,
+        event_type='requested',
+        caller_name=name,
+        caller_phone=phone,
+        latitude=latitude,
+        longitude=longitude
+    )
+
+    response = {
         "success": True, 
-        "message": "Ambulance dispatched! Help is on the way. Your details have been logged."
-    })
+        "message": "Ambulance dispatched! Help is on the way. Your details have been logged.",
+        "dispatch_id": dispatch_id
+    }
+    if coordinates:
+        geocoder.lookup_async(latitude, longitude,
+                              lambda result: attach_dispatch_address(dispatch_id, latitude, longitude, result))
+        response["address_url"] = url_for('dispatch_address', dispatch_id=dispatch_id)
+    return jsonify(response)
+
+@app.route('/call_ambulance/<dispatch_id>/address')
+def dispatch_address(dispatch_id):
+    """
+    The address found for a dispatch's location: status 'pending' until the lookup
+    has finished and been written to the log (within a second or so of the call).
+    404 for a dispatch that is neither in the database nor waiting in the log.
+    """
+    resolved = DispatchEvent.query.filter_by(dispatch_id=dispatch_id, event_type='address_resolved').first()
+    if resolved is not None:
+        return jsonify({"status": "resolved", "address": resolved.address, "source": resolved.address_source})
+    # Checked before the database, so an event being flushed right now is seen in one place or the other
+    if dispatch_log.is_pending(dispatch_id):
+        return jsonify({"status": "pending"})
+    requested = db.session.query(DispatchEvent.id).filter_by(dispatch_id=dispatch_id, event_type='requested').first()
+    if requested is None:
+        return jsonify({"status": "unknown", "error": "No such dispatch."}), 404
+    return jsonify({"status": "pending"})
+
+@app.route('/dispatches/nearest')
+def nearest_open_dispatch():
+    """The open dispatch closest to ?lat=&lon=, e.g. for the ambulance nearest to a crew's position."""
+    if not is_admin_request():
+        return jsonify({"error": "Access Denied"}), 403
+    coordinates = parse_coordinates(request.args.get('lat'), request.args.get('lon'))
+    if not coordinates:
+        return jsonify({"error": "lat and lon are required."}), 400
+
+    nearest = find_nearest_open_dispatch(*coordinates)
+    if nearest is None:
+        return jsonify({"error": f"No open dispatch within {DISPATCH_SEARCH_RADII_KM[-1]} km."}), 404
+    dispatch_event, distance = nearest
+    return jsonify({"dispatch": dispatch_event_to_dict(dispatch_event), "distance_km": round(distance, 3)})
+
+@app.route('/dispatches/<dispatch_id>/close', methods=['POST'])
+def close_dispatch(dispatch_id):
+    """Marks a dispatch as handled, so the nearest-dispatch search no longer returns it."""
+    if not is_admin_request():
+        return jsonify({"error": "Access Denied"}), 403
+    dispatch_log.record(dispatch_id=dispatch_id, event_type='closed')
+    return jsonify({"success": True, "dispatch_id": dispatch_id})
 
+@app.route('/dispatches/stream')
+def stream_dispatches():
+    """
+    Server-Sent Events feed of the dispatch log: the last ?recent= events (default 50),
+    then every new event as it is written. Each event carries its row id, so a
+    reconnecting EventSource resumes from Last-Event-ID without gaps or repeats.
+    """
+    if not is_admin_request():
+        return jsonify({"error": "Access Denied"}), 403
+
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    recent = min(request.args.get('recent', 50, type=int), 500)
+
+    def generate():
+        if last_event_id is not None:
+            last_id = last_event_id
+        else:
+            backlog = DispatchEvent.query.order_by(DispatchEvent.id.desc()).limit(recent).all()
+            last_id = backlog[0].id if backlog else 0
+            for row in reversed(backlog):
+                yield sse_event(dispatch_event_to_dict(row), event='dispatch', event_id=row.id)
+
+        stop_at = time.monotonic() + MAX_DISPATCH_STREAM_SECONDS
+        while time.monotonic() < stop_at:
+            rows = DispatchEvent.query.filter(DispatchEvent.id > last_id).order_by(DispatchEvent.id).limit(500).all()
+            # Serialised first: the rollback expires the rows, and reading them again would start a new transaction
+            new_events = [dispatch_event_to_dict(row) for row in rows]
+            db.session.rollback() # End the read transaction so the next poll sees newly written rows
+            for payload in new_events:
+                yield sse_event(payload, event='dispatch', event_id=payload['id'])
+                last_id = payload['id']
+            if not new_events:
+                yield ": keep-alive\n\n"
+                time.sleep(app.config['DISPATCH_LOG_FLUSH_SECONDS'] * 2)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+CHAT_PROMPT_TEMPLATE = """
+        You are an Emergency First Aid Assistant Chatbot. Your role is to:
+        1. Analyze the user's emergency situation described in their message.
+        2. Provide immediate, clear, and actionable first aid guidance using simple language and Markdown lists.
+        3. ALWAYS prioritize advising the user to call emergency services if the situation sounds serious.
+        4. Be calm and reassuring.
+        
+        User's emergency situation: "{user_message}"
+        
+        Provide a helpful, step-by-step response. Start with the most critical action.
+        """
 
 # 4. API route for handling the interactive chatbot messages
 @app.route('/chat_response', methods=['POST'])
@@ -1128,44 +2790,55 @@ def chat_response():
     if not user_message:
         return jsonify({"response": "I'm sorry, I didn't receive a message."}), 400
 
-    if not gemini_model:
+    if not cache_bypassed():
+        cached = chat_cache.lookup(user_message)
+        if cached:
+            return jsonify({"response": cached.response, "cached": True}), 200, {'X-Cache': 'HIT'}
+
+    if not llm.available:
         return jsonify({"error": "AI service is not configured."}), 500
 
     try:
-        prompt = f"""
-        You are an Emergency First Aid Assistant Chatbot. Your role is to:
-        1. Analyze the user's emergency situation described in their message.
-        2. Provide immediate, clear, and actionable first aid guidance using simple language and Markdown lists.
-        3. ALWAYS prioritize advising the user to call emergency services if the situation sounds serious.
-        4. Be calm and reassuring.
-        
-        User's emergency situation: "{user_message}"
-        
-        Provide a helpful, step-by-step response. Start with the most critical action.
-        """
+        prompt = CHAT_PROMPT_TEMPLATE.format(user_message=user_message)
         
-        response = gemini_model.generate_content(prompt)
-        bot_response = response.candidates[0].content.parts[0].text.strip()
+        bot_response = llm.generate(prompt, 'chat_response')
+        chat_cache.store(user_message, bot_response)
         
-        return jsonify({"response": bot_response})
+        return jsonify({"response": bot_response}), 200, {'X-Cache': 'MISS'}
     except Exception as e:
         print(f"Chatbot Error: {e}")
         return jsonify({"error": "Sorry, I could not process your request right now."}), 500
 
+@app.route('/chat_response/stream', methods=['POST'])
+def chat_response_stream():
+    """Streaming version of /chat_response: tokens are sent to the browser as soon as Gemini produces them."""
+    data = request.get_json()
+    user_message = data.get('message')
+
+    if not user_message:
+        return jsonify({"response": "I'm sorry, I didn't receive a message."}), 400
+
+    if not cache_bypassed():
+        cached = chat_cache.lookup(user_message)
+        if cached:
+            return cached_stream_response(cached.response)
+
+    if not llm.available:
+        return jsonify({"error": "AI service is not configured."}), 500
+
+    prompt = CHAT_PROMPT_TEMPLATE.format(user_message=user_message)
+    return stream_ai_response(
+        prompt, 'chat_response', "Sorry, I could not process your request right now.",
+        on_complete=lambda text: chat_cache.store(user_message, text)
+    )
+
 # --- END: Routes for Emergency Guide Page ---
 # --- REPLACE your old get_exercise_plan function with this ---
 # Environment variable for ExerciseDB API Key
 # In app.py, REPLACE the get_exercise_names function
 
 def get_exercise_names(medical_conditions: str) -> list:
-    if not gemini_model:
-        raise Exception("AI service is not configured.")
-
-    available_exercises = [
-        "walking", "arm_circles", "wall_push_up", "seated_leg_raise", 
-        "bodyweight_squat", "glute_bridge", "jumping_jacks", "plank",
-        "cat_cow_stretch", "bird_dog"
-    ]
+    available_exercises = EXERCISE_LIST
     
     prompt = f"""
     You are an AI fitness advisor. Your task is to select 5 safe, low-impact exercises for a person with these medical conditions: "{medical_conditions}".
@@ -1173,18 +2846,40 @@ def get_exercise_names(medical_conditions: str) -> list:
     Your response MUST be ONLY a JSON-formatted list of strings.
     """
     
-    response = gemini_model.generate_content(prompt)
-    
-    if response and response.candidates:
-        json_string = response.candidates[0].content.parts[0].text.strip().replace("`", "").replace("json", "")
+    json_string = llm.generate(prompt, 'exercise_names').replace("`", "").replace("json", "")
+    try:
+        exercise_list = json.loads(json_string)
+        # Final check to ensure AI didn't invent an exercise
+        return [ex for ex in exercise_list if ex in available_exercises]
+    except json.JSONDecodeError:
+        raise Exception("AI did not return a valid JSON list.")
+
+def get_exercise_selection(profile) -> list:
+    """
+    Returns the exercises for a profile's medical history. The selection is
+    stored on the profile and reused until the (normalised) history changes.
+    Histories the local rules fully cover never reach the AI; if the AI
+    fails, the rules decide anyway.
+    """
+    key = selection_key(profile.medical_history)
+    if profile.exercise_selection and profile.exercise_selection_key == key:
+        return json.loads(profile.exercise_selection)
+
+    exercise_names = select_by_rules(profile.medical_history)
+    if exercise_names is None:
         try:
-            exercise_list = json.loads(json_string)
-            # Final check to ensure AI didn't invent an exercise
-            return [ex for ex in exercise_list if ex in available_exercises]
-        except json.JSONDecodeError:
-            raise Exception("AI did not return a valid JSON list.")
-    else:
-        raise Exception("Could not get a valid response from the AI model.")
+            print("[INFO] Getting exercise names from Gemini...")
+            exercise_names = get_exercise_names(profile.medical_history)
+            print(f"[INFO] Gemini suggested: {exercise_names}")
+        except Exception as e:
+            print(f"AI exercise selection failed, using the local rules instead: {e}")
+            exercise_names = select_by_rules(profile.medical_history, require_known=False)
+
+    if exercise_names:
+        profile.exercise_selection = json.dumps(exercise_names)
+        profile.exercise_selection_key = key
+        db.session.commit()
+    return exercise_names
     
 # In app.py, REPLACE the /get_exercise_plan route
 
@@ -1198,47 +2893,22 @@ def generate_exercise_plan_route():
     if not profile or not profile.medical_history:
         return jsonify({"error": "Please add medical history to generate a plan."})
 
-    # Check if the DALL-E client was configured
-    if not openai_client:
-        return jsonify({"error": "Image generation service is not configured."}), 500
-
     try:
-        # --- Step 1: Get exercise names from Gemini AI (same as before) ---
-        print("[INFO] Getting exercise names from Gemini...")
-        exercise_names = get_exercise_names(profile.medical_history)
-        print(f"[INFO] Gemini suggested: {exercise_names}")
+        # --- Step 1: Choose the exercises (stored selection, local rules, or Gemini) ---
+        exercise_names = get_exercise_selection(profile)
 
-        # --- Step 2: Generate an image for EACH exercise name using DALL-E ---
-        exercise_details_list = []
-        
-        # Define a consistent visual style for all images
-        image_style_prompt = (
-            "A clean, minimalist, vector line art illustration on a plain white background. "
-            "The image should clearly and simply demonstrate the exercise form. "
-            "Anatomically correct, simple black lines, no color, no shadows."
-        )
+        # --- Step 2: Serve the saved illustrations; only missing ones are generated (in parallel) ---
+        if image_llm.available:
+            has_image = exercise_images.ensure(exercise_names, timeout=app.config['EXERCISE_IMAGE_WAIT_SECONDS'])
+        else:
+            has_image = {name: exercise_images.has_image(name) for name in exercise_names}
 
+        exercise_details_list = []
         for name in exercise_names:
-            print(f"[INFO] Generating image for '{name}' via DALL-E...")
-            
-            # Create a detailed prompt for the image generation model
-            dalle_prompt = f"An illustration of a person performing the '{name.replace('_', ' ')}' exercise. {image_style_prompt}"
-
-            # Make the API call to DALL-E
-            response = openai_client.images.generate(
-                model="dall-e-3",
-                prompt=dalle_prompt,
-                size="1024x1024", # A standard square size
-                quality="standard",
-                n=1,
-            )
-            
-            # The API returns a temporary URL to the generated image
-            image_url = response.data[0].url
-            
             exercise_details_list.append({
                 "name": name.replace("_", " ").title(),
-                "gifUrl": image_url, # This is now the LIVE URL from DALL-E
+                # Empty when the image isn't available yet; the dashboard shows a placeholder
+                "gifUrl": url_for('static', filename=f'exercises/{name}.png') if has_image[name] else "",
                 "equipment": "Body Weight",
                 "instructions": ["Follow the motion shown in the illustration.", "Perform 10-12 repetitions."]
             })
@@ -1250,67 +2920,71 @@ def generate_exercise_plan_route():
     except Exception as e:
         print(f"--- [CRITICAL ERROR] Live Image Generation Failed: {e} ---")
         return jsonify({"error": "Could not generate a complete exercise plan at this time."}), 500
+@app.route('/debug/text_cache_stats')
+def text_cache_stats():
+    # Security: This route should only be accessible in debug mode
+    if not app.debug:
+        return "This feature is only available in debug mode.", 403
+    return jsonify(text_cache.stats())
+
+@app.route('/debug/semantic_cache_stats')
+def semantic_cache_stats():
+    # Security: This route should only be accessible in debug mode
+    if not app.debug:
+        return "This feature is only available in debug mode.", 403
+    return jsonify(chat_cache.stats())
+
+@app.route('/debug/mail_queue')
+def mail_queue_stats():
+    # Security: This route should only be accessible in debug mode
+    if not app.debug:
+        return "This feature is only available in debug mode.", 403
+    counts = dict(db.session.query(OutboundEmail.status, func.count(OutboundEmail.id)).group_by(OutboundEmail.status).all())
+    oldest_queued = db.session.query(func.min(OutboundEmail.created_at)).filter(OutboundEmail.status == 'queued').scalar()
+    dead_letters = OutboundEmail.query.filter_by(status='dead').order_by(OutboundEmail.id.desc()).limit(20).all()
+    return jsonify({
+        "counts": counts,
+        "oldest_queued_seconds": (datetime.utcnow() - oldest_queued).total_seconds() if oldest_queued else None,
+        "dead_letters": [
+            {"id": e.id, "to": e.to_email, "subject": e.subject, "attempts": e.attempts, "last_error": e.last_error}
+            for e in dead_letters
+        ]
+    })
+
+@app.route('/debug/metrics')
+def metrics_snapshot():
+    # Security: This route should only be accessible in debug mode
+    if not app.debug:
+        return "This feature is only available in debug mode.", 403
+    return jsonify(metrics.snapshot())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Every metric in the Prometheus text format, for scraping (send the admin token as X-Admin-Token)."""
+    if not is_admin_request():
+        return jsonify({"error": "Access Denied"}), 403
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/debug/generate_exercise_assets')
 def generate_exercise_assets():
     # Security: This route should only be accessible in debug mode
     if not app.debug:
         return "This feature is only available in debug mode.", 403
 
-    if not openai_client:
+    if not image_llm.available:
         return "OpenAI client is not configured. Cannot generate images.", 500
 
-    # --- Configuration ---
-    # This list MUST match the names in your get_exercise_names() AI prompt
-    EXERCISE_LIST = [
-        "walking", "arm_circles", "wall_push_up", "seated_leg_raise", 
-        "bodyweight_squat", "glute_bridge", "jumping_jacks", "plank",
-        "cat_cow_stretch", "bird_dog"
-    ]
-    OUTPUT_FOLDER = os.path.join(app.static_folder, 'exercises') # Correctly points to 'static/exercises'
-    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-    IMAGE_STYLE_PROMPT = (
-        "A clean, minimalist, vector line art illustration on a plain white background. "
-        "The image should clearly and simply demonstrate the exercise form. "
-        "Anatomically correct, simple black lines, no color, no shadows. "
-        "Focus on the movement and proper posture."
-    )
-
     results = []
+    has_image = {name: exercise_images.has_image(name) for name in EXERCISE_LIST}
+    generated = exercise_images.ensure([name for name in EXERCISE_LIST if not has_image[name]])
 
     for exercise_name in EXERCISE_LIST:
-        file_path = os.path.join(OUTPUT_FOLDER, f"{exercise_name}.png")
-        if os.path.exists(file_path):
-            message = f"✅ Image for '{exercise_name}' already exists. Skipping."
-            print(message)
-            results.append(message)
-            continue
-
-        prompt = f"An illustration of a person performing the '{exercise_name.replace('_', ' ')}' exercise. {IMAGE_STYLE_PROMPT}"
-        print(f"Generating image for: '{exercise_name}'...")
-        
-        try:
-            response = openai_client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                size="1024x1024",
-                quality="standard",
-                n=1,
-            )
-            image_url = response.data[0].url
-            image_data = requests.get(image_url).content
-            
-            with open(file_path, 'wb') as handler:
-                handler.write(image_data)
-            
-            message = f"✅ Successfully generated and saved image to {file_path}"
-            print(message)
-            results.append(message)
-            
-        except Exception as e:
-            message = f"❌ Failed to generate image for '{exercise_name}'. Error: {e}"
-            print(message)
-            results.append(message)
+        if has_image[exercise_name]:
+            results.append(f"✅ Image for '{exercise_name}' already exists. Skipping.")
+        elif generated[exercise_name]:
+            results.append(f"✅ Successfully generated and saved image to {exercise_images.path(exercise_name)}")
+        else:
+            results.append(f"❌ Failed to generate image for '{exercise_name}'. See the server log for the error.")
     
     # Return a simple HTML page with the results
     return f"""
@@ -1320,14 +2994,18 @@ def generate_exercise_assets():
     </ul>
     """
 
+# --- Resume background jobs left over from the last run ---
+try:
+    with app.app_context():
+        resume_pending_jobs()
+except Exception as e:
+    print(f"WARNING: Could not resume pending document jobs. Error: {e}")
+
 # --- Main execution ---
 if __name__ == '__main__':
     # Important: Before running for the first time, make sure you have:
-    # 1. A MySQL database named 'hospital_db' created.
-    # 2. Run the commands in your terminal to create the tables:
+    # 1. A MySQL database named 'hospital_db' created (or DATABASE_URL set).
+    # 2. Created / updated the tables by applying the migrations in migrations/:
     #    - set FLASK_APP=app.py  (or export FLASK_APP=app.py)
-    #    - flask shell
-    #    - from app import db
-    #    - db.create_all()
-    #    - exit()
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    #    - flask db upgrade
+    app.run(debug=True, host='0.0.0.0')
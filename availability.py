@@ -0,0 +1,96 @@
+"""
+In-memory index of booked appointment slots, for answering "what is free?"
+without touching the database.
+
+Each (doctor, day) is a bitmap of 5-minute cells; a booking sets the cells
+it covers. A slot is free when none of its cells are set, so the index keeps
+working if a doctor's slot length or hours change. Days are loaded from the
+database on first use and updated incrementally on book/cancel. Entries
+expire after `ttl_seconds` so bookings made by other worker processes show
+up; the database's unique constraint on reservations is what actually
+prevents double-booking.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+CELL_MINUTES = 5
+
+# Working hours of a doctor: start/end are datetime.time, slot_minutes a multiple of CELL_MINUTES
+Schedule = namedtuple('Schedule', ['start', 'end', 'slot_minutes'])
+
+
+def _cell(moment):
+    return (moment.hour * 60 + moment.minute) // CELL_MINUTES
+
+
+def _mask(start_cell, cells):
+    return ((1 << cells) - 1) << start_cell
+
+
+class SlotIndex:
+    def __init__(self, load_booked, ttl_seconds=60, max_days=10000):
+        """`load_booked(doctor_id, day)` returns [(start datetime, length in minutes)] booked that day."""
+        self._load_booked = load_booked
+        self.ttl_seconds = ttl_seconds
+        self.max_days = max_days
+        self._lock = threading.Lock()
+        self._days = OrderedDict()  # (doctor_id, date) -> (bitmap, loaded_at)
+
+    def slots(self, doctor_id, day, schedule):
+        """Returns [(slot start datetime, is free)] for every slot in the doctor's working hours."""
+        bitmap = self._bitmap(doctor_id, day)
+        cells_per_slot = schedule.slot_minutes // CELL_MINUTES
+        result = []
+        moment = datetime.combine(day, schedule.start)
+        end = datetime.combine(day, schedule.end)
+        while moment + timedelta(minutes=schedule.slot_minutes) <= end:
+            result.append((moment, not bitmap & _mask(_cell(moment), cells_per_slot)))
+            moment += timedelta(minutes=schedule.slot_minutes)
+        return result
+
+    def mark_booked(self, doctor_id, start, slot_minutes):
+        self._update(doctor_id, start, slot_minutes, booked=True)
+
+    def mark_free(self, doctor_id, start, slot_minutes):
+        self._update(doctor_id, start, slot_minutes, booked=False)
+
+    def invalidate(self, doctor_id, day):
+        with self._lock:
+            self._days.pop((doctor_id, day), None)
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+
+    # --- Internals ---
+
+    def _bitmap(self, doctor_id, day):
+        key = (doctor_id, day)
+        with self._lock:
+            entry = self._days.get(key)
+            if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+                self._days.move_to_end(key)
+                return entry[0]
+
+        bitmap = 0
+        for start, minutes in self._load_booked(doctor_id, day):
+            bitmap |= _mask(_cell(start), max(1, minutes // CELL_MINUTES))
+
+        with self._lock:
+            self._days[key] = (bitmap, time.monotonic())
+            self._days.move_to_end(key)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+        return bitmap
+
+    def _update(self, doctor_id, start, slot_minutes, booked):
+        key = (doctor_id, start.date())
+        mask = _mask(_cell(start), max(1, slot_minutes // CELL_MINUTES))
+        with self._lock:
+            entry = self._days.get(key)
+            if entry is None:
+                return  # Not cached; it will be loaded from the database when asked for
+            bitmap = entry[0] | mask if booked else entry[0] & ~mask
+            self._days[key] = (bitmap, entry[1])
@@ -0,0 +1,234 @@
+"""
+Content-addressed storage for uploaded documents.
+
+A blob is stored once under the SHA-256 of its bytes, at the sharded key
+`ab/cd/<sha256>` (the first two byte pairs of the hash), so identical files
+uploaded by different people share one copy and no directory grows past a
+few thousand entries. Uploads are streamed to a temporary file in chunks
+while being hashed, then moved into place under their hash.
+
+Where the bytes live is up to the backend:
+  * LocalBackend: files under a directory on this machine
+  * ObjectStoreBackend: an S3-style object store client (put_object /
+    get_object / head_object / delete_object); LocalObjectStoreClient is a
+    stand-in that keeps objects in a directory. Blobs are downloaded into a
+    local cache when code needs a file path (OCR, PDF parsing).
+
+The store only deals in bytes; app.py keeps refcounts in the Blob table.
+An upload is staged (hashed into a temporary file) first and only stored
+once its reference is committed: scripts/gc_blobs.py deletes bytes while it
+holds the unreferenced row, so checking for the bytes after committing the
+reference can't race with a collection of the same blob.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_key(sha256):
+    """The sharded key a blob is stored under: ab/cd/<sha256>."""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def _check_hash(sha256):
+    if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+        raise ValueError(f"Not a SHA-256 hex digest: {sha256!r}")
+
+
+class LocalBackend:
+    """Blobs as files under `root`."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put_file(self, key, source_path):
+        """Moves `source_path` (on the same filesystem) into place; atomic, so readers never see half a blob."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def local_path(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        return path
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class LocalObjectStoreClient:
+    """
+    Stand-in for an object store bucket with the subset of the S3 client API
+    that ObjectStoreBackend uses. Objects are files under `root`, named by key.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put_object(self, Key, Body):
+        path = self._path(Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.part"
+        with open(temp_path, 'wb') as f:
+            shutil.copyfileobj(Body, f, CHUNK_SIZE)
+        os.replace(temp_path, path)
+
+    def get_object(self, Key):
+        return {'Body': open(self._path(Key), 'rb')}
+
+    def head_object(self, Key):
+        """Raises FileNotFoundError if there is no such object (a real client raises its own 404 error)."""
+        return {'ContentLength': os.path.getsize(self._path(Key))}
+
+    def delete_object(self, Key):
+        try:
+            os.remove(self._path(Key))
+        except FileNotFoundError:
+            pass
+
+
+class ObjectStoreBackend:
+    """Blobs in an object store, under `prefix`. `local_path` downloads into `cache_dir` on first use."""
+
+    def __init__(self, client, cache_dir, prefix='blobs/', not_found_errors=(FileNotFoundError,)):
+        self.client = client
+        self.cache = LocalBackend(cache_dir)  # Blobs never change, so cached copies never go stale
+        self.prefix = prefix
+        self.not_found_errors = not_found_errors
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Key=self.prefix + key)
+            return True
+        except self.not_found_errors:
+            return False
+
+    def put_file(self, key, source_path):
+        with open(source_path, 'rb') as f:
+            self.client.put_object(Key=self.prefix + key, Body=f)
+        self.cache.put_file(key, source_path)  # The uploader is likely to read it back soon (analysis)
+
+    def open(self, key):
+        if self.cache.exists(key):
+            return self.cache.open(key)
+        return self.client.get_object(Key=self.prefix + key)['Body']
+
+    def local_path(self, key):
+        if not self.cache.exists(key):
+            fd, temp_path = tempfile.mkstemp(dir=self.cache.root, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    body = self.client.get_object(Key=self.prefix + key)['Body']
+                    try:
+                        shutil.copyfileobj(body, f, CHUNK_SIZE)
+                    finally:
+                        body.close()
+                self.cache.put_file(key, temp_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return self.cache.local_path(key)
+
+    def delete(self, key):
+        self.client.delete_object(Key=self.prefix + key)
+        self.cache.delete(key)
+
+
+class StagedBlob:
+    """
+    An upload hashed into a temporary file but not stored yet. Use it as a
+    context manager; the temporary file is removed on exit.
+    """
+
+    def __init__(self, backend, sha256, size, temp_path):
+        self.backend = backend
+        self.sha256 = sha256
+        self.size = size
+        self.temp_path = temp_path
+
+    def store(self):
+        """Moves the bytes into the store unless they are already there. Returns True if they were written."""
+        key = blob_key(self.sha256)
+        if self.backend.exists(key):
+            return False
+        self.backend.put_file(key, self.temp_path)
+        return True
+
+    def discard(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.discard()
+
+
+class BlobStore:
+    def __init__(self, backend, temp_dir):
+        self.backend = backend
+        self.temp_dir = temp_dir  # Must be on the same filesystem as a LocalBackend's root
+        os.makedirs(temp_dir, exist_ok=True)
+
+    def stage(self, stream):
+        """Reads a binary stream into a temporary file while hashing it. Returns a StagedBlob."""
+        sha = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return StagedBlob(self.backend, sha.hexdigest(), size, temp_path)
+
+    def put_stream(self, stream):
+        """
+        Stores everything read from a binary stream. Returns (sha256, size, created),
+        where created is False if an identical blob was already stored.
+        """
+        with self.stage(stream) as staged:
+            return staged.sha256, staged.size, staged.store()
+
+    def exists(self, sha256):
+        _check_hash(sha256)
+        return self.backend.exists(blob_key(sha256))
+
+    def open(self, sha256):
+        _check_hash(sha256)
+        return self.backend.open(blob_key(sha256))
+
+    def local_path(self, sha256):
+        """A path to the blob's bytes on this machine, for code that needs a real file. Raises FileNotFoundError."""
+        _check_hash(sha256)
+        return self.backend.local_path(blob_key(sha256))
+
+    def delete(self, sha256):
+        _check_hash(sha256)
+        self.backend.delete(blob_key(sha256))
@@ -0,0 +1,160 @@
+"""
+Append-only log of ambulance dispatch events.
+
+Requests only append an event to an in-memory buffer, which never blocks on
+I/O. A background thread flushes the buffer every `flush_seconds` (sooner
+once `max_batch` events are waiting):
+  1. every event is appended to a JSONL file, one JSON object per line, as a
+     local record that doesn't depend on the database;
+  2. the same events are inserted into the database in one multi-row insert
+     by `write_rows(rows)`, supplied by app.py.
+
+If the database is unavailable (one of `transient_errors`), the events stay
+queued for it and are retried on the next flush; the JSONL file already has
+them. Any other failure is blamed on the rows: they are retried one at a
+time, and rows that still fail are dead-lettered - appended to
+`<name>.dead.jsonl` with the error - so one bad row can't hold up the rest.
+At most `max_pending` events wait for the database; older ones are
+dead-lettered beyond that. Events are flushed at exit, too.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import metrics
+
+flush_seconds_histogram = metrics.histogram('dispatch_log_flush_seconds', 'Time one dispatch log flush took')
+events_total = metrics.counter('dispatch_log_events_total', 'Dispatch events written, by destination')
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+class DispatchLog:
+    def __init__(self, jsonl_path, write_rows, flush_seconds=0.5, max_batch=1000, max_pending=100_000,
+                 transient_errors=()):
+        self.jsonl_path = jsonl_path
+        self.dead_letter_path = os.path.splitext(jsonl_path)[0] + '.dead.jsonl'
+        self._write_rows = write_rows
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.transient_errors = tuple(transient_errors)  # Errors meaning the database is down, not the rows bad
+        self._buffer = deque()        # Events not yet written anywhere
+        self._db_pending = []         # Events in the JSONL file but not yet in the database
+        self._flush_lock = threading.Lock()
+        self._move_lock = threading.Lock()  # Held while events move from the buffer to _db_pending
+        self._wake = threading.Event()
+        os.makedirs(os.path.dirname(jsonl_path) or '.', exist_ok=True)
+
+        self._thread = threading.Thread(target=self._run, name='dispatch-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def record(self, **event):
+        """Queues an event (a dict of column values). Returns immediately."""
+        event.setdefault('created_at', datetime.utcnow())
+        self._buffer.append(event)  # deque.append is thread-safe
+        if len(self._buffer) >= self.max_batch:
+            self._wake.set()
+
+    @property
+    def pending(self):
+        """Events not yet in the database."""
+        return len(self._buffer) + len(self._db_pending)
+
+    def is_pending(self, dispatch_id):
+        """Whether an event of this dispatch is still waiting to be written to the database."""
+        with self._move_lock:
+            return any(event.get('dispatch_id') == dispatch_id
+                       for events in (list(self._buffer), self._db_pending) for event in events)
+
+    def flush(self):
+        with self._flush_lock:
+            started = time.monotonic()
+            with self._move_lock:
+                batch = []
+                while self._buffer:
+                    batch.append(self._buffer.popleft())
+                self._db_pending.extend(batch)
+
+            if batch:
+                try:
+                    with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                        f.write(''.join(json.dumps(event, default=_json_default) + '\n' for event in batch))
+                    events_total.inc(len(batch), destination='jsonl')
+                except OSError as e:
+                    print(f"Could not append {len(batch)} dispatch events to {self.jsonl_path}: {e}")
+
+            if self._db_pending:
+                self._write_pending()
+            if len(self._db_pending) > self.max_pending:
+                with self._move_lock:
+                    overflow = self._db_pending[:-self.max_pending]
+                    self._db_pending = self._db_pending[-self.max_pending:]
+                self._dead_letter([(event, "database queue full") for event in overflow])
+
+            if batch:
+                flush_seconds_histogram.observe(time.monotonic() - started)
+
+    def _write_pending(self):
+        """Writes _db_pending to the database: in one insert, or row by row if that fails."""
+        pending = self._db_pending
+        try:
+            self._write_rows(pending)
+        except self.transient_errors as e:
+            print(f"Could not write {len(pending)} dispatch events to the database, will retry: {e}")
+            return
+        except Exception as e:
+            print(f"Could not write {len(pending)} dispatch events to the database, retrying them one by one: {e}")
+        else:
+            events_total.inc(len(pending), destination='database')
+            with self._move_lock:
+                del self._db_pending[:len(pending)]
+            return
+
+        written, failed = 0, []
+        for position, event in enumerate(pending):
+            try:
+                self._write_rows([event])
+                written += 1
+            except self.transient_errors as e:
+                print(f"Could not write dispatch events to the database, will retry: {e}")
+                break
+            except Exception as e:
+                failed.append((event, str(e)))
+        else:
+            position = len(pending)
+        events_total.inc(written, destination='database')
+        with self._move_lock:
+            del self._db_pending[:position]  # Rows from the first transient failure on are retried next time
+        self._dead_letter(failed)
+
+    def _dead_letter(self, failed):
+        """Sets aside events the database won't take: (event, reason) pairs."""
+        if not failed:
+            return
+        print(f"Dead-lettering {len(failed)} dispatch events to {self.dead_letter_path}: {failed[0][1]}")
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps({'event': event, 'error': reason}, default=_json_default) + '\n'
+                                for event, reason in failed))
+        except OSError as e:
+            print(f"Could not append {len(failed)} events to {self.dead_letter_path}: {e}")
+        events_total.inc(len(failed), destination='dead_letter')
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Dispatch log flush failed: {e}")
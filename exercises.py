@@ -0,0 +1,205 @@
+"""
+Exercise catalogue, rule-based exercise selection and the on-disk cache of
+exercise illustrations.
+
+Selection: a medical history whose every condition is covered by
+CONDITION_RULES is answered locally; anything else is left to the AI
+selector in app.py, with the rules as the fallback if it fails.
+
+Illustrations live in static/exercises/<name>.png. The plan endpoint serves
+whatever is already there and only generates the missing images, in
+parallel on a small bounded pool; each finished image is saved so an
+exercise is illustrated once per deployment.
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+# The AI exercise selector must choose from this list, and every entry gets an illustration
+EXERCISE_LIST = [
+    "walking", "arm_circles", "wall_push_up", "seated_leg_raise",
+    "bodyweight_squat", "glute_bridge", "jumping_jacks", "plank",
+    "cat_cow_stretch", "bird_dog"
+]
+
+EXERCISES_PER_PLAN = 5
+
+# Order in which the rule-based selector prefers exercises (lowest impact first)
+RULE_PREFERENCE = [
+    "walking", "seated_leg_raise", "cat_cow_stretch", "arm_circles", "glute_bridge",
+    "wall_push_up", "bird_dog", "bodyweight_squat", "plank", "jumping_jacks"
+]
+
+# Condition keyword -> exercises to avoid with that condition
+CONDITION_RULES = {
+    'asthma': {"jumping_jacks"},
+    'copd': {"jumping_jacks", "plank", "bodyweight_squat"},
+    'hypertension': {"jumping_jacks", "plank"},
+    'blood pressure': {"jumping_jacks", "plank"},
+    'heart': {"jumping_jacks", "plank", "bodyweight_squat"},
+    'cardiac': {"jumping_jacks", "plank", "bodyweight_squat"},
+    'diabetes': {"jumping_jacks"},
+    'obesity': {"jumping_jacks", "plank"},
+    'arthritis': {"jumping_jacks", "bodyweight_squat", "plank"},
+    'knee': {"jumping_jacks", "bodyweight_squat"},
+    'hip': {"jumping_jacks", "bodyweight_squat", "seated_leg_raise"},
+    'back pain': {"jumping_jacks", "plank", "bodyweight_squat"},
+    'spine': {"jumping_jacks", "plank", "bodyweight_squat", "cat_cow_stretch"},
+    'shoulder': {"arm_circles", "wall_push_up", "plank"},
+    'wrist': {"wall_push_up", "plank", "bird_dog"},
+    'osteoporosis': {"jumping_jacks", "cat_cow_stretch"},
+    'pregnant': {"jumping_jacks", "plank", "bodyweight_squat"},
+    'pregnancy': {"jumping_jacks", "plank", "bodyweight_squat"},
+    'vertigo': {"jumping_jacks", "cat_cow_stretch", "bird_dog"},
+    'dizziness': {"jumping_jacks", "cat_cow_stretch", "bird_dog"},
+    'migraine': {"jumping_jacks"},
+    'thyroid': set(),
+    'none': set(),
+    'healthy': set(),
+}
+
+# A rule matches whole words (a trailing 's' allowed), so 'heart' doesn't match 'heartburn'
+_RULE_PATTERNS = {rule: re.compile(rf"\b{re.escape(rule)}s?\b") for rule in CONDITION_RULES}
+
+# Words that may surround a rule's keyword without changing which exercises are safe ("mild asthma",
+# "type 2 diabetes"). A condition with any other word left over ("heart transplant") is not known.
+QUALIFIER_WORDS = set("""
+mild moderate severe chronic acute controlled high low history of type stage 1 2 i ii left right
+disease diseases problem problems issue issues condition conditions pain
+""".split())
+
+# Bump when CONDITION_RULES or the AI selection prompt change, so stored selections are recomputed
+SELECTION_VERSION = 2
+
+IMAGE_STYLE_PROMPT = (
+    "A clean, minimalist, vector line art illustration on a plain white background. "
+    "The image should clearly and simply demonstrate the exercise form. "
+    "Anatomically correct, simple black lines, no color, no shadows. "
+    "Focus on the movement and proper posture."
+)
+
+
+def image_prompt(name: str) -> str:
+    return f"An illustration of a person performing the '{name.replace('_', ' ')}' exercise. {IMAGE_STYLE_PROMPT}"
+
+
+def history_conditions(medical_history: str) -> list:
+    """Splits a free-text medical history into normalised, de-duplicated, sorted condition phrases."""
+    items = re.split(r"[,;\n/]+|\band\b", (medical_history or '').lower())
+    return sorted({' '.join(re.findall(r"[a-z0-9]+", item)) for item in items} - {''})
+
+
+def selection_key(medical_history: str) -> str:
+    """Hash identifying an exercise selection: equal for histories that differ only in case, order or spacing."""
+    normalized = '|'.join(history_conditions(medical_history))
+    return hashlib.sha256(f"v{SELECTION_VERSION}:{normalized}".encode('utf-8')).hexdigest()
+
+
+def is_known_condition(condition: str, matches) -> bool:
+    """True if the rules in `matches` account for the whole condition phrase, qualifiers aside."""
+    if not matches:
+        return False
+    for rule in matches:
+        condition = _RULE_PATTERNS[rule].sub(' ', condition)
+    return all(word in QUALIFIER_WORDS for word in condition.split())
+
+
+def select_by_rules(medical_history: str, require_known=True):
+    """
+    Picks EXERCISES_PER_PLAN exercises that none of the listed conditions rule out.
+    With `require_known`, returns None unless rules cover every condition completely
+    (so the AI can judge anything unusual); otherwise unknown conditions are ignored.
+    """
+    excluded = set()
+    for condition in history_conditions(medical_history):
+        matches = [rule for rule, pattern in _RULE_PATTERNS.items() if pattern.search(condition)]
+        if require_known and not is_known_condition(condition, matches):
+            return None
+        for rule in matches:
+            excluded |= CONDITION_RULES[rule]
+
+    allowed = [name for name in RULE_PREFERENCE if name not in excluded]
+    return allowed[:EXERCISES_PER_PLAN]
+
+
+def fetch_image(url: str, timeout=30) -> bytes:
+    """Returns the bytes behind an image URL (http(s) or a base64 data: URL)."""
+    if url.startswith('data:'):
+        return base64.b64decode(url.split(',', 1)[1])
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+class ExerciseImageCache:
+    """
+    `generate_image(prompt)` must return an image URL; it is only called for
+    exercises that have no image on disk yet, and at most once at a time per
+    exercise even when several requests need the same missing image.
+    """
+
+    def __init__(self, folder, generate_image, max_workers=4):
+        self.folder = folder
+        self._generate_image = generate_image
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exercise-image')
+        self._lock = threading.RLock()  # The done callback runs inline if the future has already finished
+        self._pending = {}  # name -> Future of the generation in progress
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.folder, f"{name}.png")
+
+    def has_image(self, name):
+        return os.path.exists(self.path(name))
+
+    def ensure(self, names, timeout=None):
+        """
+        Makes sure each exercise has an image, generating the missing ones in parallel.
+        Returns {name: True/False}; False means the image failed or wasn't ready
+        within `timeout` seconds (it keeps generating in the background and is saved when done).
+        """
+        futures = {name: self._generation(name) for name in names if not self.has_image(name)}
+        if futures:
+            wait(futures.values(), timeout=timeout)
+
+        available = {}
+        for name in names:
+            future = futures.get(name)
+            if future is None:
+                available[name] = True
+            elif future.done() and future.exception() is None:
+                available[name] = True
+            else:
+                if future.done():
+                    print(f"Failed to generate image for '{name}': {future.exception()}")
+                available[name] = False
+        return available
+
+    def _generation(self, name):
+        with self._lock:
+            future = self._pending.get(name)
+            if future is None:
+                future = self._pending[name] = self._pool.submit(self._generate, name)
+                future.add_done_callback(lambda _: self._finished(name))
+            return future
+
+    def _finished(self, name):
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def _generate(self, name):
+        if self.has_image(name): # Finished by an earlier request in the meantime
+            return
+        print(f"Generating image for: '{name}'...")
+        image_data = fetch_image(self._generate_image(image_prompt(name)))
+
+        tmp_path = f"{self.path(name)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as handler:
+            handler.write(image_data)
+        os.replace(tmp_path, self.path(name))
+        print(f"Saved image to {self.path(name)}")
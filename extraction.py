@@ -0,0 +1,190 @@
+"""
+Text extraction for uploaded medical documents.
+
+PDF pages are fanned out across a process pool. Pages with a text layer are
+read with PyMuPDF; image-only pages (scans) are rasterised and passed through
+Tesseract OCR, as are uploaded images. Before OCR, images are cleaned up and
+checked for blur/blankness (ocr.py) unless the engine was built with
+preprocess=False.
+Extraction is recorded as spans (tracing.py): 'pdf' for the wall time of a
+whole PDF, and 'ocr' for Tesseract. OCR of scanned pages is timed inside the
+workers and reported back, so a PDF's 'ocr' span is summed over workers and
+overlaps its 'pdf' span.
+Routes should not call this directly; go through `get_document_text` in
+app.py so the result is served from the extracted-text cache.
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image
+
+import ocr
+import tracing
+from ocr import UnreadableImageError
+
+PDF_EXTENSIONS = {'pdf'}
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+OCR_DPI = 300  # Resolution scanned PDF pages are rasterised at before OCR
+
+
+def init_worker(tesseract_cmd=None):
+    """
+    Initializer for OCR worker processes.
+    Spawned workers (e.g. on Windows) don't inherit the Tesseract path that
+    app.py configures, so it is passed in explicitly.
+    """
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+
+def file_extension(filename: str) -> str:
+    """Returns the lower-cased extension of a filename without the dot."""
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+# Leading bytes of the file types we read, for files stored without an extension (blobs)
+_MAGIC_NUMBERS = ((b'%PDF', 'pdf'), (b'\x89PNG', 'png'), (b'\xff\xd8\xff', 'jpg'))
+
+
+def sniff_extension(filepath: str) -> str:
+    """Returns the extension matching the file's contents ('pdf', 'png', 'jpg'), or ''."""
+    with open(filepath, 'rb') as f:
+        head = f.read(8)
+    return next((extension for magic, extension in _MAGIC_NUMBERS if head.startswith(magic)), '')
+
+
+def is_extractable(filename: str) -> bool:
+    """True if we know how to pull text out of this kind of file."""
+    return file_extension(filename) in PDF_EXTENSIONS | IMAGE_EXTENSIONS
+
+
+# --- Worker functions (run inside the process pool, so they must be top-level) ---
+
+def _page_text(page, ocr_dpi, preprocess):
+    """Returns (text, seconds spent in OCR). A scanned page that fails the quality gate reads as empty."""
+    text = page.get_text()
+    if text.strip() or not page.get_images(full=False):
+        return text, 0.0
+
+    # Image-only page: render it and OCR the pixels
+    started = time.perf_counter()
+    pixmap = page.get_pixmap(dpi=ocr_dpi)
+    image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    try:
+        text = ocr.read_text(image, preprocess)
+    except UnreadableImageError:
+        text = ""
+    return text, time.perf_counter() - started
+
+
+def extract_pdf_pages(filepath, first_page, last_page, ocr_dpi=OCR_DPI, preprocess=True):
+    """
+    Returns the text of pages [first_page, last_page) of a PDF, one string per page,
+    and the seconds spent on OCR for them.
+    """
+    with fitz.open(filepath) as pdf_doc:
+        results = [_page_text(pdf_doc[number], ocr_dpi, preprocess) for number in range(first_page, last_page)]
+    return [text for text, _ in results], sum(seconds for _, seconds in results)
+
+
+def ocr_image_file(filepath, preprocess=True):
+    """Returns the OCR text of an image file. Raises UnreadableImageError if it is blank or too blurry."""
+    with Image.open(filepath) as image:
+        return ocr.read_text(image, preprocess)
+
+
+class ExtractionEngine:
+    """
+    Extracts document text using a shared pool of worker processes.
+    A PDF is split into runs of consecutive pages so every worker gets a
+    share of the document; the per-page results are joined once at the end.
+    """
+
+    def __init__(self, max_workers=None, max_pages=200, ocr_dpi=OCR_DPI, tesseract_cmd=None, preprocess=True):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pages = max_pages
+        self.ocr_dpi = ocr_dpi
+        self.preprocess = preprocess
+        self._tesseract_cmd = tesseract_cmd
+        self._pool = None  # Created on first use so importing the app doesn't fork
+        self._lock = threading.Lock()
+
+    def extract(self, filepath: str) -> str:
+        """
+        Returns the text of a PDF or image file, or an empty string for file
+        types we cannot read. Only the first `max_pages` pages of a PDF are read.
+        Files without an extension (blobs) are identified by their contents.
+        Raises UnreadableImageError for an image too blurry or blank to OCR.
+        """
+        extension = file_extension(filepath) or sniff_extension(filepath)
+
+        if extension in IMAGE_EXTENSIONS:
+            with tracing.span('ocr'):
+                return self._run(lambda pool: pool.submit(ocr_image_file, filepath, self.preprocess).result())
+
+        if extension in PDF_EXTENSIONS:
+            started = time.perf_counter()
+            with fitz.open(filepath) as pdf_doc:
+                total_pages = pdf_doc.page_count
+            page_count = min(total_pages, self.max_pages)
+            if page_count < total_pages:
+                print(f"WARNING: {filepath} has {total_pages} pages; only the first {page_count} were extracted.")
+            text, ocr_seconds = self._run(lambda pool: self._extract_pdf(pool, filepath, page_count))
+            tracing.record_span('pdf', time.perf_counter() - started)
+            if ocr_seconds:
+                tracing.record_span('ocr', ocr_seconds)
+            return text
+
+        return ""
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _extract_pdf(self, pool, filepath, page_count):
+        if page_count == 0:
+            return "", 0.0
+
+        # Two runs per worker evens out pages that need OCR against pages that don't
+        pages_per_task = max(1, math.ceil(page_count / (self.max_workers * 2)))
+        futures = [
+            pool.submit(extract_pdf_pages, filepath, first, min(first + pages_per_task, page_count),
+                        self.ocr_dpi, self.preprocess)
+            for first in range(0, page_count, pages_per_task)
+        ]
+
+        pages, ocr_seconds = [], 0.0
+        for future in futures:
+            texts, seconds = future.result()
+            pages.extend(texts)
+            ocr_seconds += seconds
+        return "\n".join(pages), ocr_seconds
+
+    def _run(self, work):
+        pool = self._get_pool()
+        try:
+            return work(pool)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next document
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=init_worker,
+                    initargs=(self._tesseract_cmd,)
+                )
+            return self._pool
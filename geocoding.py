@@ -0,0 +1,164 @@
+"""
+Reverse geocoding for ambulance dispatch.
+
+A ReverseGeocoder wraps one shared provider client (Nominatim) and adds:
+  * a TTL cache keyed on the location rounded to CACHE_DECIMALS places (about 11 m),
+    so repeat calls from the same spot don't hit the provider
+  * a token bucket that keeps calls within the provider's rate limit
+    (Nominatim's usage policy allows one request per second)
+  * an offline fallback: when the bucket is empty or the provider is slow or
+    down, the address is the nearest place in a bundled gazetteer
+    (data/gazetteer.csv), found with a haversine BallTree
+
+Dispatch must never wait on any of this: `lookup_async` resolves the address
+on a small pool and hands it to a callback.
+"""
+import csv
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import tracing
+
+CACHE_DECIMALS = 4
+EARTH_RADIUS_KM = 6371.0
+
+lookups_total = metrics.counter('geocode_lookups_total', 'Reverse geocoding lookups by where the address came from')
+provider_seconds = metrics.histogram('geocode_provider_seconds', 'Time the reverse geocoding provider took to answer')
+
+# source is 'cache', 'provider', 'gazetteer' or 'none'
+GeocodeResult = namedtuple('GeocodeResult', ['address', 'source'])
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle (haversine) distance between two points."""
+    lat1, lat2 = math.radians(latitude1), math.radians(latitude2)
+    dlat, dlon = lat2 - lat1, math.radians(longitude2 - longitude1)
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Takes a token if one is available. Never waits."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Gazetteer:
+    """
+    Bundled list of places (CSV with name, region, country, latitude, longitude).
+    A larger file - e.g. GeoNames' cities15000 converted to these columns - can be
+    dropped in through GAZETTEER_PATH.
+    """
+
+    def __init__(self, path):
+        from sklearn.neighbors import BallTree
+
+        with open(path, newline='', encoding='utf-8') as f:
+            self.places = list(csv.DictReader(f))
+        points = [[math.radians(float(p['latitude'])), math.radians(float(p['longitude']))] for p in self.places]
+        self._tree = BallTree(points, metric='haversine')
+
+    def nearest(self, latitude, longitude):
+        """Returns (place row, distance in km) for the closest place."""
+        distances, indices = self._tree.query([[math.radians(latitude), math.radians(longitude)]], k=1)
+        return self.places[indices[0][0]], distances[0][0] * EARTH_RADIUS_KM
+
+    def describe(self, latitude, longitude):
+        place, distance_km = self.nearest(latitude, longitude)
+        name = ', '.join(part for part in (place['name'], place['region'], place['country']) if part)
+        return name if distance_km < 1 else f"About {distance_km:.0f} km from {name}"
+
+
+def nominatim_provider(user_agent):
+    """Returns provider(latitude, longitude, timeout) -> address or None, sharing one Nominatim client."""
+    from geopy.geocoders import Nominatim
+
+    geolocator = Nominatim(user_agent=user_agent)
+
+    def reverse(latitude, longitude, timeout):
+        location = geolocator.reverse((latitude, longitude), exactly_one=True, language='en', timeout=timeout)
+        return location.address if location else None
+
+    return reverse
+
+
+class ReverseGeocoder:
+    def __init__(self, provider, gazetteer=None, ttl_seconds=7 * 24 * 3600, max_entries=10000,
+                 rate_per_second=1.0, timeout_seconds=3.0, workers=2):
+        self.provider = provider    # None to always use the gazetteer
+        self.gazetteer = gazetteer  # None if no gazetteer could be loaded
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.timeout_seconds = timeout_seconds
+        self._bucket = TokenBucket(rate_per_second)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (rounded lat, rounded lon) -> (address, stored_at)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geocode')
+
+    def lookup(self, latitude, longitude):
+        """Returns a GeocodeResult. Waits at most `timeout_seconds` for the provider."""
+        key = (round(latitude, CACHE_DECIMALS), round(longitude, CACHE_DECIMALS))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+                self._cache.move_to_end(key)
+                lookups_total.inc(source='cache')
+                return GeocodeResult(entry[0], 'cache')
+
+        if self.provider and self._bucket.try_acquire():
+            started = time.monotonic()
+            try:
+                address = self.provider(latitude, longitude, self.timeout_seconds)
+            except Exception as e:
+                print(f"Reverse geocoding failed, using the offline gazetteer: {e}")
+                address = None
+            elapsed = time.monotonic() - started
+            provider_seconds.observe(elapsed)
+            tracing.record_span('geocode', elapsed)
+            if address:
+                self._store(key, address)
+                lookups_total.inc(source='provider')
+                return GeocodeResult(address, 'provider')
+
+        # Rate-limited, failed or no answer: not cached, so the next call tries the provider again
+        if self.gazetteer:
+            lookups_total.inc(source='gazetteer')
+            return GeocodeResult(self.gazetteer.describe(latitude, longitude), 'gazetteer')
+        lookups_total.inc(source='none')
+        return GeocodeResult(None, 'none')
+
+    def lookup_async(self, latitude, longitude, callback):
+        """Resolves the address in the background and calls callback(GeocodeResult)."""
+        def run():
+            try:
+                callback(self.lookup(latitude, longitude))
+            except Exception as e:
+                print(f"Error handling reverse geocoding result: {e}")
+        return self._pool.submit(run)
+
+    def _store(self, key, address):
+        with self._lock:
+            self._cache[key] = (address, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
@@ -0,0 +1,107 @@
+"""
+Library of first-aid guides for the fixed emergency buttons.
+
+Guides come from a bundled JSON file (data/first_aid_guides.json) and may
+be overridden by newer versions written by the scheduled refresh job (run
+by one worker at a time; the others pick its file up with `reload_if_changed`).
+They are held in memory, so a lookup is a dict access and works even when the
+AI provider is down. Only emergencies that are not in the library need a
+live model call.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+
+class Guide:
+    def __init__(self, name, text, version, updated_at):
+        self.name = name
+        self.text = text
+        self.version = version
+        self.updated_at = updated_at
+        digest = hashlib.sha256(f"{version}:{text}".encode('utf-8')).hexdigest()[:16]
+        self.etag = f"{name.lower().replace(' ', '-')}-v{version}-{digest}"
+
+    def to_dict(self):
+        return {"guide": self.text, "version": self.version, "updated_at": self.updated_at}
+
+
+class GuideStore:
+    def __init__(self, bundled_path, refreshed_path):
+        self.bundled_path = bundled_path
+        self.refreshed_path = refreshed_path  # Where refreshed guides are written
+        self._lock = threading.Lock()
+        self._guides = {}   # lower-cased name -> Guide
+        self._aliases = {}  # lower-cased alias -> canonical name
+        self._loaded_mtime = None  # Modification time of the refreshed file when it was last read
+        self.load()
+
+    def load(self):
+        """(Re)loads the bundled guides, then any refreshed versions on top of them."""
+        with open(self.bundled_path, 'r', encoding='utf-8') as f:
+            bundled = json.load(f)
+
+        entries = dict(bundled.get('guides', {}))
+        mtime = self._refreshed_mtime()
+        if mtime is not None:
+            with open(self.refreshed_path, 'r', encoding='utf-8') as f:
+                for name, entry in json.load(f).get('guides', {}).items():
+                    # A newer bundled release wins over an older refresh
+                    if name not in entries or entry['version'] > entries[name]['version']:
+                        entries[name] = entry
+
+        guides = {
+            name.lower(): Guide(name, entry['text'], entry['version'], entry.get('updated_at'))
+            for name, entry in entries.items()
+        }
+        aliases = {alias.lower(): name for alias, name in bundled.get('aliases', {}).items()}
+
+        with self._lock:
+            self._guides = guides
+            self._aliases = aliases
+            self._loaded_mtime = mtime
+
+    def reload_if_changed(self):
+        """Reloads if the refreshed-guides file changed since it was read. Returns True if it did."""
+        if self._refreshed_mtime() == self._loaded_mtime:
+            return False
+        self.load()
+        return True
+
+    def _refreshed_mtime(self):
+        try:
+            return os.stat(self.refreshed_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, emergency_type):
+        """Returns the Guide for an emergency name (case-insensitive, aliases allowed), or None."""
+        key = ' '.join(emergency_type.split()).lower()
+        with self._lock:
+            key = self._aliases.get(key, key).lower()
+            return self._guides.get(key)
+
+    def names(self):
+        with self._lock:
+            return [guide.name for guide in self._guides.values()]
+
+    def update(self, name, text):
+        """Stores a new version of a guide in memory and in the refreshed-guides file."""
+        with self._lock:
+            current = self._guides.get(name.lower())
+            version = current.version + 1 if current else 1
+            guide = Guide(name, text, version, datetime.utcnow().isoformat(timespec='seconds'))
+            self._guides[name.lower()] = guide
+            snapshot = {
+                g.name: {"version": g.version, "updated_at": g.updated_at, "text": g.text}
+                for g in self._guides.values()
+            }
+
+        os.makedirs(os.path.dirname(self.refreshed_path) or '.', exist_ok=True)
+        tmp_path = f"{self.refreshed_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"guides": snapshot}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.refreshed_path)
+        return guide
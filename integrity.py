@@ -0,0 +1,180 @@
+"""
+Tamper evidence for uploaded medical documents.
+
+  * A document's hash is the SHA-256 its blob is stored under, computed while
+    the upload is written (blobstore.py), so an upload is read once.
+  * Each upload appends a ledger entry whose hash covers the previous entry's
+    hash, the document id, the file hash and the time: editing or removing an
+    entry breaks every later link (`entry_hash`).
+  * Periodically the entries not yet anchored are sealed into a batch: a
+    Merkle tree over their entry hashes, whose root is anchored with a notary.
+    Each entry keeps its inclusion proof, so checking one document costs
+    O(log n) hashes against one anchored root, never a pass over the history.
+
+LocalNotary stands in for an external timestamping service or public chain:
+an append-only file of roots, each record chained to the one before and
+signed with a key only the notary holds.
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+from datetime import datetime
+
+GENESIS_HASH = '0' * 64  # prev_hash of the first ledger entry
+
+# Leaves and inner nodes are hashed with different prefixes, so an inner node
+# can never be passed off as a leaf (second-preimage attack on the tree)
+_LEAF_PREFIX = b'\x00'
+_NODE_PREFIX = b'\x01'
+
+
+def entry_hash(prev_hash, document_id, content_hash, created_at):
+    """The hash of one ledger entry. `created_at` must be stored exactly, so whole seconds only."""
+    payload = f"{prev_hash}|{document_id}|{content_hash}|{created_at.isoformat()}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# --- Merkle tree ---
+
+def _leaf(value):
+    return hashlib.sha256(_LEAF_PREFIX + value).digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(_NODE_PREFIX + left + right).digest()
+
+
+def merkle_tree(leaves):
+    """
+    Builds a Merkle tree over `leaves` (hex hashes). Returns (root, proofs):
+    the hex root, and for every leaf its inclusion proof - a list of
+    [side, sibling hash] pairs from the leaf up, where side is 'L' or 'R'.
+    A level with an odd number of nodes carries its last node up unchanged.
+    """
+    if not leaves:
+        raise ValueError("Cannot build a Merkle tree without leaves.")
+    level = [_leaf(bytes.fromhex(value)) for value in leaves]
+    positions = list(range(len(leaves)))  # Index of each leaf's ancestor on the current level
+    proofs = [[] for _ in leaves]
+
+    while len(level) > 1:
+        for leaf_index, position in enumerate(positions):
+            sibling = position ^ 1
+            if sibling < len(level):
+                side = 'L' if sibling < position else 'R'
+                proofs[leaf_index].append([side, level[sibling].hex()])
+        level = [
+            _node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+        positions = [position // 2 for position in positions]
+
+    return level[0].hex(), proofs
+
+
+def verify_proof(leaf, proof, root):
+    """True if `proof` (from merkle_tree) shows that the hex hash `leaf` is in the tree with this root."""
+    node = _leaf(bytes.fromhex(leaf))
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        node = _node(sibling, node) if side == 'L' else _node(node, sibling)
+    return hmac.compare_digest(node.hex(), root)
+
+
+# --- Notary ---
+
+class LocalNotary:
+    """
+    Append-only log of anchored Merkle roots (JSON lines). Every record holds
+    the hash of the record before it, and the receipt handed back is signed
+    with the notary's key (created in `key_path` on first use). Receipts carry
+    the record's byte offset, so checking one is a single seek.
+    """
+
+    def __init__(self, path, key_path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._key = self._load_key(key_path)
+        self._lock = threading.Lock()
+
+    def anchor(self, root):
+        """Records a Merkle root. Returns the receipt (a dict) to keep with the batch."""
+        with self._lock:
+            height, prev = self._last_record()
+            record = {
+                'height': height + 1,
+                'root': root,
+                'prev': prev,
+                'anchored_at': datetime.utcnow().replace(microsecond=0).isoformat()
+            }
+            record['record_hash'] = self._record_hash(record)
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(json.dumps(record, sort_keys=True).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+        receipt = {'height': record['height'], 'offset': offset, 'record_hash': record['record_hash'],
+                   'anchored_at': record['anchored_at']}
+        receipt['signature'] = self._sign(receipt)
+        return receipt
+
+    def verify(self, root, receipt):
+        """True if the receipt is genuine and the notary's record at its offset anchors `root`."""
+        unsigned = {key: value for key, value in receipt.items() if key != 'signature'}
+        if not hmac.compare_digest(self._sign(unsigned), receipt.get('signature', '')):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(receipt['offset'])
+                record = json.loads(f.readline())
+        except (OSError, ValueError, KeyError):
+            return False
+        return (record.get('height') == receipt['height']
+                and record.get('root') == root
+                and record.get('record_hash') == receipt['record_hash']
+                and self._record_hash(record) == record['record_hash'])
+
+    def _last_record(self):
+        """(height, record_hash) of the last record, reading only the end of the file."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+                if end == 0:
+                    return 0, GENESIS_HASH
+                f.seek(max(0, end - 4096))
+                last_line = f.read().rstrip(b'\n').rsplit(b'\n', 1)[-1]
+        except FileNotFoundError:
+            return 0, GENESIS_HASH
+        record = json.loads(last_line)
+        return record['height'], record['record_hash']
+
+    @staticmethod
+    def _record_hash(record):
+        fields = {key: record[key] for key in ('height', 'root', 'prev', 'anchored_at')}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _sign(self, fields):
+        message = json.dumps(fields, sort_keys=True).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def _load_key(key_path):
+        try:
+            with open(key_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(key_path) or '.', exist_ok=True)
+            key = os.urandom(32)
+            # O_EXCL: if another process created the key first, use theirs
+            try:
+                fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                with open(key_path, 'rb') as f:
+                    return f.read()
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key)
+            return key
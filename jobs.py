@@ -0,0 +1,51 @@
+"""
+Background execution for slow document-processing work.
+
+Each job runs on a thread pool: the job body mostly waits, either on the
+extraction engine's process pool (OCR) or on the LLM. The number of jobs
+waiting or running is bounded; `submit` raises QueueFullError once the
+limit is reached so routes can answer 429 instead of piling up work.
+
+Job *state* is not kept here - app.py stores it in the ProcessingJob table
+so it survives restarts.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at its maximum depth."""
+
+
+class JobQueue:
+    def __init__(self, max_depth=50, workers=8):
+        self.max_depth = max_depth
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._active = set()
+
+    @property
+    def depth(self):
+        """Number of jobs currently queued or running in this process."""
+        with self._lock:
+            return len(self._active)
+
+    def submit(self, job_id, fn, *args, force=False):
+        """
+        Runs fn(*args) in the background.
+        Raises QueueFullError if the queue is full, unless `force` is set
+        (used when resuming jobs after a restart, which were already accepted).
+        """
+        with self._lock:
+            if job_id in self._active:
+                return
+            if len(self._active) >= self.max_depth and not force:
+                raise QueueFullError(f"Job queue is full ({self.max_depth} jobs).")
+            self._active.add(job_id)
+
+        future = self._pool.submit(fn, *args)
+        future.add_done_callback(lambda _: self._finished(job_id))
+
+    def _finished(self, job_id):
+        with self._lock:
+            self._active.discard(job_id)
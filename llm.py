@@ -0,0 +1,390 @@
+"""
+Gateway for every call to an AI provider (Gemini for text, DALL-E for images).
+
+Routes never talk to a provider SDK directly. An LLMGateway wraps one
+provider and adds:
+  * a concurrency cap (semaphore), so a slow provider can't tie up every worker
+  * a deadline per call, shared by queueing, every attempt and the backoff between them
+  * retries with jittered exponential backoff for transient errors
+  * a circuit breaker that fails fast while the provider keeps failing
+  * coalescing, so identical prompts that are in flight together make one call
+  * latency and token metrics, and an 'llm' span for the request's trace
+
+FakeProvider answers locally without a network, so the whole app can be
+load-tested offline (LLM_PROVIDER=fake).
+"""
+import base64
+import io
+import random
+import threading
+import time
+
+import metrics
+import tracing
+
+request_seconds = metrics.histogram(
+    'llm_request_seconds',
+    'Time an AI provider call took, including queueing and retries'
+)
+tokens_total = metrics.counter('llm_tokens_total', 'Tokens sent to and received from AI providers')
+calls_total = metrics.counter('llm_calls_total', 'AI provider calls by outcome')
+
+
+class LLMError(Exception):
+    """An AI provider call failed."""
+
+
+class LLMUnavailableError(LLMError):
+    """The provider is not configured, or its circuit breaker is open."""
+
+
+class LLMTimeoutError(LLMError):
+    """The call did not finish before its deadline."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, calls
+    fail immediately; after `reset_seconds` one trial call is let through
+    and its result closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self._opened_at >= self.reset_seconds else 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """Ends a trial call that finished without a verdict (e.g. cancelled), so another can be let through."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+# --- Providers ---
+
+class GeminiProvider:
+    name = 'gemini'
+
+    def __init__(self, model_name, api_key):
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+        self.retryable_errors = (
+            google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded, ConnectionError
+        )
+
+    def generate(self, prompt, timeout):
+        """Returns (text, prompt tokens, output tokens)."""
+        response = self._model.generate_content(prompt, request_options={'timeout': timeout})
+        if not response or not response.candidates:
+            raise LLMError("The AI model returned no answer.")
+        text = response.candidates[0].content.parts[0].text.strip()
+        usage = getattr(response, 'usage_metadata', None)
+        return (text, getattr(usage, 'prompt_token_count', 0) or 0,
+                getattr(usage, 'candidates_token_count', 0) or 0)
+
+    def stream(self, prompt, timeout):
+        for chunk in self._model.generate_content(prompt, stream=True, request_options={'timeout': timeout}):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # Chunk without text (e.g. only safety metadata)
+            if text:
+                yield text
+
+
+class OpenAIImageProvider:
+    name = 'openai'
+
+    def __init__(self, client, model_name="dall-e-3"):
+        import openai
+
+        self.model_name = model_name
+        self._client = client
+        self.retryable_errors = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+    def generate_image(self, prompt, timeout):
+        """Returns a URL for the generated image."""
+        response = self._client.images.generate(
+            model=self.model_name,
+            prompt=prompt,
+            size="1024x1024",
+            quality="standard",
+            n=1,
+            timeout=timeout
+        )
+        return response.data[0].url
+
+
+class FakeProvider:
+    """
+    Offline stand-in for both providers. Answers after `latency_seconds` and
+    fails a `failure_rate` share of calls, so timeouts, retries and the
+    breaker can be exercised under load without spending anything.
+    """
+    name = 'fake'
+    model_name = 'fake'
+    retryable_errors = (ConnectionError,)
+
+    ANSWER = (
+        "**1. Call Emergency Services Immediately**\n\n"
+        "This is a placeholder answer from the offline AI provider.\n\n"
+        "* Stay calm and keep the person still.\n"
+        "* Follow the dispatcher's instructions until help arrives."
+    )
+    # Replies to prompts asking for a JSON list (e.g. exercise selection)
+    JSON_ANSWER = '["walking", "arm_circles", "wall_push_up", "glute_bridge", "bird_dog"]'
+
+    def __init__(self, latency_seconds=0.5, failure_rate=0.0):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+
+    def _wait(self, timeout):
+        time.sleep(min(self.latency_seconds, timeout))
+        if self.latency_seconds > timeout:
+            raise TimeoutError("Fake provider timed out.")
+        if random.random() < self.failure_rate:
+            raise ConnectionError("Fake provider failure.")
+
+    def _answer(self, prompt):
+        return self.JSON_ANSWER if 'JSON' in prompt else self.ANSWER
+
+    def generate(self, prompt, timeout):
+        self._wait(timeout)
+        answer = self._answer(prompt)
+        return answer, len(prompt.split()), len(answer.split())
+
+    def stream(self, prompt, timeout):
+        self._wait(timeout)
+        for line in self._answer(prompt).splitlines(keepends=True):
+            yield line
+
+    def generate_image(self, prompt, timeout):
+        from PIL import Image
+
+        self._wait(timeout)
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), 'white').save(buffer, format='PNG')
+        return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+# --- Gateway ---
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMGateway:
+    def __init__(self, provider, max_concurrency=8, timeout_seconds=30, max_retries=2,
+                 backoff_seconds=0.5, breaker=None):
+        self.provider = provider  # None when the provider could not be configured
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = {}  # (kind, prompt) -> _InFlight
+
+    @property
+    def available(self):
+        return self.provider is not None
+
+    @property
+    def model_name(self):
+        return self.provider.model_name if self.provider else None
+
+    def generate(self, prompt, endpoint, timeout=None):
+        """Returns the text answer for a prompt. Raises an LLMError subclass on failure."""
+        return self._coalesced('text', prompt, endpoint, timeout, self._generate_once)
+
+    def generate_image(self, prompt, endpoint, timeout=None):
+        """Returns a URL for an image generated from the prompt. Raises an LLMError subclass on failure."""
+        return self._coalesced('image', prompt, endpoint, timeout, self._generate_image_once)
+
+    def stream(self, prompt, endpoint, timeout=None):
+        """
+        Yields the answer in chunks as the provider produces them.
+        Failures before the first chunk are retried; after that they are raised,
+        since part of the answer has already been shown.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout_seconds)
+        started = time.monotonic()
+        self._check_configured()
+        self._acquire(deadline)
+        outcome = 'error'
+        try:
+            if not self.breaker.allow():
+                outcome = 'rejected'
+                raise LLMUnavailableError("AI service is temporarily unavailable.")
+            attempt = 0
+            while True:
+                sent_any = False
+                try:
+                    for text in self.provider.stream(prompt, self._remaining(deadline)):
+                        sent_any = True
+                        yield text
+                    self.breaker.record_success()
+                    outcome = 'ok'
+                    return
+                except GeneratorExit:
+                    # The client went away. Chunks received mean the provider is up; without any, no verdict
+                    if sent_any:
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.release_trial()
+                    outcome = 'cancelled'
+                    raise
+                except Exception as e:
+                    self.breaker.record_failure()
+                    if sent_any or not self._should_retry(e, attempt, deadline):
+                        raise self._as_llm_error(e) from e
+                    attempt += 1
+        finally:
+            self._semaphore.release()
+            self._record(endpoint, outcome, started)
+
+    # --- Internals ---
+
+    def _generate_once(self, prompt, timeout):
+        return self.provider.generate(prompt, timeout)
+
+    def _generate_image_once(self, prompt, timeout):
+        return self.provider.generate_image(prompt, timeout), 0, 0
+
+    def _coalesced(self, kind, prompt, endpoint, timeout, call):
+        deadline = time.monotonic() + (timeout or self.timeout_seconds)
+        key = (kind, prompt)
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            calls_total.inc(provider=self._provider_name, endpoint=endpoint, outcome='coalesced')
+            if not in_flight.done.wait(self._remaining(deadline)):
+                raise LLMTimeoutError("Timed out waiting for an identical AI request.")
+            if in_flight.error:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = self._call_with_retries(call, prompt, endpoint, deadline)
+            return in_flight.result
+        except LLMError as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    def _call_with_retries(self, call, prompt, endpoint, deadline):
+        started = time.monotonic()
+        self._check_configured()
+        self._acquire(deadline)
+        outcome = 'error'
+        try:
+            if not self.breaker.allow():
+                outcome = 'rejected'
+                raise LLMUnavailableError("AI service is temporarily unavailable.")
+            attempt = 0
+            while True:
+                try:
+                    result, prompt_tokens, output_tokens = call(prompt, self._remaining(deadline))
+                except Exception as e:
+                    self.breaker.record_failure()
+                    if not self._should_retry(e, attempt, deadline):
+                        raise self._as_llm_error(e) from e
+                    attempt += 1
+                    continue
+
+                self.breaker.record_success()
+                outcome = 'ok'
+                if prompt_tokens or output_tokens:
+                    tokens_total.inc(prompt_tokens, provider=self._provider_name, endpoint=endpoint, kind='prompt')
+                    tokens_total.inc(output_tokens, provider=self._provider_name, endpoint=endpoint, kind='output')
+                return result
+        finally:
+            self._semaphore.release()
+            self._record(endpoint, outcome, started)
+
+    @property
+    def _provider_name(self):
+        return self.provider.name if self.provider else 'none'
+
+    def _check_configured(self):
+        if not self.provider:
+            raise LLMUnavailableError("AI service is not configured.")
+
+    def _acquire(self, deadline):
+        if not self._semaphore.acquire(timeout=self._remaining(deadline)):
+            raise LLMTimeoutError("Timed out waiting for a free AI provider slot.")
+
+    def _remaining(self, deadline):
+        return max(0.0, deadline - time.monotonic())
+
+    def _should_retry(self, error, attempt, deadline):
+        if attempt >= self.max_retries or not isinstance(error, self.provider.retryable_errors):
+            return False
+        # Full jitter: sleep a random share of the exponential backoff, if the deadline allows
+        delay = random.uniform(0, self.backoff_seconds * (2 ** attempt))
+        if delay >= self._remaining(deadline):
+            return False
+        time.sleep(delay)
+        return self.breaker.allow()
+
+    def _as_llm_error(self, error):
+        if isinstance(error, LLMError):
+            return error
+        if isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower() \
+                or 'deadline' in type(error).__name__.lower():
+            return LLMTimeoutError(f"The AI provider did not answer in time: {error}")
+        return LLMError(f"The AI provider call failed: {error}")
+
+    def _record(self, endpoint, outcome, started):
+        elapsed = time.monotonic() - started
+        request_seconds.observe(elapsed, provider=self._provider_name, endpoint=endpoint)
+        tracing.record_span('llm', elapsed)
+        calls_total.inc(provider=self._provider_name, endpoint=endpoint, outcome=outcome)
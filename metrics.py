@@ -0,0 +1,140 @@
+"""
+Lightweight in-process metrics.
+
+Metrics are registered once by name and updated with optional labels,
+e.g. `histogram('llm_time_to_first_token_seconds', '...').observe(0.42, endpoint='chat')`
+or `counter('llm_tokens_total', '...').inc(120, kind='output')`.
+`render_prometheus()` returns every metric in the Prometheus text format.
+"""
+import threading
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025) + DEFAULT_BUCKETS  # For things that usually take milliseconds
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    """Cumulative bucket counts plus a running sum and count, per label set."""
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # sorted label items -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1  # +Inf bucket doubles as the total count
+            series[-1] += value
+
+    def snapshot(self):
+        """Returns {'label=value,...': {'count', 'sum', 'buckets': {bound: cumulative count}}}."""
+        with self._lock:
+            result = {}
+            for key, series in self._series.items():
+                result[",".join(f"{k}={v}" for k, v in key)] = {
+                    'count': series[len(self.buckets)],
+                    'sum': series[-1],
+                    'buckets': dict(zip(self.buckets, series[:len(self.buckets)]))
+                }
+            return result
+
+    def prometheus_lines(self):
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = [f"# HELP {self.name} {_escape_help(self.description)}", f"# TYPE {self.name} histogram"]
+        for key, values in series:
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_labels(key, le=repr(float(bound)))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(key, le='+Inf')} {values[len(self.buckets)]}")
+            lines.append(f"{self.name}_sum{_labels(key)} {values[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(key)} {values[len(self.buckets)]}")
+        return lines
+
+
+class Counter:
+    """A monotonically increasing total per label set."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._series = {}  # sorted label items -> total
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def snapshot(self):
+        """Returns {'label=value,...': total}."""
+        with self._lock:
+            return {",".join(f"{k}={v}" for k, v in key): total for key, total in self._series.items()}
+
+    def prometheus_lines(self):
+        with self._lock:
+            series = list(self._series.items())
+        lines = [f"# HELP {self.name} {_escape_help(self.description)}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(key)} {total}" for key, total in series)
+        return lines
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _labels(key, **extra):
+    """Formats a label set as {name="value",...}, or '' if there are no labels."""
+    items = list(key) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in items
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _register(name, factory):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = factory()
+        return metric
+
+
+def histogram(name, description='', buckets=DEFAULT_BUCKETS):
+    """Returns the histogram registered under `name`, creating it on first use."""
+    return _register(name, lambda: Histogram(name, description, buckets))
+
+
+def counter(name, description=''):
+    """Returns the counter registered under `name`, creating it on first use."""
+    return _register(name, lambda: Counter(name, description))
+
+
+def snapshot():
+    """Returns a snapshot of every registered metric, keyed by name."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def render_prometheus():
+    """Returns every registered metric in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.prometheus_lines())
+    return "\n".join(lines) + "\n"
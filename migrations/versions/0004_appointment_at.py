@@ -0,0 +1,129 @@
+"""combine appointment date and time into appointment_at
+
+Replaces appointment.appointment_date (DATE) and appointment.appointment_time
+('HH:MM AM/PM' string) with one indexed DATETIME, so appointments sort and
+range-scan in time order. Existing rows are converted; a time that cannot be
+parsed becomes midnight and is reported.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 11:40:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+TIME_FORMAT = '%I:%M %p'
+BATCH = 5000
+
+appointment = sa.table(
+    'appointment',
+    sa.column('id', sa.Integer),
+    sa.column('appointment_date', sa.Date),
+    sa.column('appointment_time', sa.String),
+    sa.column('appointment_at', sa.DateTime),
+)
+
+
+def _parse_time(value):
+    for time_format in (TIME_FORMAT, '%H:%M'):
+        try:
+            return datetime.strptime(value.strip(), time_format).time()
+        except (AttributeError, ValueError):
+            continue
+    return None
+
+
+def _fill_appointment_at(bind):
+    if bind.dialect.name == 'mysql':
+        bind.execute(sa.text(
+            "UPDATE appointment SET appointment_at = "
+            "STR_TO_DATE(CONCAT(appointment_date, ' ', appointment_time), '%Y-%m-%d %h:%i %p') "
+            "WHERE appointment_time REGEXP '^[0-9]{1,2}:[0-9]{2} (AM|PM)$'"
+        ))
+
+    # Everything else (and any row MySQL couldn't parse) is converted in Python
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(appointment.c.id, appointment.c.appointment_date, appointment.c.appointment_time)
+            .where(appointment.c.appointment_at.is_(None), appointment.c.id > last_id)
+            .order_by(appointment.c.id).limit(BATCH)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            parsed = _parse_time(row.appointment_time)
+            if parsed is None:
+                print(f"appointment {row.id}: unrecognised time {row.appointment_time!r}, using midnight")
+                parsed = datetime.min.time()
+            updates.append({'row_id': row.id, 'value': datetime.combine(row.appointment_date, parsed)})
+        bind.execute(
+            appointment.update().where(appointment.c.id == sa.bindparam('row_id'))
+            .values(appointment_at=sa.bindparam('value')),
+            updates
+        )
+        last_id = rows[-1].id
+
+
+def _fill_date_and_time(bind):
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(appointment.c.id, appointment.c.appointment_at)
+            .where(appointment.c.id > last_id).order_by(appointment.c.id).limit(BATCH)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            appointment.update().where(appointment.c.id == sa.bindparam('row_id'))
+            .values(appointment_date=sa.bindparam('date_value'), appointment_time=sa.bindparam('time_value')),
+            [{'row_id': row.id, 'date_value': row.appointment_at.date(),
+              'time_value': row.appointment_at.strftime(TIME_FORMAT)} for row in rows]
+        )
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('appointment_at', sa.DateTime(), nullable=True))
+
+    _fill_appointment_at(op.get_bind())
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.alter_column('appointment_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_index('ix_appointment_patient_status_date')
+        batch_op.drop_index('ix_appointment_doctor_date')
+        batch_op.drop_column('appointment_time')
+        batch_op.drop_column('appointment_date')
+        batch_op.create_index('ix_appointment_appointment_at', ['appointment_at'], unique=False)
+        batch_op.create_index('ix_appointment_doctor_at', ['doctor_id', 'appointment_at'], unique=False)
+        batch_op.create_index('ix_appointment_patient_status_at', ['patient_id', 'status', 'appointment_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('appointment_date', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('appointment_time', sa.String(length=10), nullable=True))
+
+    _fill_date_and_time(op.get_bind())
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.alter_column('appointment_date', existing_type=sa.Date(), nullable=False)
+        batch_op.alter_column('appointment_time', existing_type=sa.String(length=10), nullable=False)
+        batch_op.drop_index('ix_appointment_patient_status_at')
+        batch_op.drop_index('ix_appointment_doctor_at')
+        batch_op.drop_index('ix_appointment_appointment_at')
+        batch_op.drop_column('appointment_at')
+        batch_op.create_index('ix_appointment_doctor_date', ['doctor_id', 'appointment_date', 'appointment_time'], unique=False)
+        batch_op.create_index('ix_appointment_patient_status_date', ['patient_id', 'status', 'appointment_date', 'appointment_time'], unique=False)
@@ -0,0 +1,209 @@
+"""
+Image clean-up before Tesseract OCR (OpenCV).
+
+Phone photos of reports arrive at 12 MP or more, often skewed, unevenly lit
+or out of focus. `prepare` turns an image into what Tesseract reads best:
+
+  1. grayscale, and downscale to at most MAX_SIDE pixels (A4 at 300 DPI)
+  2. quality gate on a small copy: a near-uniform image is blank, and a low
+     variance of the Laplacian means no sharp edges, i.e. too blurry to read.
+     Both are rejected before any OCR time is spent.
+  3. rescale so the median character is about TARGET_CHAR_HEIGHT pixels tall
+  4. adaptive threshold, which also evens out shadows and uneven lighting
+  5. deskew: the angle whose horizontal projection profile has the sharpest
+     peaks (text lines) is taken as the skew and rotated away
+  6. pick a page segmentation mode from the layout: one line, sparse text,
+     two columns, or a single block
+
+`read_text` runs the whole stage and then Tesseract.
+"""
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import pytesseract
+
+MAX_SIDE = 3508                # Long side of an A4 page scanned at 300 DPI
+GATE_SIDE = 1000               # The quality gate works on a copy this size
+BLANK_STDDEV = 2.0             # Grayscale standard deviation below this: a uniform image, nothing on it
+BLUR_THRESHOLD = 60.0          # Laplacian variance below this: too blurry to read
+TARGET_CHAR_HEIGHT = 32        # Tesseract is most accurate with capitals around 30-33 px tall
+MAX_SKEW_DEGREES = 15
+
+# Tesseract page segmentation modes
+PSM_AUTO = 3          # Fully automatic layout analysis (multi-column pages)
+PSM_SINGLE_BLOCK = 6  # One uniform block of text
+PSM_SINGLE_LINE = 7
+PSM_SPARSE = 11       # Scattered text in no particular order (labels, forms)
+
+PreparedImage = namedtuple('PreparedImage', ['image', 'psm', 'skew_degrees', 'scale'])
+
+
+class UnreadableImageError(Exception):
+    """The image failed the quality gate (blank or too blurry), so it was not OCR'd."""
+
+
+def _resize(image, scale):
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+def _to_gray(image):
+    """PIL image or numpy array -> 2D uint8 array."""
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert('L'))
+    elif image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY if image.shape[2] == 3 else cv2.COLOR_RGBA2GRAY)
+    return image
+
+
+def quality_gate(gray):
+    """Raises UnreadableImageError if the image is blank or too blurry to be worth OCR'ing."""
+    scale = min(1.0, GATE_SIDE / max(gray.shape))
+    small = _resize(gray, scale) if scale < 1 else gray
+    if float(small.std()) < BLANK_STDDEV:
+        raise UnreadableImageError("the image is blank")
+    sharpness = float(cv2.Laplacian(small, cv2.CV_64F).var())
+    if sharpness < BLUR_THRESHOLD:
+        raise UnreadableImageError(f"the image is too blurry or has no text (sharpness {sharpness:.0f})")
+
+
+def _binarize(gray):
+    """Black text on white. The local threshold copes with shadows and uneven light."""
+    block = max(15, (min(gray.shape) // 40) | 1)
+    return cv2.adaptiveThreshold(cv2.medianBlur(gray, 3), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, block, 15)
+
+
+def _text_components(binary):
+    """Bounding boxes (x, y, width, height) of the connected components that look like characters."""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(255 - binary, connectivity=8)
+    stats = stats[1:]
+    heights, widths = stats[:, cv2.CC_STAT_HEIGHT], stats[:, cv2.CC_STAT_WIDTH]
+    # Drop specks, long rules/table borders and the edges of the sheet
+    plausible = ((heights >= 4) & (stats[:, cv2.CC_STAT_AREA] >= 8) & (widths < 5 * heights)
+                 & (heights < binary.shape[0] / 20))
+    return stats[plausible, :4]
+
+
+def _character_height(boxes):
+    """Median character height in pixels, or None when there are too few characters to tell."""
+    if len(boxes) < 10:
+        return None
+    heights = boxes[:, 3]
+    # Noise specks that survived the size filter would drag a plain median down
+    return float(np.median(heights[heights >= 0.5 * np.percentile(heights, 90)]))
+
+
+def _profile_score(ink, angle):
+    height, width = ink.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    rotated = cv2.warpAffine(ink, matrix, (width, height), flags=cv2.INTER_NEAREST, borderValue=0)
+    rows = rotated.sum(axis=1, dtype=np.float64)
+    return float(np.square(np.diff(rows)).sum())  # Sharp line/gap transitions score high
+
+
+def estimate_skew(binary):
+    """The rotation (degrees, counter-clockwise) that makes the text lines horizontal."""
+    scale = min(1.0, 800 / max(binary.shape))
+    ink = (_resize(255 - binary, scale) if scale < 1 else 255 - binary) > 127
+    ink = ink.astype(np.uint8)
+    coarse = max(range(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + 1), key=lambda a: _profile_score(ink, a))
+    fine = [coarse + step / 10 for step in range(-10, 11)]
+    return max(fine, key=lambda a: _profile_score(ink, a))
+
+
+def _rotate(image, angle):
+    height, width = image.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    # Grow the canvas so rotated corners aren't cut off
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width, new_height = int(height * sin + width * cos), int(height * cos + width * sin)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    return cv2.warpAffine(image, matrix, (new_width, new_height), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+def _runs(mask):
+    """(start, end) of each run of True values in a 1D boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def _coverage(starts, lengths, size):
+    """How many of the spans [start, start + length) cover each position in 0..size."""
+    counts = np.zeros(size + 1, np.int32)
+    np.add.at(counts, starts, 1)
+    np.add.at(counts, starts + lengths, -1)
+    return np.cumsum(counts)[:size]
+
+
+def choose_psm(binary):
+    """Picks a Tesseract page segmentation mode from the deskewed, binarized page."""
+    boxes = _text_components(binary)
+    if len(boxes) < 3:
+        return PSM_SPARSE
+    height, width = binary.shape
+
+    # Text lines: bands of rows crossed by several characters (a lone speck doesn't make a line).
+    # Bands much shorter than a character are the dots of i's and j's or underlines, not lines.
+    min_line_height = 0.5 * np.median(boxes[:, 3])
+    lines = [(top, bottom) for top, bottom in _runs(_coverage(boxes[:, 1], boxes[:, 3], height) >= 3)
+             if bottom - top >= min_line_height]
+    if not lines:
+        return PSM_SPARSE
+    if len(lines) <= 1:
+        return PSM_SINGLE_LINE
+    if len(boxes) / len(lines) < 8:
+        return PSM_SPARSE  # A few words per line: labels, stamps, form fields
+
+    # Two columns: an empty vertical band in the middle third that most lines have text on both sides of
+    centres = boxes[:, 1] + boxes[:, 3] // 2
+    line_of_box = np.full(len(boxes), -1)
+    for number, (top, bottom) in enumerate(lines):
+        line_of_box[(centres >= top) & (centres < bottom)] = number
+    in_lines = boxes[line_of_box >= 0]
+    columns = _coverage(in_lines[:, 0], in_lines[:, 2], width) > 0
+    third = width // 3
+    gaps = [(third + start, third + end) for start, end in _runs(~columns[third:2 * third])
+            if end - start >= width * 0.04]
+    if gaps:
+        gap_start, gap_end = max(gaps, key=lambda gap: gap[1] - gap[0])
+        # Several characters on each side, so a sheet edge or a stray mark isn't taken for a column
+        left = np.bincount(line_of_box[(line_of_box >= 0) & (boxes[:, 0] + boxes[:, 2] <= gap_start)],
+                           minlength=len(lines))
+        right = np.bincount(line_of_box[(line_of_box >= 0) & (boxes[:, 0] >= gap_end)], minlength=len(lines))
+        if np.count_nonzero((left >= 3) & (right >= 3)) >= len(lines) / 2:
+            return PSM_AUTO
+    return PSM_SINGLE_BLOCK
+
+
+def prepare(image):
+    """Returns a PreparedImage ready for Tesseract. Raises UnreadableImageError for hopeless images."""
+    gray = _to_gray(image)
+    if max(gray.shape) > MAX_SIDE:
+        gray = _resize(gray, MAX_SIDE / max(gray.shape))
+    quality_gate(gray)
+
+    scale = 1.0
+    char_height = _character_height(_text_components(_binarize(gray)))
+    if char_height:
+        scale = min(2.0, MAX_SIDE / max(gray.shape), max(0.25, TARGET_CHAR_HEIGHT / char_height))
+        if abs(scale - 1.0) > 0.15:
+            gray = _resize(gray, scale)
+        else:
+            scale = 1.0
+    binary = _binarize(gray)
+
+    skew = estimate_skew(binary)
+    if abs(skew) >= 0.3:
+        binary = _binarize(_rotate(gray, skew))
+    return PreparedImage(binary, choose_psm(binary), skew, scale)
+
+
+def read_text(image, preprocess=True):
+    """OCR text of a PIL image. With preprocess=False the image goes to Tesseract as-is."""
+    if not preprocess:
+        return pytesseract.image_to_string(image)
+    prepared = prepare(image)
+    return pytesseract.image_to_string(prepared.image, config=f'--psm {prepared.psm}')
@@ -0,0 +1,188 @@
+"""
+Picks the parts of a document that are relevant to a question.
+
+A long report is split once into overlapping chunks of words, and the chunks
+are embedded as TF-IDF vectors of words and word pairs (the IDF is computed
+over that document's own chunks). A question is embedded the same way and
+the chunks are ranked by cosine similarity, so the prompt gets a fixed
+budget of relevant text however long the document is.
+
+Indexes are keyed on the SHA-256 of the text and persisted as .npz files
+under `index_dir` (only arrays, nothing pickled), with the most recently
+used ones kept in memory. The text itself is not stored - chunks are kept
+as offsets into it, and the caller has the text from the text cache.
+Deleting the directory is safe; indexes are rebuilt on the next question.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+CHUNK_WORDS = 120      # Words per chunk
+OVERLAP_WORDS = 30     # Words shared with the previous chunk, so a finding isn't cut in half
+INDEX_VERSION = 1      # Part of the file name; bump when chunking or features change
+EXCERPT_SEPARATOR = "\n[...]\n"
+
+_WORD = re.compile(r'\S+')
+
+
+def chunk_spans(text, chunk_words=CHUNK_WORDS, overlap_words=OVERLAP_WORDS):
+    """(start, end) character offsets of overlapping chunks of `chunk_words` words covering the text."""
+    words = [match.span() for match in _WORD.finditer(text)]
+    if not words:
+        return []
+    step = chunk_words - overlap_words
+    spans = []
+    for first in range(0, len(words), step):
+        last = min(first + chunk_words, len(words)) - 1
+        spans.append((words[first][0], words[last][1]))
+        if last == len(words) - 1:
+            break
+    return spans
+
+
+class DocumentIndex:
+    """The chunks of one document and their TF-IDF vectors."""
+
+    def __init__(self, starts, ends, matrix, idf_columns, idf_values):
+        self.starts = starts
+        self.ends = ends
+        self.matrix = matrix            # CSR, one L2-normalised row per chunk
+        self.idf_columns = idf_columns  # Sorted feature columns that occur in the document...
+        self.idf_values = idf_values    # ...and their IDF
+
+    def scores(self, query_counts):
+        """Cosine similarity of every chunk to a query (a 1 x n_features row of term counts)."""
+        query = query_counts.tocsr()
+        positions = np.searchsorted(self.idf_columns, query.indices)
+        known = (positions < len(self.idf_columns)) & (
+            self.idf_columns[np.minimum(positions, len(self.idf_columns) - 1)] == query.indices)
+        # Terms that never occur in the document can't match a chunk, so they are dropped
+        columns = query.indices[known]
+        weights = query.data[known] * self.idf_values[positions[known]]
+        norm = np.linalg.norm(weights)
+        if not norm:
+            return np.zeros(self.matrix.shape[0])
+        vector = sparse.csr_matrix((weights / norm, columns, [0, len(columns)]), shape=(1, self.matrix.shape[1]))
+        return (self.matrix @ vector.T).toarray().ravel()
+
+
+class RetrievalIndex:
+    def __init__(self, index_dir, max_memory_indexes=64):
+        self.index_dir = index_dir
+        self.max_memory_indexes = max_memory_indexes
+        os.makedirs(index_dir, exist_ok=True)
+        # Hashing needs no fitted vocabulary, so a saved index is just arrays
+        self._vectorizer = HashingVectorizer(
+            ngram_range=(1, 2), stop_words='english', token_pattern=r'(?u)\b\w+\b',
+            n_features=2 ** 20, alternate_sign=False, norm=None
+        )
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # digest -> DocumentIndex, least recently used first
+
+    def select(self, text, question, max_chars):
+        """
+        The text to answer `question` from, at most about `max_chars` long: the best
+        matching chunks, in document order, with overlapping ones merged and gaps
+        marked by EXCERPT_SEPARATOR. Chunks are ranked by similarity; when nothing in
+        the question occurs in the document, the start of the document is used.
+        """
+        index = self.get(text)
+        scores = index.scores(self._vectorizer.transform([question]))
+        order = np.lexsort((np.arange(len(scores)), -scores))  # Best first; ties: earlier chunks first
+
+        chosen, used = [], 0
+        for i in order:
+            length = int(index.ends[i] - index.starts[i])
+            if chosen and used + length > max_chars:
+                break
+            chosen.append(i)
+            used += length
+
+        excerpts = []
+        for i in sorted(chosen):
+            start, end = int(index.starts[i]), int(index.ends[i])
+            if excerpts and start <= excerpts[-1][1]:
+                excerpts[-1][1] = max(excerpts[-1][1], end)
+            else:
+                excerpts.append([start, end])
+        return EXCERPT_SEPARATOR.join(text[start:end] for start, end in excerpts)
+
+    def get(self, text):
+        """The index of `text`: from memory, from disk, or built (and saved) now."""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            index = self._memory.get(digest)
+            if index is not None:
+                self._memory.move_to_end(digest)
+                return index
+
+        index = self._load(digest)
+        if index is None:
+            index = self.build(text)
+            self._save(digest, index)
+
+        with self._lock:
+            self._memory[digest] = index
+            if len(self._memory) > self.max_memory_indexes:
+                self._memory.popitem(last=False)
+        return index
+
+    def build(self, text):
+        spans = chunk_spans(text)
+        starts = np.array([start for start, _ in spans], dtype=np.int64)
+        ends = np.array([end for _, end in spans], dtype=np.int64)
+        counts = self._vectorizer.transform([text[start:end] for start, end in spans]).tocsc()
+
+        # Smoothed IDF over this document's chunks, as in sklearn's TfidfTransformer
+        document_frequency = np.diff(counts.indptr)
+        idf_columns = np.flatnonzero(document_frequency)
+        idf_values = np.log((1 + len(spans)) / (1 + document_frequency[idf_columns])) + 1
+        idf = np.zeros(counts.shape[1])
+        idf[idf_columns] = idf_values
+
+        matrix = (counts @ sparse.diags(idf)).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+        return DocumentIndex(starts, ends, matrix.tocsr(), idf_columns, idf_values)
+
+    def _path_for(self, digest):
+        return os.path.join(self.index_dir, digest[:2], f"{digest}.v{INDEX_VERSION}.npz")
+
+    def _load(self, digest):
+        try:
+            with np.load(self._path_for(digest), allow_pickle=False) as data:
+                matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+                return DocumentIndex(data['starts'], data['ends'], matrix, data['idf_columns'], data['idf_values'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"WARNING: could not read retrieval index {digest}: {e}")
+            return None
+
+    def _save(self, digest, index):
+        path = self._path_for(digest)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f, starts=index.starts, ends=index.ends,
+                    data=index.matrix.data.astype(np.float32), indices=index.matrix.indices,
+                    indptr=index.matrix.indptr, shape=np.array(index.matrix.shape),
+                    idf_columns=index.idf_columns, idf_values=index.idf_values
+                )
+            os.replace(tmp_path, path)  # Atomic, so readers never see a half-written file
+        except OSError as e:
+            print(f"WARNING: could not save retrieval index {digest}: {e}")
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
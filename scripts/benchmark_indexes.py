@@ -0,0 +1,161 @@
+"""
+Times the dashboard queries with and without the composite indexes.
+
+    python scripts/benchmark_indexes.py [--appointments 1000000] [--database-url sqlite:///bench.db]
+
+Seeds a local database (a fresh SQLite file by default) with a million
+appointments spread over doctors and patients, plus documents and medical
+records, then runs each query-layer function used by the dashboards with
+the indexes dropped and again with them created, and prints the median
+latency of each.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--appointments', type=int, default=1_000_000)
+parser.add_argument('--doctors', type=int, default=2_000)
+parser.add_argument('--patients', type=int, default=100_000)
+parser.add_argument('--documents', type=int, default=300_000)
+parser.add_argument('--records', type=int, default=300_000)
+parser.add_argument('--repeat', type=int, default=20, help="timed runs per query")
+parser.add_argument('--database-url', help="defaults to a new SQLite file in a temp directory")
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = args.database_url or \
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_indexes_'), 'bench.db')}"
+os.environ.setdefault('LLM_PROVIDER', 'fake')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hospital_app  # noqa: E402
+from app import app, db, Appointment, Doctor, Hospital, MedicalRecord, Patient, PatientDocument  # noqa: E402
+
+INDEXED_TABLES = [Appointment.__table__, PatientDocument.__table__, MedicalRecord.__table__]
+BATCH = 20_000
+TIMES = [datetime.strptime(t, '%H:%M').time() for t in ('09:00', '09:30', '10:00', '10:30', '11:00', '14:00', '14:30', '15:00')]
+
+
+def insert_batches(table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def seed():
+    random.seed(42)
+    today = date.today()
+    started = time.monotonic()
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(Hospital.__table__.insert(), [
+        {'id': 1, 'name': 'General Hospital', 'email': 'hospital@example.com', 'password_hash': 'x'}
+    ])
+    insert_batches(Doctor.__table__, (
+        {'id': i, 'name': f'Doctor {i}', 'email': f'doctor{i}@example.com', 'phone': f'8{i:09d}',
+         'password_hash': 'x', 'specialization': 'General', 'hospital_id': 1}
+        for i in range(1, args.doctors + 1)
+    ))
+    insert_batches(Patient.__table__, (
+        {'id': i, 'name': f'Patient {i}', 'phone': f'9{i:09d}', 'email': f'patient{i}@example.com', 'password_hash': 'x'}
+        for i in range(1, args.patients + 1)
+    ))
+    # Doctor 1 is the busiest doctor: 1% of all appointments
+    insert_batches(Appointment.__table__, (
+        {'id': i, 'patient_name': 'Patient', 'patient_email': 'p@example.com', 'patient_phone': '9',
+         'appointment_at': datetime.combine(today + timedelta(days=random.randint(-365, 60)), random.choice(TIMES)),
+         'status': random.choice(['Booked', 'Booked', 'Completed', 'Cancelled']),
+         'doctor_id': 1 if i % 100 == 0 else random.randint(2, args.doctors),
+         'patient_id': random.randint(1, args.patients)}
+        for i in range(1, args.appointments + 1)
+    ))
+    insert_batches(PatientDocument.__table__, (
+        {'id': i, 'filename': f'{i}_report.pdf', 'document_type': 'Report',
+         'upload_date': datetime.utcnow() - timedelta(minutes=random.randint(0, 500_000)),
+         'patient_id': random.randint(1, args.patients), 'doctor_id': None}
+        for i in range(1, args.documents + 1)
+    ))
+    insert_batches(MedicalRecord.__table__, (
+        {'id': i, 'record_date': datetime.utcnow() - timedelta(minutes=random.randint(0, 500_000)),
+         'notes': 'Notes', 'doctor_id': random.randint(1, args.doctors),
+         'patient_id': random.randint(1, args.patients), 'appointment_id': i}
+        for i in range(1, min(args.records, args.appointments) + 1)
+    ))
+    print(f"Seeded {args.appointments:,} appointments in {time.monotonic() - started:.0f}s")
+
+
+def set_indexes(enabled):
+    for table in INDEXED_TABLES:
+        for index in table.indexes:
+            if enabled:
+                index.create(db.engine, checkfirst=True)
+            else:
+                index.drop(db.engine, checkfirst=True)
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+
+def busy_patient():
+    """The patient with the most appointments, so the patient queries have something to return."""
+    return db.session.execute(db.text(
+        'SELECT patient_id FROM appointment GROUP BY patient_id ORDER BY COUNT(*) DESC LIMIT 1'
+    )).scalar()
+
+
+def time_queries(patient_id):
+    queries = {
+        'doctor upcoming appointments': lambda: hospital_app.get_doctor_upcoming_appointments(1),
+        'doctor medical record count': lambda: hospital_app.count_doctor_medical_records(1),
+        'patient upcoming appointments (first page)': lambda: hospital_app.get_patient_upcoming_appointments(patient_id),
+        'patient documents (first page)': lambda: hospital_app.get_patient_documents(patient_id),
+        'patient medical records (first page)': lambda: hospital_app.get_patient_medical_records(patient_id),
+        'document by filename': lambda: PatientDocument.query.filter_by(
+            filename=f'{args.documents // 2}_report.pdf').first(),
+    }
+    results = {}
+    for name, query in queries.items():
+        query()  # Warm up caches
+        samples = []
+        for _ in range(args.repeat):
+            db.session.expunge_all()
+            started = time.perf_counter()
+            query()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = statistics.median(samples)
+    return results
+
+
+def main():
+    with app.app_context():
+        seed()
+        patient_id = busy_patient()
+
+        set_indexes(False)
+        before = time_queries(patient_id)
+        set_indexes(True)
+        after = time_queries(patient_id)
+
+    print(f"\n{'query':<32}{'no index (ms)':>15}{'indexed (ms)':>15}{'speed-up':>10}")
+    for name in before:
+        print(f"{name:<32}{before[name]:>15.2f}{after[name]:>15.2f}{before[name] / after[name]:>9.1f}x")
+
+    hospital_app.scheduler.shutdown(wait=False)
+    hospital_app.extraction_engine.shutdown()
+
+
+if __name__ == '__main__':
+    main()
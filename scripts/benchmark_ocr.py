@@ -0,0 +1,178 @@
+"""
+Compares OCR time and accuracy with and without the ocr.py pre-processing.
+
+    python scripts/benchmark_ocr.py [--seed 7] [--save-corpus DIR] [--skip-raw]
+
+The corpus is generated rather than stored: lab-report pages are rendered
+from known text and then photographed badly - scaled up to a 12 MP phone
+photo, rotated, unevenly lit, noisy, and in two cases blurred past reading
+or left blank. The same seed gives the same images, and because the text on
+each page is known, character accuracy is 1 - edit distance / length.
+--save-corpus writes the images out as PNGs to look at.
+
+Needs the tesseract binary on PATH (or TESSERACT_CMD).
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocr  # noqa: E402
+
+PHOTO_SIZE = (4000, 3000)  # 12 MP, portrait below
+
+TESTS = [
+    ('Haemoglobin', 'g/dL', 13.0, 17.0), ('WBC count', '10^3/uL', 4.0, 11.0),
+    ('Platelets', '10^3/uL', 150, 450), ('Fasting glucose', 'mg/dL', 70, 100),
+    ('HbA1c', '%', 4.0, 5.6), ('Total cholesterol', 'mg/dL', 125, 200),
+    ('LDL cholesterol', 'mg/dL', 50, 130), ('HDL cholesterol', 'mg/dL', 40, 60),
+    ('Triglycerides', 'mg/dL', 50, 150), ('Creatinine', 'mg/dL', 0.7, 1.3),
+    ('Urea', 'mg/dL', 15, 40), ('TSH', 'mIU/L', 0.4, 4.0), ('Vitamin D', 'ng/mL', 30, 100),
+    ('Serum sodium', 'mmol/L', 135, 145), ('Serum potassium', 'mmol/L', 3.5, 5.1),
+]
+
+# (name, rotation degrees, lighting gradient, noise sigma, blur kernel, lines of text)
+SCENARIOS = [
+    ('clean', 0, 0.0, 0, 0, 14),
+    ('skew_4deg', 4, 0.0, 4, 0, 14),
+    ('skew_-7deg', -7, 0.1, 4, 0, 14),
+    ('shadow', 2, 0.55, 6, 0, 14),
+    ('noisy', -2, 0.2, 18, 0, 14),
+    ('soft_focus', 3, 0.2, 5, 9, 14),
+    ('single_line', 1, 0.1, 4, 0, 1),
+    ('motion_blur', 0, 0.1, 3, 81, 14),   # Expected to be rejected by the quality gate
+    ('blank_page', 0, 0.3, 3, 0, 0),      # Expected to be rejected by the quality gate
+]
+
+
+def report_lines(rng, count):
+    lines = [f"Patient ID: HX-{rng.randint(10000, 99999)}   Sample: Blood   Date: 2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}"]
+    for name, unit, low, high in rng.sample(TESTS, min(count - 1, len(TESTS))):
+        value = round(rng.uniform(low * 0.7, high * 1.3), 1)
+        flag = 'H' if value > high else 'L' if value < low else ''
+        lines.append(f"{name:<20} {value:>7} {unit:<8} ({low} - {high}) {flag}".rstrip())
+    return lines[:count]
+
+
+def render_page(lines, header):
+    """A clean A4 page at 150 DPI with the given lines."""
+    page = Image.new('L', (1240, 1754), 255)
+    draw = ImageDraw.Draw(page)
+    if header:
+        draw.text((90, 80), header, fill=0, font=ImageFont.load_default(size=34))
+    font = ImageFont.load_default(size=22)
+    for number, line in enumerate(lines):
+        draw.text((90, 200 + number * 44), line, fill=0, font=font)
+    return np.asarray(page)
+
+
+def photograph(page, rng, angle, gradient, noise, blur):
+    """The page as a badly taken 12 MP phone photo."""
+    height, width = PHOTO_SIZE
+    image = cv2.resize(page, (int(width * 0.9), int(height * 0.9)), interpolation=cv2.INTER_CUBIC)
+    canvas = np.full((height, width), 200, np.uint8)  # Desk behind the sheet
+    top, left = (height - image.shape[0]) // 2, (width - image.shape[1]) // 2
+    canvas[top:top + image.shape[0], left:left + image.shape[1]] = image
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    photo = cv2.warpAffine(canvas, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=200).astype(np.float32)
+
+    if gradient:
+        # Light falling off towards one corner
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+        photo *= 1.0 - gradient * (xs / width + ys / height) / 2
+    if blur:
+        kernel = np.zeros((blur, blur), np.float32)
+        kernel[blur // 2, :] = 1.0 / blur  # Horizontal motion / defocus smear
+        photo = cv2.filter2D(photo, -1, kernel)
+        photo = cv2.GaussianBlur(photo, (0, 0), blur / 6)
+    if noise:
+        photo += np.random.default_rng(rng.randint(0, 2**32 - 1)).normal(0, noise, photo.shape).astype(np.float32)
+    return np.clip(photo, 0, 255).astype(np.uint8)
+
+
+def build_corpus(seed):
+    rng = random.Random(seed)
+    corpus = []
+    for name, angle, gradient, noise, blur, line_count in SCENARIOS:
+        lines = report_lines(rng, line_count) if line_count else []
+        header = "CITY DIAGNOSTICS LABORATORY" if line_count > 1 else ""  # A one-line slip has no letterhead
+        page = render_page(lines, header)
+        expected = "\n".join(([header] if header else []) + lines)
+        corpus.append((name, photograph(page, rng, angle, gradient, noise, blur), expected))
+    return corpus
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def accuracy(expected, text):
+    # Layout whitespace isn't scored
+    expected, text = " ".join(expected.split()), " ".join(text.split())
+    if not expected:
+        return 1.0 if not text else 0.0
+    return max(0.0, 1 - edit_distance(expected, text) / len(expected))
+
+
+def run(image, expected, preprocess):
+    started = time.perf_counter()
+    try:
+        text = ocr.read_text(Image.fromarray(image), preprocess)
+        outcome = f"{accuracy(expected, text):6.1%}"
+    except ocr.UnreadableImageError as e:
+        text, outcome = "", f"rejected ({e})"
+    return time.perf_counter() - started, outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--save-corpus', metavar='DIR', help="also write the generated images to DIR")
+    parser.add_argument('--skip-raw', action='store_true', help="only run with pre-processing (raw 12 MP OCR is slow)")
+    args = parser.parse_args()
+
+    if os.getenv('TESSERACT_CMD'):
+        pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSERACT_CMD')
+    if not shutil.which(pytesseract.pytesseract.tesseract_cmd):
+        sys.exit("tesseract not found; install it or set TESSERACT_CMD.")
+
+    corpus = build_corpus(args.seed)
+    if args.save_corpus:
+        os.makedirs(args.save_corpus, exist_ok=True)
+        for name, image, _ in corpus:
+            cv2.imwrite(os.path.join(args.save_corpus, f"{name}.png"), image)
+
+    totals = {'raw': 0.0, 'prepared': 0.0}
+    print(f"{'image':<13} {'raw s':>7} {'raw acc':<10} {'prep s':>7} {'prep acc':<10} psm  skew")
+    for name, image, expected in corpus:
+        raw_seconds, raw_outcome = (0.0, '-') if args.skip_raw else run(image, expected, preprocess=False)
+        prepared_seconds, prepared_outcome = run(image, expected, preprocess=True)
+        totals['raw'] += raw_seconds
+        totals['prepared'] += prepared_seconds
+        try:
+            prepared = ocr.prepare(image)
+            layout = f"{prepared.psm:>3}  {prepared.skew_degrees:+.1f}"
+        except ocr.UnreadableImageError:
+            layout = "  -     -"
+        print(f"{name:<13} {raw_seconds:>7.2f} {raw_outcome:<10} {prepared_seconds:>7.2f} {prepared_outcome:<10} {layout}")
+
+    print(f"{'total':<13} {totals['raw']:>7.2f} {'':<10} {totals['prepared']:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
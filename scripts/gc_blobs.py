@@ -0,0 +1,57 @@
+"""
+Deletes stored blobs that no document references any more.
+
+    python scripts/gc_blobs.py [--grace-hours 24] [--dry-run]
+
+A blob whose refcount dropped to 0 at least `grace-hours` ago has its Blob
+row and its bytes removed. The row is deleted first, and only if it is still
+unreferenced, so a blob that was uploaded again in the meantime is kept. The
+bytes are deleted before that delete is committed: an upload of the same file
+waits for the row lock, then finds no row and stores the bytes again.
+Uses the app's database settings (DATABASE_URL).
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hospital_app  # noqa: E402
+from app import app, db, Blob  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--grace-hours', type=float, default=24)
+    parser.add_argument('--dry-run', action='store_true', help="only list what would be deleted")
+    args = parser.parse_args()
+
+    cutoff = datetime.utcnow() - timedelta(hours=args.grace_hours)
+    deleted = 0
+    with app.app_context():
+        candidates = [sha for (sha,) in db.session.query(Blob.sha256).filter(Blob.refcount <= 0, Blob.updated_at < cutoff)]
+        for sha in candidates:
+            if args.dry_run:
+                print(f"Would delete blob {sha}")
+                continue
+            removed = Blob.query.filter(Blob.sha256 == sha, Blob.refcount <= 0, Blob.updated_at < cutoff).delete(
+                synchronize_session=False)
+            if not removed:
+                db.session.rollback()
+                continue
+            try:
+                hospital_app.blob_store.delete(sha)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Could not delete blob {sha}, kept: {e}")
+                continue
+            db.session.commit()
+            deleted += 1
+
+    print(f"{len(candidates)} unreferenced blobs, {deleted} deleted.")
+    hospital_app.scheduler.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Moves documents stored before the blob store into it.
+
+    python scripts/import_uploads.py [--delete-originals] [--dry-run]
+
+For every PatientDocument whose file is still in UPLOAD_FOLDER, the file is
+streamed into the blob store and the document pointed at its blob. Documents
+that had no content hash yet also get one and are added to the integrity
+ledger. A file whose hash no longer matches the one recorded at upload is
+reported and left alone. Uses the app's database settings (DATABASE_URL).
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hospital_app  # noqa: E402
+from app import app, db, Blob, PatientDocument  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--delete-originals', action='store_true', help="remove each file from UPLOAD_FOLDER once imported")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would be imported")
+    args = parser.parse_args()
+
+    counts = {'imported': 0, 'already_stored': 0, 'missing': 0, 'mismatched': 0}
+    with app.app_context():
+        document_ids = [doc_id for (doc_id,) in db.session.query(PatientDocument.id).order_by(PatientDocument.id)]
+        for doc_id in document_ids:
+            doc = db.session.get(PatientDocument, doc_id)
+            legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], doc.filename)
+            if doc.content_hash and hospital_app.blob_store.exists(doc.content_hash):
+                counts['already_stored'] += 1
+                continue
+            if not os.path.isfile(legacy_path):
+                counts['missing'] += 1
+                print(f"Document {doc.id}: {legacy_path} not found.")
+                continue
+            if args.dry_run:
+                counts['imported'] += 1
+                continue
+
+            with open(legacy_path, 'rb') as f, hospital_app.blob_store.stage(f) as staged:
+                content_hash = staged.sha256
+                if doc.content_hash and doc.content_hash != content_hash:
+                    counts['mismatched'] += 1
+                    print(f"Document {doc.id}: {legacy_path} has changed since it was uploaded; not imported.")
+                    continue  # The staged copy is discarded, so nothing is left behind without a Blob row
+
+                if not doc.content_hash:
+                    blob = db.session.get(Blob, content_hash)
+                    if blob:
+                        blob.refcount += 1
+                    else:
+                        db.session.add(Blob(sha256=content_hash, refcount=1))
+                    doc.content_hash = content_hash
+                    db.session.commit()
+                    hospital_app.record_document_in_ledger(doc)
+                # Otherwise the Blob row (and its reference) was created when the ledger recorded the upload.
+                # Either way the reference is committed before the bytes are stored (see blobstore.py).
+                staged.store()
+                counts['imported'] += 1
+
+            if args.delete_originals:
+                os.remove(legacy_path)
+
+    print(", ".join(f"{count} {label.replace('_', ' ')}" for label, count in counts.items()))
+    hospital_app.scheduler.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Counts the SQL statements each dashboard and listing route issues, at two data sizes.
+
+    python scripts/query_counts.py [--rows 5] [--scale 10]
+
+Seeds a throwaway SQLite database (via DATABASE_URL), requests every route
+once with `rows` and once with `rows * scale` appointments, documents and
+medical records (each with its own doctor), and prints a per-endpoint
+report. Exits with status 1 if any route's statement count grows with the
+number of rows, i.e. something is lazy-loading per row.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime, time, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='query_counts_'), 'query_counts.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('LLM_PROVIDER', 'fake')  # Never call a real AI provider from here
+os.environ.pop('MAIL_SERVER', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import url_for  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import app as hospital_app  # noqa: E402
+from app import (app, db, Appointment, Doctor, Hospital, MedicalRecord, Patient,  # noqa: E402
+                 PatientDocument, PatientProfile)
+
+
+def seed(rows):
+    """Creates one patient with `rows` appointments, documents and records, each from a different doctor."""
+    db.drop_all()
+    db.create_all()
+    hospital_app.slot_index.clear()  # Bookings from the previous run are cached in memory
+    hospital = Hospital(name='General Hospital', email='hospital@example.com', address='1 Main St')
+    hospital.set_password('x')
+    patient = Patient(name='Test Patient', phone='9000000000', email='patient@example.com')
+    patient.set_password('2000-01-01')
+    db.session.add_all([hospital, patient])
+    db.session.flush()
+    profile = PatientProfile(profile_name='Main', patient_id=patient.id, date_of_birth=date(2000, 1, 1))
+    db.session.add(profile)
+
+    first_doctor = None
+    for i in range(rows):
+        # Separate doctors for documents and records, so loading one list can't warm the other's
+        doctor, uploader = [
+            Doctor(name=f'Doctor {i}{kind}', email=f'doctor{i}{kind}@example.com', phone=f'8{i:05d}{n}',
+                   specialization='General', hospital_id=hospital.id, password_hash='x')
+            for n, kind in enumerate('ab')
+        ]
+        db.session.add_all([doctor, uploader])
+        db.session.flush()
+        first_doctor = first_doctor or doctor
+
+        # Every upcoming appointment belongs to the first doctor (their dashboard lists them all);
+        # documents and records are spread over all doctors
+        appointment = Appointment(
+            patient_name=patient.name, patient_email=patient.email, patient_phone=patient.phone,
+            appointment_at=datetime.combine(date.today() + timedelta(days=1 + i), time(10)),
+            doctor_id=first_doctor.id, patient_id=patient.id
+        )
+        past = Appointment(
+            patient_name=patient.name, patient_email=patient.email, patient_phone=patient.phone,
+            appointment_at=datetime.combine(date.today() - timedelta(days=1 + i), time(10)),
+            doctor_id=doctor.id, patient_id=patient.id, status='Completed'
+        )
+        db.session.add_all([appointment, past])
+        db.session.flush()
+        db.session.add(PatientDocument(filename=f'{patient.id}_{i}_report.pdf', document_type='Report',
+                                       patient_id=patient.id, doctor_id=uploader.id))
+        db.session.add(MedicalRecord(notes='Notes', doctor_id=doctor.id, patient_id=patient.id,
+                                     appointment_id=past.id))
+
+    db.session.commit()
+    return first_doctor.id, patient.id, profile.id, appointment.id
+
+
+def login(client, user_id, user_type, profile_id=None):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['user_type'] = user_type
+        if profile_id:
+            sess['profile_id'] = profile_id
+
+
+def measure(rows):
+    """Returns {endpoint: statement count} for one request to each route."""
+    with app.app_context():
+        doctor_id, patient_id, profile_id, appointment_id = seed(rows)
+        engine = db.engine
+    # Requests run in their own app context, so nothing seeded above is in their session's identity map
+
+    requests_to_make = [
+        ('doctor_dashboard', 'doctor', doctor_id, None, 'GET', {}, None),
+        ('view_patient_details', 'doctor', doctor_id, None, 'GET',
+         {'patient_id': patient_id, 'appointment_id': appointment_id}, None),
+        ('patient_dashboard', 'patient', patient_id, profile_id, 'GET', {}, None),
+        ('list_patient_documents', 'patient', patient_id, profile_id, 'GET', {'patient_id': patient_id}, None),
+        ('list_patient_medical_records', 'doctor', doctor_id, None, 'GET', {'patient_id': patient_id}, None),
+        ('list_patient_appointments', 'patient', patient_id, profile_id, 'GET', {'patient_id': patient_id}, None),
+        ('book_appointment', None, None, None, 'POST', {}, {
+            'firstName': 'Test', 'lastName': 'Patient', 'phone': '9000000000',
+            'email': 'patient@example.com', 'date': (date.today() + timedelta(days=3)).isoformat(),
+            'time': '11:00 AM', 'doctorId': doctor_id
+        }),
+    ]
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        client = app.test_client()
+        counts = {}
+        for endpoint, user_type, user_id, profile, method, url_args, payload in requests_to_make:
+            with app.test_request_context():
+                url = url_for(endpoint, **url_args)
+            if user_type:
+                login(client, user_id, user_type, profile)
+            statements.clear()
+            response = client.open(url, method=method, json=payload)
+            if response.status_code >= 400:
+                raise SystemExit(f"{endpoint} returned {response.status_code}")
+            counts[endpoint] = len(statements)
+        return counts
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5)
+    parser.add_argument('--scale', type=int, default=10)
+    args = parser.parse_args()
+
+    small = measure(args.rows)
+    large = measure(args.rows * args.scale)
+    hospital_app.scheduler.shutdown(wait=False)
+
+    print(f"{'endpoint':<32}{args.rows:>10} rows{args.rows * args.scale:>10} rows")
+    failed = False
+    for endpoint in small:
+        grows = large[endpoint] > small[endpoint]
+        failed |= grows
+        print(f"{endpoint:<32}{small[endpoint]:>15}{large[endpoint]:>15}{'   <-- grows with rows' if grows else ''}")
+
+    hospital_app.extraction_engine.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Local SMTP server that accepts every message and throws it away, for
+testing the outbound email queue without a real mail server.
+
+    python scripts/smtp_sink.py [--port 1025] [--refuse-rate 0.0] [--save-dir DIR]
+
+Point the app at it with MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=false
+MAIL_DEFAULT_SENDER=noreply@example.com. The sink prints how many messages and
+connections it has received, and the delivery rate, every few seconds.
+`--refuse-rate` rejects that share of recipients (550), to exercise retries
+and dead-lettering.
+"""
+import argparse
+import os
+import random
+import socketserver
+import threading
+import time
+
+stats = {'messages': 0, 'connections': 0, 'refused': 0}
+stats_lock = threading.Lock()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        with stats_lock:
+            stats['connections'] += 1
+        self.reply("220 smtp-sink ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.reply("250-smtp-sink")
+                self.reply("250 8BITMIME")
+            elif verb == 'HELO':
+                self.reply("250 smtp-sink")
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                if random.random() < self.server.refuse_rate:
+                    with stats_lock:
+                        stats['refused'] += 1
+                    self.reply("550 Mailbox unavailable")
+                else:
+                    recipients.append(command)
+                    self.reply("250 OK")
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply("554 No valid recipients")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self.read_data()
+                with stats_lock:
+                    stats['messages'] += 1
+                    number = stats['messages']
+                if self.server.save_dir:
+                    with open(os.path.join(self.server.save_dir, f"{number:06d}.eml"), 'wb') as f:
+                        f.write(data)
+                self.reply("250 OK")
+            elif verb in ('RSET', 'NOOP'):
+                recipients = []
+                self.reply("250 OK")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--refuse-rate', type=float, default=0.0)
+    parser.add_argument('--save-dir', help="Write every message here as an .eml file")
+    parser.add_argument('--report-seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = SinkServer((args.host, args.port), SMTPHandler)
+    server.refuse_rate = args.refuse_rate
+    server.save_dir = args.save_dir
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"SMTP sink listening on {args.host}:{args.port}")
+
+    last_messages, last_time = 0, time.monotonic()
+    try:
+        while True:
+            time.sleep(args.report_seconds)
+            with stats_lock:
+                snapshot = dict(stats)
+            now = time.monotonic()
+            rate = (snapshot['messages'] - last_messages) / (now - last_time)
+            last_messages, last_time = snapshot['messages'], now
+            print(f"{snapshot['messages']} messages over {snapshot['connections']} connections, "
+                  f"{snapshot['refused']} recipients refused, {rate:.1f} messages/s")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Full-text search over a patient's documents and medical records.
+
+The index is an SQLite FTS5 database kept next to the app (a sidecar, like
+the text cache): an inverted index with BM25 ranking, snippets and
+highlighting built in, whatever database the app itself runs on.
+
+  entries     one row per indexed item: (kind, source_id) -> patient, date
+  entry_text  FTS5 table, rowid = entries.id, columns (patient, title, body)
+  watermarks  per kind, the highest source id indexed so far
+
+Every entry carries its patient as a token (`p<id>`) in the `patient`
+column, so a search is a single FTS query whose doclists are intersected
+with that patient's - it never scans other patients' matches. The patient
+column is weighted 0 in BM25, titles count twice as much as the body.
+
+Indexing is incremental: callers add or replace single entries, and the
+watermarks let a periodic job pick up only what is new. Deleting the file
+rebuilds the index from scratch on the following runs.
+"""
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SNIPPET_TOKENS = 16  # Words of context in a snippet
+_HIGHLIGHT_START, _HIGHLIGHT_END = '\x02', '\x03'  # Markers FTS5 wraps matches in; never in indexed text
+_PHRASE_OR_WORD = re.compile(r'"([^"]*)"|(\w+)(\*?)', re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    source_id INTEGER NOT NULL,
+    patient_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (kind, source_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entry_text USING fts5(
+    patient, title, body,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    kind TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+"""
+
+
+def match_expression(query):
+    """
+    Turns what a user typed into an FTS5 query: every word must match, "quoted
+    text" is a phrase, and a word ending in * matches as a prefix (gluc*).
+    Words are stemmed, so plurals and other endings match without it; prefix
+    terms cost roughly twice as much, which is why they are opt-in. Operators
+    and other syntax in the input are treated as plain words. Returns None if
+    the query has no words.
+    """
+    terms = []
+    for phrase, word, star in _PHRASE_OR_WORD.findall(query):
+        words = [word] if word else re.findall(r'\w+', phrase)
+        if words:
+            terms.append('"' + ' '.join(words) + '"' + star)
+    return ' '.join(terms) if terms else None
+
+
+def _strip_markers(marked):
+    """Splits FTS5 highlight markers out of `marked`: returns (text, [[start, end], ...])."""
+    text, highlights = [], []
+    position, start = 0, None
+    for part in re.split(f'([{_HIGHLIGHT_START}{_HIGHLIGHT_END}])', marked):
+        if part == _HIGHLIGHT_START:
+            start = position
+        elif part == _HIGHLIGHT_END:
+            if start is not None:
+                highlights.append([start, position])
+            start = None
+        else:
+            text.append(part)
+            position += len(part)
+    return ''.join(text), highlights
+
+
+def _clean(text):
+    return (text or '').replace(_HIGHLIGHT_START, ' ').replace(_HIGHLIGHT_END, ' ')
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()  # sqlite3 connections can't be shared between threads
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')  # Searches don't wait for the indexing job
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """A write transaction. IMMEDIATE takes the write lock up front, so two writers queue up
+        (busy timeout) instead of one failing when it upgrades from reading."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    # --- Indexing ---
+
+    def add(self, kind, source_id, patient_id, title, body, created_at):
+        """Indexes one item, replacing what was indexed for it before."""
+        with self._write() as conn:
+            row = conn.execute('SELECT id FROM entries WHERE kind = ? AND source_id = ?', (kind, source_id)).fetchone()
+            if row:
+                conn.execute('DELETE FROM entry_text WHERE rowid = ?', row)
+                conn.execute('UPDATE entries SET patient_id = ?, created_at = ? WHERE id = ?',
+                             (patient_id, created_at.isoformat(), row[0]))
+                entry_id = row[0]
+            else:
+                entry_id = conn.execute(
+                    'INSERT INTO entries (kind, source_id, patient_id, created_at) VALUES (?, ?, ?, ?)',
+                    (kind, source_id, patient_id, created_at.isoformat())
+                ).lastrowid
+            conn.execute('INSERT INTO entry_text (rowid, patient, title, body) VALUES (?, ?, ?, ?)',
+                         (entry_id, f'p{patient_id}', _clean(title), _clean(body)))
+
+    def remove(self, kind, source_id):
+        with self._write() as conn:
+            row = conn.execute('SELECT id FROM entries WHERE kind = ? AND source_id = ?', (kind, source_id)).fetchone()
+            if row:
+                conn.execute('DELETE FROM entry_text WHERE rowid = ?', row)
+                conn.execute('DELETE FROM entries WHERE id = ?', row)
+
+    def watermark(self, kind):
+        """The highest source id of this kind that the indexing job has covered (0 if none)."""
+        row = self._connection().execute('SELECT last_id FROM watermarks WHERE kind = ?', (kind,)).fetchone()
+        return row[0] if row else 0
+
+    def indexed_ids(self, kind, after_id):
+        """The source ids of this kind above `after_id` that are in the index."""
+        rows = self._connection().execute('SELECT source_id FROM entries WHERE kind = ? AND source_id > ?',
+                                          (kind, after_id))
+        return {source_id for (source_id,) in rows}
+
+    def set_watermark(self, kind, last_id):
+        with self._write() as conn:
+            conn.execute('INSERT INTO watermarks (kind, last_id) VALUES (?, ?) '
+                         'ON CONFLICT (kind) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)',
+                         (kind, last_id))
+
+    def optimize(self):
+        """Merges the FTS index segments; worth running after a large backfill."""
+        with self._write() as conn:
+            conn.execute("INSERT INTO entry_text (entry_text) VALUES ('optimize')")
+
+    # --- Searching ---
+
+    def search(self, patient_id, query, kinds=None, limit=20):
+        """
+        The patient's entries matching `query`, best first. Each result is a dict with
+        kind, source_id, created_at, score (BM25, higher is better), title, snippet,
+        and highlights: [start, end] character offsets of the matches in the snippet.
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        sql = (
+            "SELECT e.kind, e.source_id, e.created_at, bm25(entry_text, 0.0, 2.0, 1.0) AS rank, "
+            f"highlight(entry_text, 1, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}'), "
+            f"snippet(entry_text, 2, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}', '…', {SNIPPET_TOKENS}) "
+            "FROM entry_text JOIN entries e ON e.id = entry_text.rowid "
+            "WHERE entry_text MATCH ?"
+        )
+        params = [f'patient : p{int(patient_id)} AND {{title body}} : ({expression})']
+        if kinds:
+            sql += f" AND e.kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+
+        results = []
+        for kind, source_id, created_at, rank, marked_title, marked_snippet in self._connection().execute(sql, params):
+            title, title_highlights = _strip_markers(marked_title)
+            snippet, highlights = _strip_markers(marked_snippet)
+            results.append({
+                'kind': kind,
+                'source_id': source_id,
+                'created_at': created_at,
+                'score': round(-rank, 4),  # FTS5's bm25() is negated so that smaller sorts first
+                'title': title,
+                'title_highlights': title_highlights,
+                'snippet': snippet,
+                'highlights': highlights
+            })
+        return results
@@ -0,0 +1,215 @@
+"""
+Similarity cache for emergency chatbot answers.
+
+Messages are normalised (lower-cased, filler words dropped, a few spelling
+variants folded together) and embedded locally as TF-IDF weighted character
+n-grams, so "my kid swallowed a coin" and "kids swallowed coin what do i do"
+map to the same entry. A cached answer is only served for a message that
+says the same thing:
+
+  * words that change the medical meaning - negations, numbers and who the
+    patient is (infant, child, adult, pregnant...) - must match exactly,
+    since n-gram similarity barely notices "not breathing" vs "breathing"
+    or "2 pills" vs "20 pills"
+  * the rest must be identical after normalisation, or have a cosine
+    similarity of at least the (high) threshold
+
+Storing an entry does not refit the TF-IDF index. New entries are compared
+directly until a lookup refits the index - at most every REBUILD_SECONDS,
+or after REBUILD_PENDING new entries - and the refit runs outside the lock.
+
+Entries expire after a TTL and the least recently used ones are evicted
+once the cache is full.
+"""
+import itertools
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+REBUILD_SECONDS = 60
+REBUILD_PENDING = 100
+
+STOP_WORDS = set("""
+a an the my our your his her their i me we you he she it they is are was were be been am
+do does did what how should can could will would please help to of in on at for with and or
+so just now this that there if im its
+""".split())
+
+# Only spelling variants; words for different patients (baby, child, son...) are kept apart
+SYNONYMS = {
+    'kid': 'child', 'kids': 'child', 'children': 'child',
+    'swallow': 'swallowed', 'swallowing': 'swallowed', 'ate': 'swallowed',
+    'bleed': 'bleeding', 'bleeds': 'bleeding',
+    'burned': 'burn', 'burnt': 'burn', 'burns': 'burn',
+}
+
+NEGATIONS = set("""
+no not never none nothing without cant cannot couldnt dont doesnt didnt isnt arent wasnt werent wont
+hasnt havent hadnt nor neither unable stopped
+""".split())
+
+NUMBER_WORDS = set("""
+zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen sixteen
+seventeen eighteen nineteen twenty thirty forty fifty hundred thousand half dozen
+""".split())
+
+PATIENT_WORDS = set("""
+baby babies infant infants newborn toddler child son daughter teen teenager adult elderly pregnant
+man woman grandmother grandfather dog cat
+""".split())
+
+
+def normalize_message(message: str) -> str:
+    words = re.findall(r"[a-z0-9]+", message.lower().replace("'", "").replace("’", ""))
+    return ' '.join(SYNONYMS.get(word, word) for word in words if word not in STOP_WORDS)
+
+
+def key_terms(normalized: str) -> frozenset:
+    """The words that must match exactly for two messages to share an answer."""
+    return frozenset(word for word in normalized.split()
+                     if word in NEGATIONS or word in NUMBER_WORDS or word in PATIENT_WORDS or word.isdigit()
+                     or any(char.isdigit() for char in word))
+
+
+class CacheEntry:
+    def __init__(self, message, normalized, response, seq):
+        self.message = message
+        self.normalized = normalized
+        self.key_terms = key_terms(normalized)
+        self.response = response
+        self.seq = seq  # Order of storing, to tell which entries the fitted index covers
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class SemanticCache:
+    def __init__(self, threshold=0.95, ttl_seconds=24 * 3600, max_entries=2000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        # Hashing keeps the vocabulary open-ended, so entries can be added without refitting a vocabulary
+        self._vectorizer = HashingVectorizer(
+            analyzer='char_wb', ngram_range=(3, 5), n_features=2 ** 18, alternate_sign=False, norm=None
+        )
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalized message -> CacheEntry, least recently used first
+        self._seq = itertools.count(1)
+        self._index = None             # (entries in row order, TF-IDF transformer, row-normalised matrix)
+        self._pending = []             # Entries stored since the index was fitted
+        self._built_at = 0.0
+        self._rebuilding = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, message):
+        """Returns the CacheEntry for the most similar cached message, or None."""
+        normalized = normalize_message(message)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(normalized)  # Exact match after normalisation: skip the vector search
+            index, pending = self._index, list(self._pending)
+            rebuild = self._rebuild_due()
+
+        if entry is None and normalized and (index or pending):
+            entry = self._nearest(normalized, index, pending)
+        if rebuild:
+            self._rebuild()
+
+        with self._lock:
+            if entry is None or self._entries.get(entry.normalized) is not entry:  # Evicted in the meantime
+                self.misses += 1
+                return None
+            entry.hits += 1
+            self.hits += 1
+            self._entries.move_to_end(entry.normalized)
+            return entry
+
+    def store(self, message, response):
+        normalized = normalize_message(message)
+        if not normalized:
+            return
+        with self._lock:
+            entry = CacheEntry(message, normalized, response, next(self._seq))
+            self._entries[normalized] = entry
+            self._entries.move_to_end(normalized)
+            self._pending.append(entry)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            top = sorted(self._entries.values(), key=lambda e: e.hits, reverse=True)[:10]
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "top_entries": [{"message": e.message, "hits": e.hits} for e in top],
+            }
+
+    # --- Internals ---
+
+    def _expire(self):
+        """Called with the lock held. Expired entries may stay in the index; matches are checked against _entries."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry.created_at < cutoff]
+        for key in expired:
+            del self._entries[key]
+
+    def _rebuild_due(self):
+        """Called with the lock held; claims the rebuild for the caller if one is due."""
+        due = self._pending and (len(self._pending) >= REBUILD_PENDING
+                                 or time.monotonic() - self._built_at >= REBUILD_SECONDS)
+        if due and not self._rebuilding:
+            self._rebuilding = True
+            return True
+        return False
+
+    def _rebuild(self):
+        """Refits the TF-IDF index over the current entries. Runs without the lock, so lookups carry on."""
+        try:
+            with self._lock:
+                entries = list(self._entries.values())
+                indexed_seq = max((entry.seq for entry in entries), default=0)
+            index = None
+            if entries:
+                counts = self._vectorizer.transform([e.normalized for e in entries])
+                transformer = TfidfTransformer(sublinear_tf=True).fit(counts)
+                index = (entries, transformer, transformer.transform(counts))
+            with self._lock:
+                self._index = index
+                self._pending = [entry for entry in self._pending if entry.seq > indexed_seq]
+                self._built_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _nearest(self, normalized, index, pending):
+        query_terms = key_terms(normalized)
+        query_counts = self._vectorizer.transform([normalized])
+        candidates, rows = [], []
+
+        if index:
+            entries, transformer, matrix = index
+            candidates.extend(entries)
+            rows.append(matrix)
+        else:
+            transformer = TfidfTransformer(sublinear_tf=True).fit(query_counts)  # No IDF yet: plain TF cosine
+        if pending:
+            candidates.extend(pending)
+            rows.append(transformer.transform(self._vectorizer.transform([e.normalized for e in pending])))
+
+        query = transformer.transform(query_counts)
+        similarities = (sparse.vstack(rows) @ query.T).toarray().ravel()
+        best, best_similarity = None, self.threshold
+        for entry, similarity in zip(candidates, similarities):
+            if similarity >= best_similarity and entry.key_terms == query_terms:
+                best, best_similarity = entry, similarity
+        return best
@@ -0,0 +1,45 @@
+// Lazy loading for the paginated history lists (documents, records, appointments).
+// The server renders the first page and a "Load more" button carrying the listing
+// URL (data-url) and the cursor of the next page (data-cursor). The next page is
+// fetched when the button is clicked or scrolled into view; renderItem(item)
+// returns the HTML for one row, which is appended to `list`.
+function setupLoadMore(button, list, renderItem) {
+    if (!button || !list) return;
+
+    async function loadNextPage() {
+        if (button.disabled) return;
+        button.disabled = true;
+        try {
+            const url = new URL(button.dataset.url, window.location.origin);
+            url.searchParams.set('cursor', button.dataset.cursor);
+            const response = await fetch(url);
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.error);
+
+            list.insertAdjacentHTML('beforeend', data.items.map(renderItem).join(''));
+            if (data.next_cursor) {
+                button.dataset.cursor = data.next_cursor;
+                button.disabled = false;
+            } else {
+                observer.disconnect();
+                button.remove();
+            }
+        } catch (error) {
+            console.error('Error loading more items:', error);
+            button.disabled = false;
+        }
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+    });
+    observer.observe(button);
+    button.addEventListener('click', loadNextPage);
+}
+
+// Text from the listing APIs is user-provided; escape it before building HTML
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value == null ? '' : String(value);
+    return div.innerHTML;
+}
@@ -0,0 +1,55 @@
+// Reads the response of one of the streaming AI endpoints (/chat_response/stream,
+// /get_guide/stream, /ask_about_document/stream).
+// onText(textSoFar) is called every time a new chunk arrives, so the page can
+// re-render as the answer is written. Resolves with the complete text.
+// Plain JSON responses (validation errors, cached answers) are handled as well.
+async function readAIStream(response, onText) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.startsWith('text/event-stream')) {
+        const data = await response.json();
+        if (data.error) {
+            throw new Error(data.error);
+        }
+        const text = data.response || data.guide || data.analysis || '';
+        onText(text);
+        return text;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let fullText = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            const payload = data ? JSON.parse(data) : {};
+
+            if (eventName === 'error') {
+                throw new Error(payload.error || 'The AI service failed to respond.');
+            }
+            if (eventName === 'done') {
+                return fullText;
+            }
+            if (payload.text) {
+                fullText += payload.text;
+                onText(fullText);
+            }
+        }
+    }
+    return fullText;
+}
@@ -0,0 +1,228 @@
+"""
+Content-addressed cache for text extracted from uploaded documents.
+
+Entries are keyed on the SHA-256 of the file bytes, so the same scan is
+OCR'd once no matter how many routes (or filenames) point at it.
+
+There are two tiers:
+  - memory: an LRU dict bounded by the total size of the cached text
+  - disk:   one file per digest under `cache_dir`, bounded by total bytes,
+            evicted least-recently-used first (access time is tracked
+            through the file's mtime)
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Read files 1 MB at a time when hashing
+_HASH_MEMO_SIZE = 4096
+
+_hash_memo = OrderedDict()
+_hash_memo_lock = threading.Lock()
+
+
+def file_sha256(filepath: str) -> str:
+    """
+    Returns the hex SHA-256 of a file's contents.
+    Results are memoised on (path, size, mtime) so repeated lookups of an
+    unchanged file don't re-read it from disk.
+    """
+    stat = os.stat(filepath)
+    memo_key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+
+    with _hash_memo_lock:
+        digest = _hash_memo.get(memo_key)
+        if digest is not None:
+            _hash_memo.move_to_end(memo_key)
+            return digest
+
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _hash_memo_lock:
+        _hash_memo[memo_key] = digest
+        if len(_hash_memo) > _HASH_MEMO_SIZE:
+            _hash_memo.popitem(last=False)
+    return digest
+
+
+class TextCache:
+    """Two-tier (memory + disk) LRU cache of extracted document text."""
+
+    def __init__(self, cache_dir, max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # digest -> (text, size_in_bytes)
+        self._memory_bytes = 0
+        self._disk_bytes = self._scan_disk_usage()
+        self._inflight = {}  # digest -> lock held by the thread doing the extraction
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # --- Public API ---
+
+    def get(self, digest):
+        """Returns the cached text for a digest, or None. Counts as a hit or a miss."""
+        text = self._lookup(digest)
+        if text is None:
+            with self._lock:
+                self.misses += 1
+        return text
+
+    def put(self, digest, text):
+        """Stores text in both tiers."""
+        self._write_disk(digest, text)
+        self._remember(digest, text)
+
+    def get_or_extract(self, filepath, extract):
+        """
+        Returns the text of `filepath`, calling `extract(filepath)` only if no
+        tier has it. Concurrent callers for the same content wait for the one
+        extraction in progress instead of starting their own.
+        """
+        digest = file_sha256(filepath)
+        text = self.get(digest)
+        if text is not None:
+            return text
+
+        with self._lock:
+            key_lock = self._inflight.setdefault(digest, threading.Lock())
+
+        try:
+            with key_lock:
+                # Another thread may have finished the extraction while we waited
+                text = self._lookup(digest, count=False)
+                if text is None:
+                    text = extract(filepath)
+                    self.put(digest, text)
+                return text
+        finally:
+            with self._lock:
+                if self._inflight.get(digest) is key_lock:
+                    del self._inflight[digest]
+
+    def stats(self):
+        """Returns hit/miss counters and current tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- Internals ---
+
+    def _lookup(self, digest, count=True):
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None:
+                self._memory.move_to_end(digest)
+                if count:
+                    self.memory_hits += 1
+                return entry[0]
+
+        text = self._read_disk(digest)
+        if text is None:
+            return None
+
+        if count:
+            with self._lock:
+                self.disk_hits += 1
+        self._remember(digest, text)
+        return text
+
+    def _remember(self, digest, text):
+        size = len(text.encode('utf-8'))
+        if size > self.max_memory_bytes:
+            return  # Too large for the memory tier; the disk tier still has it
+
+        with self._lock:
+            old = self._memory.pop(digest, None)
+            if old is not None:
+                self._memory_bytes -= old[1]
+            self._memory[digest] = (text, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _path_for(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.txt")
+
+    def _read_disk(self, digest):
+        path = self._path_for(digest)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)  # Mark as recently used for LRU eviction
+            return text
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, digest, text):
+        path = self._path_for(digest)
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)  # Atomic, so readers never see a half-written file
+
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _scan_disk_usage(self):
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.txt'):
+                    total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def _evict_disk(self):
+        """Deletes least-recently-used files until the disk tier is at 90% of its budget."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.txt'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        target = int(self.max_disk_bytes * 0.9)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
@@ -0,0 +1,94 @@
+"""
+Per-request timing of the dependencies a request spends its time in.
+
+Code that calls out to a dependency wraps the call in a span:
+
+    with tracing.span('ocr'):
+        text = pytesseract.image_to_string(image)
+
+Every span is observed in the `dependency_seconds` histogram (labelled by
+dependency) and, if it runs inside a request, added to that request's
+Trace. app.py starts a Trace per request and can log its breakdown for
+slow requests, e.g. "sql=14x0.021s llm=1x3.402s".
+
+Spans outside a request (scheduler jobs, background pools) are only
+counted in the histogram. A span costs two perf_counter() calls and one
+histogram update, so it is cheap enough for every SQL statement.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+import metrics
+
+dependency_seconds = metrics.histogram(
+    'dependency_seconds',
+    'Time spent in calls to a dependency (sql, pdf, ocr, llm, smtp, geocode)',
+    buckets=metrics.LATENCY_BUCKETS
+)
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}  # dependency -> [count, total seconds]
+
+    def add(self, name, seconds):
+        totals = self.spans.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        """The spans as 'name=countxseconds' pairs, slowest first."""
+        spans = sorted(self.spans.items(), key=lambda item: item[1][1], reverse=True)
+        return " ".join(f"{name}={count}x{seconds:.3f}s" for name, (count, seconds) in spans) or "no spans"
+
+
+def start_trace():
+    """Starts a Trace for the current request (thread/context) and returns it."""
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace():
+    """Detaches and returns the current Trace, or None if there isn't one."""
+    trace = _current_trace.get()
+    _current_trace.set(None)
+    return trace
+
+
+def record_span(name, seconds):
+    """Records a span that was timed elsewhere."""
+    dependency_seconds.observe(seconds, dependency=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def instrument_sqlalchemy(engine):
+    """Records every statement `engine` executes as an 'sql' span."""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._span_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_span('sql', time.perf_counter() - context._span_started)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)